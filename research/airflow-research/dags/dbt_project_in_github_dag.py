@@ -1,40 +1,111 @@
 import datetime as dt
+from pathlib import Path
 
 import pendulum
 from airflow import DAG
+from airflow.decorators import task
+from airflow.models.param import Param
+from airflow.utils.trigger_rule import TriggerRule
 from airflow_dbt_python.operators.dbt import (
     DbtRunOperator,
     DbtSeedOperator,
     DbtTestOperator,
 )
 
+import dbt_project_cache
+
+DBT_REPO_URL = "https://github.com/dbt-labs/jaffle-shop-classic"
+# False goes back to letting every operator clone and parse the project from GitHub
+USE_CACHED_PROJECT = True
+
+
+def _templated_defer(operator):
+    """The operator with `defer` rendered from XCom too, it is only valid once state exists."""
+    return type(operator.__name__, (operator,), {"template_fields": (*operator.template_fields, "defer")})
+
+
 with DAG(
     dag_id="example_dbt_worflow_with_github",
     schedule=None,
     start_date=pendulum.today("UTC").add(days=-2),
     catchup=False,
     dagrun_timeout=dt.timedelta(minutes=60),
+    # `select` below is rendered from XCom as a list
+    render_template_as_native_obj=True,
+    params={
+        "git_ref": Param("HEAD", type="string"),
+        # only build models changed since the last successful run (and their children)
+        "slim": Param(True, type="boolean"),
+    },
 ) as dag:
-    # Project files will be pulled from "https://github.com/dbt-labs/jaffle-shop-classic"
-    dbt_seed = DbtSeedOperator(
+    if USE_CACHED_PROJECT:
+
+        @task
+        def prepare_dbt_project(**context) -> dict:
+            dag_id = context["dag"].dag_id
+            sha = dbt_project_cache.resolve_commit(DBT_REPO_URL, context["params"]["git_ref"])
+            project_dir = dbt_project_cache.checkout(DBT_REPO_URL, sha, lease=context["run_id"])
+            slim = context["params"]["slim"] and dbt_project_cache.has_state(dag_id)
+            return {
+                "sha": sha,
+                "project_dir": str(project_dir),
+                "state": str(dbt_project_cache.state_dir(dag_id)) if slim else None,
+                "select": ["state:modified+"] if slim else None,
+                # --defer without --state fails
+                "defer": slim,
+            }
+
+        @task
+        def save_dbt_state(project: dict, **context) -> None:
+            dbt_project_cache.save_state(Path(project["project_dir"]), context["dag"].dag_id)
+
+        @task(trigger_rule=TriggerRule.ALL_DONE)
+        def release_dbt_project(project: dict, **context) -> None:
+            dbt_project_cache.release(project["sha"], context["run_id"])
+            dbt_project_cache.prune()
+
+        project = prepare_dbt_project()
+        cached_kwargs = {
+            "project_dir": "{{ ti.xcom_pull(task_ids='prepare_dbt_project')['project_dir'] }}",
+            "state": "{{ ti.xcom_pull(task_ids='prepare_dbt_project')['state'] }}",
+            "select": "{{ ti.xcom_pull(task_ids='prepare_dbt_project')['select'] }}",
+            # unselected nodes resolve to the previous run's relations
+            "defer": "{{ ti.xcom_pull(task_ids='prepare_dbt_project')['defer'] }}",
+            # write target/ (partial_parse.msgpack, manifest.json) back into the cached checkout
+            "upload_dbt_project": True,
+            "replace_on_upload": True,
+        }
+        DbtSeed, DbtRun, DbtTest = (
+            _templated_defer(op) for op in (DbtSeedOperator, DbtRunOperator, DbtTestOperator)
+        )
+    else:
+        DbtSeed, DbtRun, DbtTest = DbtSeedOperator, DbtRunOperator, DbtTestOperator
+        # Project files will be pulled from "https://github.com/dbt-labs/jaffle-shop-classic"
+        cached_kwargs = {"project_dir": DBT_REPO_URL}
+
+    dbt_seed = DbtSeed(
         task_id="dbt_seed",
-        project_dir="https://github.com/dbt-labs/jaffle-shop-classic",
         target="github_connection",
         do_xcom_push_artifacts=["run_results.json"],
+        **cached_kwargs,
     )
 
-    dbt_run = DbtRunOperator(
+    dbt_run = DbtRun(
         task_id="dbt_run",
-        project_dir="https://github.com/dbt-labs/jaffle-shop-classic",
         target="github_connection",
         do_xcom_push_artifacts=["run_results.json"],
+        **cached_kwargs,
     )
 
-    dbt_test = DbtTestOperator(
+    dbt_test = DbtTest(
         task_id="dbt_test",
-        project_dir="https://github.com/dbt-labs/jaffle-shop-classic",
         target="github_connection",
         do_xcom_push_artifacts=["run_results.json"],
+        **cached_kwargs,
     )
 
     dbt_seed >> dbt_run >> dbt_test
+
+    if USE_CACHED_PROJECT:
+        project >> dbt_seed
+        dbt_test >> save_dbt_state(project) >> release_dbt_project(project)
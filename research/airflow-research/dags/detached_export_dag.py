@@ -0,0 +1,26 @@
+import datetime as dt
+
+import pendulum
+from airflow import DAG
+
+from detached_export import DetachedExportOperator
+
+gcs_bucket = "dev-duckdb-sink"
+psql_table = "b2x_checkout_transaction"
+
+with DAG(
+    dag_id="detached_export_full_table",
+    schedule=None,
+    start_date=pendulum.datetime(2025, 10, 1, tz="UTC"),
+    catchup=False,
+    dagrun_timeout=dt.timedelta(hours=12),
+) as dag:
+    # the COPY runs outside the worker, the task only occupies a triggerer coroutine while it runs
+    DetachedExportOperator(
+        task_id="export_full_table",
+        query=f"SELECT * FROM pg.public.{psql_table}",
+        target_uri=f"gs://{gcs_bucket}/{psql_table}/dt={{{{ ds }}}}/full.parquet",
+        progress_uri=f"gs://{gcs_bucket}/_exports/{{{{ dag.dag_id }}}}/{{{{ run_id }}}}/{psql_table}.json",
+        launcher="subprocess",
+        poll_interval=60,
+    )
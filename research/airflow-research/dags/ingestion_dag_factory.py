@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+from pathlib import Path
+
+import pendulum
+import yaml
+from airflow.decorators import dag, task
+from airflow.hooks.base import BaseHook
+from airflow.operators.python import get_current_context
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = Path(__file__).parent / "config" / "ingestion_tables.yaml"
+
+
+def postgres_dsn(conn_id: str) -> str:
+    """libpq connection string for duckdb's postgres extension from an Airflow connection."""
+    conn = BaseHook.get_connection(conn_id)
+    return (
+        f"host={conn.host} port={conn.port or 5432} dbname={conn.schema} "
+        f"user={conn.login} password={conn.password}"
+    )
+
+
+def duckdb_with_postgres(conn_id: str):
+    import duckdb
+
+    duck_conn = duckdb.connect()
+    duck_conn.sql(f"""
+        INSTALL postgres;
+        LOAD postgres;
+        ATTACH '{postgres_dsn(conn_id)}'
+        AS pg (TYPE POSTGRES, READ_ONLY);
+
+        INSTALL httpfs;
+        LOAD httpfs;
+
+        CREATE SECRET (
+            TYPE gcs,
+            KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+            SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+        );
+
+        SET memory_limit = '2GB';
+        SET threads TO 1;
+        SET preserve_insertion_order = false;
+    """)
+    return duck_conn
+
+
+def partition_uri(gcs_bucket: str, table: str, context) -> str:
+    etl_date = context["data_interval_end"].in_timezone("Asia/Jakarta").strftime("%Y-%m-%d")
+    return f"gs://{gcs_bucket}/{table}/dt={etl_date}"
+
+
+def clear_parts(partition: str) -> int:
+    """Removes the `part-*.parquet` files a previous run left in a dt= partition."""
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(partition)
+    fs.invalidate_cache(path)
+    stale = fs.glob(f"{path}/part-*.parquet")
+    if stale:
+        fs.rm(stale)
+    return len(stale)
+
+
+def build_ingestion_dag(
+    dag_id: str,
+    tables: list[dict],
+    postgres_conn_id: str,
+    gcs_bucket: str,
+    pool: str,
+    schedule: str | None = None,
+):
+    """Builds one ingestion DAG that maps over `tables` and then over id-range chunks.
+
+    Every non-empty chunk writes its own deterministic `part-<lo>-<hi>.parquet`, so retrying a
+    single mapped task instance overwrites exactly its own file and nothing else. The table's
+    parts in the dt= partition are cleared before it is split, so a rerun with other chunk
+    bounds (a larger max id, a new `chunk_ids`) leaves no stale parts behind. All tasks that
+    open a postgres connection run in `pool`, which caps concurrent connections no matter
+    how many chunks/tables/DAGs are active.
+    """
+
+    @dag(
+        dag_id=dag_id,
+        schedule=schedule,
+        start_date=pendulum.datetime(2025, 10, 1, tz="UTC"),
+        catchup=False,
+        max_active_runs=1,
+        dagrun_timeout=dt.timedelta(hours=12),
+        default_args={"retries": 3, "retry_delay": dt.timedelta(minutes=5)},
+        tags=["ingestion"],
+    )
+    def ingestion():
+        @task(pool=pool)
+        def split_id_ranges(table_cfg: dict) -> list[dict]:
+            schema, table = table_cfg["schema"], table_cfg["table"]
+            with duckdb_with_postgres(postgres_conn_id) as duck_conn:
+                min_id, max_id = duck_conn.sql(
+                    f"SELECT min(id), max(id) FROM pg.{schema}.{table}"
+                ).fetchone()
+
+            # before any chunk of this table is written, chunk retries don't come through here
+            partition = partition_uri(gcs_bucket, table, get_current_context())
+            logger.info(f"removed {clear_parts(partition)} part files from {partition}")
+
+            if min_id is None:
+                logger.info(f"{schema}.{table} is empty, nothing to ingest.")
+                return []
+
+            step = table_cfg.get("chunk_ids") or (max_id - min_id + 1)
+            chunks = [
+                {"schema": schema, "table": table, "lo": lo, "hi": min(lo + step - 1, max_id)}
+                for lo in range(min_id, max_id + 1, step)
+            ]
+            logger.info(f"{schema}.{table}: ids {min_id}..{max_id} split into {len(chunks)} chunks.")
+            return chunks
+
+        @task
+        def flatten(nested: list[list[dict]]) -> list[dict]:
+            return [chunk for chunks in nested for chunk in chunks]
+
+        @task(pool=pool, map_index_template="{{ chunk_label }}")
+        def ingest_chunk(chunk: dict) -> dict:
+            context = get_current_context()
+            schema, table, lo, hi = chunk["schema"], chunk["table"], chunk["lo"], chunk["hi"]
+            context["chunk_label"] = f"{table}[{lo}:{hi}]"
+
+            # same window as the scripts: yesterday 00:00 - today 00:00 Asia/Jakarta
+            psql_dstart = context["data_interval_start"].in_timezone("UTC").strftime("%Y-%m-%d %H:%M:%S")
+            psql_dend = context["data_interval_end"].in_timezone("UTC").strftime("%Y-%m-%d %H:%M:%S")
+
+            parquet_gcs_uri = f"{partition_uri(gcs_bucket, table, context)}/part-{lo:012d}-{hi:012d}.parquet"
+
+            data_query = f"""
+                SELECT * FROM pg.{schema}.{table}
+                WHERE id >= $lo AND id <= $hi
+                    AND created >= $psql_dstart AND created < $psql_dend
+
+                UNION ALL
+
+                SELECT * FROM pg.{schema}.{table}
+                WHERE id >= $lo AND id <= $hi
+                    AND last_updated >= $psql_dstart AND last_updated < $psql_dend
+            """
+            params = {"lo": lo, "hi": hi, "psql_dstart": psql_dstart, "psql_dend": psql_dend}
+
+            with duckdb_with_postgres(postgres_conn_id) as duck_conn:
+                logger.info(f"reading {table} ids {lo}..{hi}...")
+                duck_conn.sql(f"CREATE TEMP TABLE chunk AS {data_query}", params=params)
+                num_rows = duck_conn.sql("SELECT count(*) FROM chunk").fetchone()[0]
+                if not num_rows:
+                    logger.info(f"{table} ids {lo}..{hi} have no changes in the window, no part written.")
+                    return {**chunk, "uri": None, "rows": 0}
+
+                logger.info(f"copying {num_rows} rows to {parquet_gcs_uri}...")
+                duck_conn.sql(f"COPY chunk TO '{parquet_gcs_uri}' (FORMAT PARQUET, COMPRESSION zstd);")
+
+            logger.info(f"✅ {num_rows} rows written to {parquet_gcs_uri}")
+            return {**chunk, "uri": parquet_gcs_uri, "rows": num_rows}
+
+        chunks = flatten(split_id_ranges.expand(table_cfg=tables))
+        ingest_chunk.expand(chunk=chunks)
+
+    return ingestion()
+
+
+def load_dag_configs(path: Path = CONFIG_PATH) -> list[dict]:
+    with open(path) as f:
+        return yaml.safe_load(f)["dags"]
+
+
+for dag_config in load_dag_configs():
+    globals()[dag_config["dag_id"]] = build_ingestion_dag(**dag_config)
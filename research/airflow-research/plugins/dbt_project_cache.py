@@ -0,0 +1,160 @@
+"""Local, commit-addressed dbt project checkouts shared by every dbt task on a worker.
+
+Layout under `cache_root`:
+
+    projects/<commit sha>/        snapshot of the repo at that commit (no .git)
+    projects/<commit sha>/target/ partial_parse.msgpack + manifest.json written back by tasks
+    state/<dag_id>/               artifacts of the last successful run, used for `state:modified+`
+    leases/<commit sha>/<run id>  checkouts in use by a DAG run, `prune` leaves them alone
+
+`project_dir` is handed to the dbt tasks through XCom and they can run on any worker, so
+`cache_root` (DBT_PROJECT_CACHE) has to be storage every worker mounts, the dbt_cache volume
+in docker-compose.yaml or a ReadWriteMany volume on kubernetes.
+
+Checking out a new commit seeds its `target/` with the partial parse file of the newest
+existing checkout, so dbt only re-parses the files that changed between the two commits.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_ROOT = Path(os.getenv("DBT_PROJECT_CACHE", "/opt/airflow/dbt_cache"))
+STATE_ARTIFACTS = ("manifest.json", "run_results.json")
+# a lease older than this belongs to a run that died without releasing it
+LEASE_MAX_AGE_S = 6 * 3600
+
+
+@contextmanager
+def _lock(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def resolve_commit(repo_url: str, ref: str = "HEAD") -> str:
+    """Commit sha of `ref` on the remote without cloning anything."""
+    out = subprocess.run(
+        ["git", "ls-remote", repo_url, ref], check=True, capture_output=True, text=True
+    ).stdout.split()
+    if not out:
+        raise ValueError(f"ref `{ref}` not found in {repo_url}")
+    return out[0]
+
+
+def _newest_checkout(projects_dir: Path, exclude: str) -> Path | None:
+    checkouts = [
+        p for p in projects_dir.iterdir()
+        if p.is_dir() and not p.name.startswith(".") and p.name != exclude
+    ]
+    return max(checkouts, key=lambda p: p.stat().st_mtime, default=None)
+
+
+def _lease_path(cache_root: Path, sha: str, lease: str) -> Path:
+    return cache_root / "leases" / sha / lease.replace("/", "_")
+
+
+def checkout(repo_url: str, sha: str, cache_root: Path = DEFAULT_CACHE_ROOT, lease: str | None = None) -> Path:
+    """Returns the local checkout for `sha`, cloning it only if it is not cached yet.
+
+    With `lease` (e.g. the run id) the checkout is marked in use until `release` is called.
+    """
+    projects_dir = cache_root / "projects"
+    project_dir = projects_dir / sha
+    # under the lock, so `prune` can't remove the checkout between the check and the lease
+    with _lock(projects_dir / ".lock"):
+        if lease is not None:
+            path = _lease_path(cache_root, sha, lease)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+        if project_dir.exists():
+            logger.info(f"dbt project cache hit: {project_dir}")
+            # mtime is what `prune` uses as last-used time
+            os.utime(project_dir)
+            return project_dir
+
+        tmp_dir = projects_dir / f".tmp-{sha}-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        logger.info(f"dbt project cache miss, fetching {repo_url}@{sha[:12]}...")
+        subprocess.run(["git", "init", "-q", str(tmp_dir)], check=True)
+        subprocess.run(["git", "-C", str(tmp_dir), "fetch", "-q", "--depth", "1", repo_url, sha], check=True)
+        subprocess.run(["git", "-C", str(tmp_dir), "checkout", "-q", "FETCH_HEAD"], check=True)
+        shutil.rmtree(tmp_dir / ".git")
+
+        previous = _newest_checkout(projects_dir, exclude=sha)
+        if previous is not None and (previous / "target" / "partial_parse.msgpack").exists():
+            (tmp_dir / "target").mkdir(exist_ok=True)
+            shutil.copy2(previous / "target" / "partial_parse.msgpack", tmp_dir / "target")
+            logger.info(f"seeded partial parse state from {previous.name[:12]}")
+
+        os.rename(tmp_dir, project_dir)
+    return project_dir
+
+
+def release(sha: str, lease: str, cache_root: Path = DEFAULT_CACHE_ROOT) -> None:
+    _lease_path(cache_root, sha, lease).unlink(missing_ok=True)
+
+
+def _in_use(cache_root: Path, sha: str) -> bool:
+    leases = cache_root / "leases" / sha
+    if not leases.is_dir():
+        return False
+    now = time.time()
+    return any(now - p.stat().st_mtime < LEASE_MAX_AGE_S for p in leases.iterdir())
+
+
+def prune(cache_root: Path = DEFAULT_CACHE_ROOT, keep: int = 5) -> None:
+    """Drops all but the `keep` most recently used checkouts, never one with a live lease."""
+    projects_dir = cache_root / "projects"
+    with _lock(projects_dir / ".lock"):
+        checkouts = sorted(
+            (p for p in projects_dir.iterdir() if p.is_dir() and not p.name.startswith(".")),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+        for old in checkouts[keep:]:
+            if _in_use(cache_root, old.name):
+                continue
+            logger.info(f"pruning dbt project checkout {old.name[:12]}")
+            shutil.rmtree(old, ignore_errors=True)
+            shutil.rmtree(cache_root / "leases" / old.name, ignore_errors=True)
+
+
+def state_dir(dag_id: str, cache_root: Path = DEFAULT_CACHE_ROOT) -> Path:
+    return cache_root / "state" / dag_id
+
+
+def has_state(dag_id: str, cache_root: Path = DEFAULT_CACHE_ROOT) -> bool:
+    return (state_dir(dag_id, cache_root) / "manifest.json").exists()
+
+
+def save_state(project_dir: Path, dag_id: str, cache_root: Path = DEFAULT_CACHE_ROOT) -> Path:
+    """Keeps this run's artifacts as the comparison state for the next slim run."""
+    target = state_dir(dag_id, cache_root)
+    tmp = target.with_name(f".{target.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for artifact in STATE_ARTIFACTS:
+        src = Path(project_dir) / "target" / artifact
+        if src.exists():
+            shutil.copy2(src, tmp / artifact)
+
+    with _lock(target.parent / ".lock"):
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(tmp, target)
+    logger.info(f"saved dbt state for {dag_id} to {target}")
+    return target
@@ -0,0 +1,335 @@
+"""Long exports that don't hold a worker slot.
+
+The operator starts the export as a detached subprocess (Celery workers) or a single-pod Job
+(KubernetesExecutor, where the task pod goes away as soon as the task defers; the Job is
+garbage collected `pod_ttl_seconds` after it finishes) and then
+defers to `DetachedExportTrigger`. The export itself runs through `run_export` below, which
+heartbeats a small progress JSON to shared storage (a GCS/local path readable by the
+triggerer). When the JSON says `success`, the task resumes on a worker only to read the
+row and byte counts.
+
+Running the export by hand:
+
+    python detached_export.py --progress gs://bucket/_exports/x.json \
+        --target gs://bucket/table/dt=2025-10-08/000000.parquet \
+        --query "SELECT * FROM pg.public.b2x_users"
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Sequence
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+
+
+def write_progress(progress_uri: str, **progress: Any) -> None:
+    import fsspec
+
+    with fsspec.open(progress_uri, "w") as f:
+        json.dump({**progress, "heartbeat": time.time()}, f)
+
+
+def read_progress(progress_uri: str) -> dict | None:
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(progress_uri)
+    # gcsfs caches listings, without this a finished export can look "running" forever
+    fs.invalidate_cache(path)
+    if not fs.exists(path):
+        return None
+    with fs.open(path, "r") as f:
+        return json.load(f)
+
+
+def run_name(ti, limit: int = 63) -> str:
+    """export-<dag>-<task>-<map index>-<try>-<run id hash>, unique per task try and a valid pod name."""
+    suffix = f"{ti.map_index}-{ti.try_number}-{hashlib.sha1(ti.run_id.encode()).hexdigest()[:8]}"
+    prefix = re.sub(r"[^a-z0-9-]+", "-", f"export-{ti.dag_id}-{ti.task_id}".lower())
+    return f"{prefix[: limit - len(suffix) - 1].rstrip('-')}-{suffix}"
+
+
+def target_size(target_uri: str) -> int:
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(target_uri)
+    fs.invalidate_cache(path)
+    return fs.du(path) if fs.isdir(path) else fs.size(path)
+
+
+def count_parquet_rows(target_uri: str) -> int:
+    import duckdb
+
+    glob = target_uri if target_uri.endswith(".parquet") else f"{target_uri.rstrip('/')}/**/*.parquet"
+    with duckdb.connect() as duck_conn:
+        if target_uri.startswith("gs://"):
+            duck_conn.sql(f"""
+                INSTALL httpfs;
+                LOAD httpfs;
+                CREATE SECRET (
+                    TYPE gcs,
+                    KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+                    SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+                );
+            """)
+        # footer only, no data pages are read
+        return duck_conn.sql(
+            f"SELECT coalesce(sum(num_rows), 0) FROM parquet_file_metadata('{glob}')"
+        ).fetchone()[0]
+
+
+def run_export(
+    progress_uri: str,
+    target_uri: str,
+    query: str | None = None,
+    command: Sequence[str] | None = None,
+) -> None:
+    """Runs either a duckdb `COPY (query) TO target` or an arbitrary command (e.g. spark-submit)
+    and keeps `progress_uri` updated until it finishes."""
+    state: dict[str, Any] = {"status": "running", "percent": None, "error": None, "rows": None}
+
+    def _duckdb_copy() -> None:
+        import duckdb
+
+        with duckdb.connect() as duck_conn:
+            duck_conn.sql(f"""
+                INSTALL postgres;
+                LOAD postgres;
+                ATTACH '{os.getenv("PSQL_CONN")}'
+                AS pg (TYPE POSTGRES, READ_ONLY);
+
+                INSTALL httpfs;
+                LOAD httpfs;
+                CREATE SECRET (
+                    TYPE gcs,
+                    KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+                    SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+                );
+            """)
+            state["conn"] = duck_conn
+            copy_query = f"COPY ({query}) TO '{target_uri}' (FORMAT PARQUET, COMPRESSION zstd)"
+            state["rows"] = duck_conn.execute(copy_query).fetchone()[0]
+
+    def _command() -> None:
+        completed = subprocess.run(command, check=False)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{shlex.join(command)} exited with {completed.returncode}")
+
+    def _run() -> None:
+        try:
+            _duckdb_copy() if query else _command()
+            state["status"] = "success"
+        except Exception as e:
+            logger.error(f"export failed: {e}", exc_info=True)
+            state["status"], state["error"] = "failed", str(e)
+
+    worker = threading.Thread(target=_run, daemon=True)
+    worker.start()
+    while worker.is_alive():
+        if "conn" in state:
+            state["percent"] = state["conn"].query_progress()
+        write_progress(progress_uri, status="running", percent=state["percent"])
+        worker.join(HEARTBEAT_SECONDS)
+
+    if state["status"] == "success":
+        rows = state["rows"] if state["rows"] is not None else count_parquet_rows(target_uri)
+        write_progress(progress_uri, status="success", rows=rows, bytes=target_size(target_uri))
+    else:
+        write_progress(progress_uri, status="failed", error=state["error"])
+        sys.exit(1)
+
+
+class DetachedExportTrigger(BaseTrigger):
+    """Polls the export progress JSON until it reports `success`/`failed`.
+
+    A heartbeat older than `stale_after` seconds means the export process died without
+    writing a final status (OOM kill, node drain), which fails the task instead of waiting
+    forever.
+    """
+
+    def __init__(self, progress_uri: str, poll_interval: float = 30, stale_after: float = 600):
+        super().__init__()
+        self.progress_uri = progress_uri
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+
+    def serialize(self) -> tuple[str, dict[str, Any]]:
+        return (
+            "detached_export.DetachedExportTrigger",
+            {
+                "progress_uri": self.progress_uri,
+                "poll_interval": self.poll_interval,
+                "stale_after": self.stale_after,
+            },
+        )
+
+    async def run(self) -> AsyncIterator[TriggerEvent]:
+        started = time.time()
+        while True:
+            progress = await asyncio.to_thread(read_progress, self.progress_uri)
+            now = time.time()
+            if progress is None:
+                if now - started > self.stale_after:
+                    yield TriggerEvent({"status": "failed", "error": "export never started"})
+                    return
+            elif progress["status"] in ("success", "failed"):
+                yield TriggerEvent(progress)
+                return
+            elif now - progress["heartbeat"] > self.stale_after:
+                yield TriggerEvent({"status": "failed", "error": "export heartbeat is stale"})
+                return
+            else:
+                self.log.info(f"export running, progress: {progress.get('percent')}%")
+            await asyncio.sleep(self.poll_interval)
+
+
+class DetachedExportOperator(BaseOperator):
+    """Starts `run_export` outside the worker and defers until it is done.
+
+    Returns `{"target": ..., "rows": ..., "bytes": ...}` to XCom.
+
+    Args:
+        target_uri: parquet file or directory the export writes to
+        progress_uri: where the progress JSON lives, must be readable from the triggerer
+        query: duckdb query to `COPY` (the `pg` alias is attached from `PSQL_CONN`)
+        command: any other export command, e.g. `spark-submit ...`
+        launcher: `subprocess` (Celery workers) or `pod` (KubernetesExecutor)
+        pod_ttl_seconds: how long a finished export pod is kept for its logs
+    """
+
+    template_fields = ("target_uri", "progress_uri", "query", "command")
+
+    def __init__(
+        self,
+        *,
+        target_uri: str,
+        progress_uri: str,
+        query: str | None = None,
+        command: list[str] | None = None,
+        launcher: str = "subprocess",
+        namespace: str = "airflow",
+        image: str | None = None,
+        poll_interval: float = 30,
+        pod_ttl_seconds: int = 3600,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if (query is None) == (command is None):
+            raise ValueError("pass exactly one of `query` or `command`")
+        if launcher not in ("subprocess", "pod"):
+            raise ValueError(f"unknown launcher `{launcher}`")
+        self.target_uri = target_uri
+        self.progress_uri = progress_uri
+        self.query = query
+        self.command = command
+        self.launcher = launcher
+        self.namespace = namespace
+        self.image = image
+        self.poll_interval = poll_interval
+        self.pod_ttl_seconds = pod_ttl_seconds
+
+    def export_args(self) -> list[str]:
+        args = [sys.executable, os.path.abspath(__file__), "--progress", self.progress_uri, "--target", self.target_uri]
+        if self.query:
+            return args + ["--query", self.query]
+        return args + ["--", *self.command]
+
+    def launch_subprocess(self, context) -> None:
+        log_path = f"{os.getenv('AIRFLOW_HOME', '/opt/airflow')}/logs/detached_export/{run_name(context['ti'])}.log"
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        # own session so it survives the worker process handing the slot back; the child keeps
+        # its own copy of the log descriptor, the worker's is closed right after the fork
+        with open(log_path, "ab") as log:
+            proc = subprocess.Popen(
+                self.export_args(),
+                start_new_session=True,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        logger.info(f"export started as pid {proc.pid}, logs in {log_path}")
+
+    def launch_pod(self, context) -> None:
+        from kubernetes import client, config
+
+        config.load_incluster_config()
+        name = run_name(context["ti"])
+        args = self.export_args()
+        args[0:2] = ["python", "/opt/airflow/plugins/detached_export.py"]
+        labels = {"app": "detached-export"}
+        # a Job rather than a bare pod: ttl_seconds_after_finished cleans up finished pods
+        job = client.V1Job(
+            metadata=client.V1ObjectMeta(name=name, labels=labels),
+            spec=client.V1JobSpec(
+                backoff_limit=0,
+                ttl_seconds_after_finished=self.pod_ttl_seconds,
+                template=client.V1PodTemplateSpec(
+                    metadata=client.V1ObjectMeta(labels=labels),
+                    spec=client.V1PodSpec(
+                        restart_policy="Never",
+                        containers=[
+                            client.V1Container(
+                                name="export",
+                                image=self.image or os.getenv("AIRFLOW_IMAGE_NAME", "apache/airflow:2.10.5"),
+                                args=args,
+                                env_from=[
+                                    client.V1EnvFromSource(secret_ref=client.V1SecretEnvSource(name="ingestion-env"))
+                                ],
+                            )
+                        ],
+                    ),
+                ),
+            ),
+        )
+        client.BatchV1Api().create_namespaced_job(namespace=self.namespace, body=job)
+        logger.info(f"export started as job {self.namespace}/{name}")
+
+    def execute(self, context):
+        write_progress(self.progress_uri, status="starting")
+        if self.launcher == "pod":
+            self.launch_pod(context)
+        else:
+            self.launch_subprocess(context)
+
+        self.defer(
+            trigger=DetachedExportTrigger(self.progress_uri, poll_interval=self.poll_interval),
+            method_name="execute_complete",
+            timeout=timedelta(hours=12),
+        )
+
+    def execute_complete(self, context, event: dict):
+        if event["status"] != "success":
+            raise AirflowException(f"export to {self.target_uri} failed: {event.get('error')}")
+        logger.info(f"✅ export finished: {event['rows']} rows, {event['bytes']} bytes")
+        return {"target": self.target_uri, "rows": event["rows"], "bytes": event["bytes"]}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="run an export and heartbeat its progress")
+    parser.add_argument("--progress", required=True)
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--query")
+    parser.add_argument("command", nargs=argparse.REMAINDER)
+    cli_args = parser.parse_args()
+
+    command = cli_args.command[1:] if cli_args.command[:1] == ["--"] else cli_args.command
+    run_export(cli_args.progress, cli_args.target, query=cli_args.query, command=command or None)
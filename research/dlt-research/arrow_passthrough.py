@@ -0,0 +1,107 @@
+import logging
+from typing import Any, Dict, Iterator, Optional
+
+import dlt
+import numpy as np
+import pyarrow as pa
+from dlt.common.exceptions import MissingDependencyException
+from dlt.common.libs.pyarrow import py_arrow_to_table_schema_columns
+from dlt.sources.sql_database.helpers import BaseTableLoader, SelectClause
+
+logger = logging.getLogger(__name__)
+
+LOAD_ID_COLUMN = "_dlt_load_id"
+
+
+def load_id_column(load_id: str, num_rows: int) -> pa.DictionaryArray:
+    """Constant `_dlt_load_id` column without materializing `num_rows` strings.
+
+    The dictionary holds the load id once and the indices are a zeroed int8 buffer,
+    so the column costs one byte per row and is written as a single dictionary page
+    in parquet.
+    """
+    indices = pa.array(np.zeros(num_rows, dtype=np.int8))
+    return pa.DictionaryArray.from_arrays(indices, pa.array([load_id], type=pa.string()))
+
+
+class ArrowPassthroughTableLoader(BaseTableLoader):
+    """Streams record batches from postgres via ADBC and yields them untouched.
+
+    The default `pyarrow` backend fetches rows with sqlalchemy and transposes every row
+    tuple into columns (`row_tuples_to_arrow`). ADBC reads the `COPY ... BINARY` stream
+    straight into arrow buffers, so the only python work left is once per batch:
+    schema bookkeeping and (optionally) attaching the load id column.
+    """
+
+    def load_rows(self, backend_kwargs: Dict[str, Any] = None) -> Iterator[Any]:
+        backend_kwargs = dict(backend_kwargs or {})
+        query = self.make_query()
+        yield from self._load_record_batches(query, backend_kwargs)
+
+    def _load_record_batches(
+        self, query: SelectClause, backend_kwargs: Dict[str, Any]
+    ) -> Iterator[Any]:
+        try:
+            import adbc_driver_postgresql.dbapi as adbc
+        except ImportError:
+            raise MissingDependencyException(
+                "Arrow passthrough table loader", ["adbc-driver-postgresql"]
+            )
+
+        if self.engine.url.get_backend_name() != "postgresql":
+            raise ValueError(
+                f"arrow passthrough only supports postgres, got `{self.engine.url.get_backend_name()}`"
+            )
+
+        add_load_id = backend_kwargs.get("add_load_id", False)
+        load_id = dlt.current.load_package_state()["load_id"] if add_load_id else None
+
+        query_str = self.compile_query(query)
+        logger.info(f"Executing query on ADBC: {query_str}")
+
+        with adbc.connect(self.get_connection_url()) as conn:
+            with conn.cursor() as cursor:
+                if "batch_size_hint_bytes" in backend_kwargs:
+                    cursor.adbc_statement.set_options(
+                        **{
+                            "adbc.postgresql.batch_size_hint_bytes": str(
+                                backend_kwargs["batch_size_hint_bytes"]
+                            )
+                        }
+                    )
+                cursor.execute(query_str)
+                reader = cursor.fetch_record_batch()
+
+                last_schema: Optional[pa.Schema] = None
+                for batch in reader:
+                    if batch.num_rows == 0:
+                        continue
+                    if load_id is not None:
+                        batch = batch.append_column(
+                            LOAD_ID_COLUMN, load_id_column(load_id, batch.num_rows)
+                        )
+                    # slicing is zero-copy, it only moves offsets
+                    for offset in range(0, batch.num_rows, self.chunk_size):
+                        table = pa.Table.from_batches([batch.slice(offset, self.chunk_size)])
+                        if batch.schema != last_schema:
+                            last_schema = batch.schema
+                            yield dlt.mark.with_hints(
+                                table,
+                                dlt.mark.make_hints(
+                                    columns=py_arrow_to_table_schema_columns(last_schema)
+                                ),
+                            )
+                        else:
+                            yield table
+
+
+def configure_passthrough() -> None:
+    """Sets the dlt config so extracted parquet files are not rewritten by the normalizer.
+
+    Arrow items are written to parquet during extract. The normalizer only rewrites them
+    when it has to add `_dlt_load_id`/`_dlt_id` itself, otherwise files are moved as-is.
+    When `add_dlt_load_id` is wanted, pass `backend_kwargs={"add_load_id": True}` to the
+    resource instead so the column is added here, per batch.
+    """
+    dlt.config["normalize.parquet_normalizer.add_dlt_load_id"] = False
+    dlt.config["normalize.parquet_normalizer.add_dlt_id"] = False
@@ -0,0 +1,136 @@
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+import dlt
+import sqlalchemy as sa
+from dlt.sources.sql_database.arrow_helpers import row_tuples_to_arrow
+from dlt.sources.sql_database.helpers import SelectClause, TableLoader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# pg_stats.avg_width is the on-disk (possibly compressed) width, in memory rows are bigger
+PG_STATS_OVERHEAD = 3.0
+
+
+class ChunkSizer:
+    """Picks the next chunk size so one chunk fits into `memory_budget` bytes.
+
+    Row width starts from an estimate (pg_stats or a small probe chunk) and is then
+    smoothed with an EWMA of the observed bytes per row, so a table whose rows get
+    wider over time (e.g. JSON payloads) gets smaller chunks as it goes.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        initial_row_width: Optional[float] = None,
+        min_chunk_size: int = 1_000,
+        max_chunk_size: int = 500_000,
+        probe_chunk_size: int = 1_000,
+        alpha: float = 0.3,
+    ) -> None:
+        self.memory_budget = memory_budget
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.probe_chunk_size = probe_chunk_size
+        self.alpha = alpha
+        self.row_width = initial_row_width
+        self.history: List[int] = []
+
+    @property
+    def chunk_size(self) -> int:
+        if not self.row_width:
+            return self.probe_chunk_size
+        size = int(self.memory_budget / self.row_width)
+        return max(self.min_chunk_size, min(self.max_chunk_size, size))
+
+    def observe(self, num_rows: int, num_bytes: int) -> None:
+        if num_rows == 0:
+            return
+        width = num_bytes / num_rows
+        if self.row_width is None:
+            self.row_width = width
+        else:
+            self.row_width = self.alpha * width + (1 - self.alpha) * self.row_width
+
+    def trace(self) -> Dict[str, Any]:
+        return {
+            "memory_budget": self.memory_budget,
+            "row_width": round(self.row_width or 0, 1),
+            "chunk_sizes": self.history,
+            "min_chunk_size": min(self.history, default=None),
+            "max_chunk_size": max(self.history, default=None),
+        }
+
+
+def pg_stats_row_width(conn: sa.Connection, schema: str, table: str) -> Optional[float]:
+    """Average row width in bytes according to postgres statistics (None if not analyzed)."""
+    width = conn.execute(
+        sa.text(
+            "SELECT sum(avg_width) FROM pg_stats WHERE schemaname = :schema AND tablename = :table"
+        ),
+        {"schema": schema or "public", "table": table},
+    ).scalar()
+    return float(width) * PG_STATS_OVERHEAD if width else None
+
+
+class AutoChunkTableLoader(TableLoader):
+    """`TableLoader` that re-sizes every `fetchmany` from a memory budget.
+
+    `chunk_size` on the resource is ignored, set `memory_budget` (bytes) in `backend_kwargs`
+    instead. The chosen sizes are written to the resource custom metrics, so they show up
+    in `pipeline.last_trace` next to the extract step.
+    """
+
+    def _load_rows(
+        self, query: SelectClause, backend_kwargs: Dict[str, Any]
+    ) -> Iterator[Any]:
+        memory_budget = backend_kwargs.pop("memory_budget", DEFAULT_MEMORY_BUDGET)
+        tz = backend_kwargs.get("tz", "UTC")
+
+        with self.engine.connect() as conn:
+            initial_width = None
+            if self.engine.url.get_backend_name() == "postgresql":
+                initial_width = pg_stats_row_width(conn, self.table.schema, self.table.name)
+            sizer = ChunkSizer(memory_budget=memory_budget, initial_row_width=initial_width)
+            logger.info(
+                f"auto chunking {self.table.name}: budget={memory_budget} bytes, "
+                f"pg_stats row width={initial_width}, first chunk={sizer.chunk_size}"
+            )
+
+            result = conn.execution_options(stream_results=True).execute(query)
+            columns = list(result.keys())
+            for col_name in columns:
+                if col_name not in self.columns:
+                    self.columns[col_name] = {"name": col_name}
+            cursor_columns = {c: self.columns[c] for c in columns}
+
+            try:
+                while True:
+                    chunk_size = sizer.chunk_size
+                    rows = result.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    sizer.history.append(chunk_size)
+
+                    if self.backend == "pyarrow":
+                        item = row_tuples_to_arrow(
+                            [row._data for row in rows], columns=cursor_columns, tz=tz
+                        )
+                        sizer.observe(item.num_rows, item.nbytes)
+                    elif self.backend == "pandas":
+                        from dlt.common.libs.pandas_sql import _wrap_result
+
+                        item = _wrap_result(
+                            rows, columns, **{"dtype_backend": "pyarrow", **backend_kwargs}
+                        )
+                        sizer.observe(len(item), int(item.memory_usage(deep=True).sum()))
+                    else:
+                        # no cheap way to size python dicts, stick with the pg_stats estimate
+                        item = [dict(row._mapping) for row in rows]
+
+                    dlt.current.resource_metrics()["auto_chunk"] = sizer.trace()
+                    yield item
+            finally:
+                result.close()
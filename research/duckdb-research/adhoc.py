@@ -85,6 +85,16 @@ with duckdb.connect() as duck_conn:
 
     logging.info("setup done.")
 
+    ### opt-in local block cache for remote parquet, read lrucache://bucket/... instead of gs://bucket/...
+    if os.getenv("ADHOC_BLOCK_CACHE"):
+        from block_cache import LRUBlockCacheFileSystem
+
+        block_cache_fs = LRUBlockCacheFileSystem(
+            target_protocol="gs", max_bytes=int(os.getenv("ADHOC_BLOCK_CACHE_GB", "10")) * 1024**3
+        )
+        duck_conn.register_filesystem(block_cache_fs)
+        logging.info(f"block cache enabled: {block_cache_fs.cache.stats()}")
+
     main_query = f"""
         SELECT * FROM {duckdb_tbl}
     """
@@ -0,0 +1,252 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import duckdb
+import fsspec
+from dotenv import load_dotenv
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# On-disk read-through block cache for remote parquet, for adhoc DuckDB sessions
+# Remote files are read in fixed-size blocks; every block is stored on local disk keyed by
+# (path, version, block index), where version is the object's ETag/generation (mtime+size
+# for local files), so an overwritten object never serves stale blocks. The cache has a
+# size cap and evicts least-recently-used blocks. Register it with DuckDB and read through
+# `lrucache://` instead of `gs://`:
+#
+#     fs = LRUBlockCacheFileSystem(target_protocol="gs")
+#     duck_conn.register_filesystem(fs)
+#     duck_conn.sql("SELECT ... FROM read_parquet('lrucache://bucket/table/dt=2025-10-08/*.parquet')")
+#     print(fs.cache.stats())
+#
+# Local stand-ins: --target-protocol file for a directory, or s3 with a local MinIO
+# (--endpoint-url http://localhost:9000).
+#
+# python block_cache.py --path 'bucket/b2x_checkout_transaction/dt=2025-10-08/*.parquet' --repeat 3
+
+default_cache_dir = os.path.expanduser("~/.cache/duckdb-research/blocks")
+
+
+class BlockCache:
+    def __init__(self, cache_dir: str = default_cache_dir, max_bytes: int = 10 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS blocks (
+                key TEXT PRIMARY KEY,
+                path TEXT,
+                version TEXT,
+                block INTEGER,
+                size INTEGER,
+                last_access REAL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS blocks_lru ON blocks (last_access)")
+        self.db.commit()
+        self.hits = self.misses = self.evictions = 0
+        self.bytes_from_cache = self.bytes_from_remote = 0
+
+    @staticmethod
+    def _key(path: str, version: str, block: int) -> str:
+        return hashlib.sha256(f"{path}\0{version}\0{block}".encode()).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, path: str, version: str, block: int) -> bytes | None:
+        key = self._key(path, version, block)
+        with self.lock:
+            found = self.db.execute("SELECT 1 FROM blocks WHERE key = ?", (key,)).fetchone()
+            if found:
+                self.db.execute("UPDATE blocks SET last_access = ? WHERE key = ?", (time.time(), key))
+        if found:
+            try:
+                with open(self._file(key), "rb") as f:
+                    data = f.read()
+                with self.lock:
+                    self.hits += 1
+                    self.bytes_from_cache += len(data)
+                return data
+            except FileNotFoundError:
+                with self.lock:
+                    self.db.execute("DELETE FROM blocks WHERE key = ?", (key,))
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, path: str, version: str, block: int, data: bytes) -> None:
+        key = self._key(path, version, block)
+        file = self._file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, file)
+        with self.lock:
+            self.bytes_from_remote += len(data)
+            self.db.execute(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                (key, path, version, block, len(data), time.time()),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self) -> None:
+        total = self.db.execute("SELECT coalesce(sum(size), 0) FROM blocks").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM blocks ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM blocks WHERE key = ?", (key,))
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            for (key,) in self.db.execute("SELECT key FROM blocks").fetchall():
+                try:
+                    os.remove(self._file(key))
+                except FileNotFoundError:
+                    pass
+            self.db.execute("DELETE FROM blocks")
+            self.db.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            blocks, size = self.db.execute("SELECT count(*), coalesce(sum(size), 0) FROM blocks").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_from_cache": self.bytes_from_cache,
+                "bytes_from_remote": self.bytes_from_remote,
+                "evictions": self.evictions,
+                "cached_blocks": blocks,
+                "cached_bytes": size,
+            }
+
+
+class CachedFile(AbstractBufferedFile):
+    def __init__(self, fs, path, version: str, size: int, **kwargs):
+        # block alignment is done by the cache, no extra readahead buffer on top
+        super().__init__(fs, path, mode="rb", block_size=fs.cache_block_size, cache_type="none", size=size, **kwargs)
+        self.version = version
+
+    def _fetch_range(self, start: int, end: int) -> bytes:
+        bs = self.fs.cache_block_size
+        end = min(end, self.size)
+        out = []
+        for block in range(start // bs, (end - 1) // bs + 1):
+            data = self.fs.cache.get(self.path, self.version, block)
+            if data is None:
+                data = self.fs.target.cat_file(self.path, start=block * bs, end=min((block + 1) * bs, self.size))
+                self.fs.cache.put(self.path, self.version, block, data)
+            out.append(data)
+        first = (start // bs) * bs
+        return b"".join(out)[start - first : end - first]
+
+
+class LRUBlockCacheFileSystem(AbstractFileSystem):
+    protocol = "lrucache"
+
+    def __init__(
+        self,
+        target_protocol: str = "gs",
+        target_options: dict | None = None,
+        cache_dir: str = default_cache_dir,
+        max_bytes: int = 10 * 1024**3,
+        block_size: int = 4 * 1024**2,
+        info_ttl: float = 30.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.target = fsspec.filesystem(target_protocol, **(target_options or {}))
+        self.cache = BlockCache(cache_dir, max_bytes)
+        self.cache_block_size = block_size
+        # a HEAD per file per query would eat most of the win on small files, so object
+        # metadata is kept for a short while; an overwrite shows up after at most info_ttl
+        self.info_ttl = info_ttl
+        self._infos = {}
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = path[len("lrucache://"):] if path.startswith("lrucache://") else path
+        return path.rstrip("/")
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        cached = self._infos.get(path)
+        if cached and time.monotonic() - cached[0] < self.info_ttl:
+            return cached[1]
+        info = self.target.info(path, **kwargs)
+        self._infos[path] = (time.monotonic(), info)
+        return info
+
+    def ls(self, path, detail=True, **kwargs):
+        return self.target.ls(self._strip_protocol(path), detail=detail, **kwargs)
+
+    def modified(self, path):
+        # duckdb asks for it on every open to validate its own metadata cache
+        return self.target.modified(self._strip_protocol(path))
+
+    @staticmethod
+    def version_of(info: dict) -> str:
+        for field in ("etag", "ETag", "generation"):
+            if info.get(field):
+                return str(info[field]).strip('"')
+        return f"{info.get('mtime') or info.get('LastModified')}-{info['size']}"
+
+    def _open(self, path, mode="rb", **kwargs):
+        if mode != "rb":
+            raise NotImplementedError("lrucache:// is read-only")
+        info = self.info(path)
+        return CachedFile(self, self._strip_protocol(path), self.version_of(info), info["size"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="repeat a parquet scan through the block cache")
+    parser.add_argument("--path", required=True, help="path/glob without protocol, e.g. bucket/table/dt=2025-10-08/*.parquet")
+    parser.add_argument("--target-protocol", default="gs")
+    parser.add_argument("--endpoint-url", help="for s3 stand-ins like MinIO")
+    parser.add_argument("--query", default="SELECT count(*), max(hash(t)) FROM read_parquet('{path}') AS t")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=default_cache_dir)
+    parser.add_argument("--max-gb", type=float, default=10)
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    target_options = {"client_kwargs": {"endpoint_url": args.endpoint_url}} if args.endpoint_url else {}
+    fs = LRUBlockCacheFileSystem(
+        args.target_protocol,
+        target_options,
+        cache_dir=args.cache_dir,
+        max_bytes=int(args.max_gb * 1024**3),
+    )
+    if args.clear:
+        fs.cache.clear()
+
+    with duckdb.connect() as duck_conn:
+        duck_conn.register_filesystem(fs)
+        query = args.query.format(path=f"lrucache://{args.path}")
+        for n in range(1, args.repeat + 1):
+            tick = time.perf_counter()
+            result = duck_conn.sql(query).fetchall()
+            logger.info(f"run {n}: {time.perf_counter() - tick:.2f}s {result} {fs.cache.stats()}")
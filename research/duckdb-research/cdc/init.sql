@@ -0,0 +1,11 @@
+CREATE TABLE public.b2x_users (
+    id bigserial PRIMARY KEY,
+    email text,
+    status text,
+    created timestamp NOT NULL DEFAULT now(),
+    last_updated timestamp NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.b2x_users (email, status)
+SELECT 'user' || i || '@example.com', 'ACTIVE'
+FROM generate_series(1, 1000) AS i;
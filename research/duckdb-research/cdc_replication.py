@@ -0,0 +1,454 @@
+import argparse
+import json
+import logging
+import os
+import select
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+
+import duckdb
+import fsspec
+import psycopg2
+import psycopg2.extras
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# CDC alternative to the created/last_updated window queries.
+# Reads a logical replication slot (pgoutput by default, wal2json if the extension is
+# installed), turns the changes into arrow batches and writes them as parquet change files:
+#     {output}/{table}/changes/{first_commit_lsn}-{last_commit_lsn}-{first_seq}.parquet
+# named by commit lsn, which grows in the order pgoutput delivers transactions (change lsns of
+# a long transaction can be lower than those of files already compacted)
+# `compact` folds change files into a current-state snapshot:
+#     {output}/{table}/snapshot/{lsn}.parquet + {output}/{table}/snapshot/_current.json
+# The slot is only acknowledged after the change file is written, so a crash replays
+# changes instead of losing them (compaction dedups on _lsn/_seq).
+# Unchanged TOAST values of an UPDATE (listed in _toast_unchanged) are carried forward from
+# the id's previous row by `compact`.
+#
+# local test: docker compose -f cdc/docker-compose.yaml up -d
+# PSQL_CONN="host=localhost port=5433 dbname=cdc user=cdc password=cdc" \
+#     python cdc_replication.py setup --tables public.b2x_users
+# PSQL_CONN=... python cdc_replication.py stream --output ./cdc_out
+# python cdc_replication.py compact --output ./cdc_out --table b2x_users
+
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+META_COLUMNS = ["_op", "_lsn", "_seq", "_xid", "_commit_ts", "_toast_unchanged"]
+
+# pg type oid -> arrow type; everything else stays as the pg text representation
+PG_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1114: pa.timestamp("us"),
+}
+
+
+def lsn_str(lsn: int) -> str:
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+class PgOutputDecoder:
+    """Decodes pgoutput (protocol version 1) messages into row dicts.
+
+    Relation messages are cached by relid, they are sent before the first change of a
+    relation in every session and again after its schema changes.
+    """
+
+    def __init__(self):
+        self.relations: dict[int, dict] = {}
+        self.xid = None
+        self.commit_ts = None
+
+    @staticmethod
+    def _string(buf: bytes, pos: int) -> tuple[str, int]:
+        end = buf.index(b"\0", pos)
+        return buf[pos:end].decode(), end + 1
+
+    def _tuple(self, buf: bytes, pos: int, columns: list[dict]) -> tuple[dict, list[str], int]:
+        (ncols,) = struct.unpack_from(">h", buf, pos)
+        pos += 2
+        values, unchanged = {}, []
+        for col in columns[:ncols]:
+            kind = buf[pos : pos + 1]
+            pos += 1
+            if kind == b"n":
+                values[col["name"]] = None
+            elif kind == b"u":
+                # unchanged TOAST value, not sent by postgres
+                values[col["name"]] = None
+                unchanged.append(col["name"])
+            else:
+                (length,) = struct.unpack_from(">i", buf, pos)
+                pos += 4
+                values[col["name"]] = buf[pos : pos + length].decode()
+                pos += length
+        return values, unchanged, pos
+
+    def decode(self, buf: bytes) -> dict | None:
+        kind = buf[:1]
+        if kind == b"B":
+            _, ts, self.xid = struct.unpack_from(">qqi", buf, 1)
+            self.commit_ts = PG_EPOCH + timedelta(microseconds=ts)
+        elif kind == b"C":
+            return {"kind": "commit"}
+        elif kind == b"R":
+            (relid,) = struct.unpack_from(">i", buf, 1)
+            namespace, pos = self._string(buf, 5)
+            name, pos = self._string(buf, pos)
+            pos += 1  # replica identity setting
+            (ncols,) = struct.unpack_from(">h", buf, pos)
+            pos += 2
+            columns = []
+            for _ in range(ncols):
+                flags = buf[pos]
+                col_name, pos = self._string(buf, pos + 1)
+                type_oid, _ = struct.unpack_from(">ii", buf, pos)
+                pos += 8
+                columns.append({"name": col_name, "type_oid": type_oid, "key": bool(flags & 1)})
+            self.relations[relid] = {"schema": namespace, "table": name, "columns": columns}
+        elif kind in (b"I", b"U", b"D"):
+            (relid,) = struct.unpack_from(">i", buf, 1)
+            relation = self.relations[relid]
+            pos = 5
+            old_values = None
+            if kind in (b"U", b"D") and buf[pos : pos + 1] in (b"K", b"O"):
+                old_values, _, pos = self._tuple(buf, pos + 1, relation["columns"])
+            values, unchanged = old_values, []
+            if kind != b"D":
+                # skip the 'N' marker
+                values, unchanged, pos = self._tuple(buf, pos + 1, relation["columns"])
+            return {
+                "kind": "change",
+                "relation": relation,
+                "_op": kind.decode(),
+                "_xid": self.xid,
+                "_commit_ts": self.commit_ts,
+                "_toast_unchanged": unchanged,
+                "values": values,
+            }
+        elif kind == b"T":
+            logger.warning("TRUNCATE received, it is not replicated into change files.")
+        return None
+
+
+class Wal2JsonDecoder:
+    """Decodes wal2json `format-version 2` messages (one JSON object per change)."""
+
+    def __init__(self):
+        self.relations: dict[tuple, dict] = {}
+        self.xid = None
+        self.commit_ts = None
+
+    def decode(self, buf: bytes) -> dict | None:
+        msg = json.loads(buf)
+        action = msg["action"]
+        if action == "B":
+            self.xid = msg.get("xid")
+            self.commit_ts = datetime.fromisoformat(msg["timestamp"]) if "timestamp" in msg else None
+        elif action == "C":
+            return {"kind": "commit"}
+        elif action in ("I", "U", "D"):
+            cols = msg.get("columns") or msg.get("identity") or []
+            key = (msg["schema"], msg["table"])
+            relation = self.relations.setdefault(
+                key,
+                {
+                    "schema": msg["schema"],
+                    "table": msg["table"],
+                    "columns": [{"name": c["name"], "type_oid": None, "key": False} for c in cols],
+                },
+            )
+            values = {c["name"]: None if c["value"] is None else str(c["value"]) for c in cols}
+            for c in cols:
+                if c["name"] not in {col["name"] for col in relation["columns"]}:
+                    relation["columns"].append({"name": c["name"], "type_oid": None, "key": False})
+            return {
+                "kind": "change",
+                "relation": relation,
+                "_op": action,
+                "_xid": self.xid,
+                "_commit_ts": self.commit_ts,
+                "_toast_unchanged": [],
+                "values": values,
+            }
+        return None
+
+
+def changes_to_arrow(relation: dict, changes: list[dict]) -> pa.Table:
+    """Column-wise build of one table's buffered changes, values are cast per column."""
+    data = {
+        "_op": pa.array([c["_op"] for c in changes], pa.string()),
+        "_lsn": pa.array([c["_lsn"] for c in changes], pa.uint64()),
+        "_seq": pa.array([c["_seq"] for c in changes], pa.uint32()),
+        "_xid": pa.array([c["_xid"] for c in changes], pa.int64()),
+        "_commit_ts": pa.array([c["_commit_ts"] for c in changes], pa.timestamp("us", tz="UTC")),
+        "_toast_unchanged": pa.array([c["_toast_unchanged"] for c in changes], pa.list_(pa.string())),
+    }
+    for col in relation["columns"]:
+        raw = pa.array([(c["values"] or {}).get(col["name"]) for c in changes], pa.string())
+        arrow_type = PG_TYPES.get(col["type_oid"])
+        if arrow_type == pa.bool_():
+            raw = pc.equal(raw, "t")
+        elif arrow_type is not None:
+            raw = pc.cast(raw, arrow_type)
+        data[col["name"]] = raw
+    return pa.table(data)
+
+
+class ChangeFileWriter:
+    """Buffers changes per table and flushes them to parquet on size/time thresholds.
+
+    Changes wait in `pending` until their transaction commits, so a flush never writes part
+    of a transaction.
+    """
+
+    def __init__(self, output: str, batch_rows: int = 50_000, flush_seconds: int = 60):
+        self.output = output.rstrip("/")
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.buffers: dict[str, tuple[dict, list]] = {}
+        self.pending: list[dict] = []
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, change: dict) -> None:
+        self.pending.append(change)
+
+    def commit(self, commit_lsn: int) -> None:
+        for change in self.pending:
+            change["_commit_lsn"] = commit_lsn
+            relation = change["relation"]
+            buffered = self.buffers.get(relation["table"])
+            if buffered is not None and buffered[0] is not relation:
+                # a RELATION message changed the columns, rows decoded with the old ones go out first
+                self._write(relation["table"], *buffered)
+                del self.buffers[relation["table"]]
+            self.buffers.setdefault(relation["table"], (relation, []))[1].append(change)
+            self.buffered += 1
+        self.pending = []
+
+    def should_flush(self) -> bool:
+        return self.buffered >= self.batch_rows or (
+            self.buffered and time.monotonic() - self.last_flush >= self.flush_seconds
+        )
+
+    def _write(self, table_name: str, relation: dict, rows: list[dict]) -> None:
+        table = changes_to_arrow(relation, rows)
+        first_lsn, last_lsn = rows[0]["_commit_lsn"], rows[-1]["_commit_lsn"]
+        path = f"{self.output}/{table_name}/changes/{first_lsn:016X}-{last_lsn:016X}-{rows[0]['_seq']:08X}.parquet"
+        fs, fs_path = fsspec.core.url_to_fs(path)
+        fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+        with fs.open(fs_path, "wb") as f:
+            pq.write_table(table, f, compression="zstd")
+        logger.info(f"{table_name}: {table.num_rows} changes committed [{lsn_str(first_lsn)}, {lsn_str(last_lsn)}] -> {path}")
+
+    def flush(self) -> None:
+        """Writes the committed changes, pending ones stay for their commit."""
+        for table_name, (relation, rows) in self.buffers.items():
+            if rows:
+                self._write(table_name, relation, rows)
+        self.buffers.clear()
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+
+def setup(tables: list[str], slot: str, publication: str, plugin: str) -> None:
+    """Creates the publication (pgoutput) and the replication slot if they don't exist."""
+    with psycopg2.connect(os.getenv("PSQL_CONN")) as conn, conn.cursor() as cur:
+        conn.autocommit = True
+        if plugin == "pgoutput":
+            cur.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (publication,))
+            if cur.fetchone() is None:
+                cur.execute(f"CREATE PUBLICATION {publication} FOR TABLE {', '.join(tables)}")
+                logger.info(f"publication {publication} created for {tables}")
+        cur.execute("SELECT 1 FROM pg_replication_slots WHERE slot_name = %s", (slot,))
+        if cur.fetchone() is None:
+            cur.execute("SELECT pg_create_logical_replication_slot(%s, %s)", (slot, plugin))
+            logger.info(f"replication slot {slot} ({plugin}) created")
+
+
+def stream(
+    output: str,
+    slot: str,
+    publication: str,
+    plugin: str,
+    batch_rows: int = 50_000,
+    flush_seconds: int = 60,
+    max_seconds: float | None = None,
+) -> None:
+    conn = psycopg2.connect(
+        os.getenv("PSQL_CONN"), connection_factory=psycopg2.extras.LogicalReplicationConnection
+    )
+    cur = conn.cursor()
+    if plugin == "pgoutput":
+        decoder = PgOutputDecoder()
+        options = {"proto_version": "1", "publication_names": publication}
+    else:
+        decoder = Wal2JsonDecoder()
+        options = {"format-version": "2", "include-xids": "1", "include-timestamp": "1"}
+    cur.start_replication(slot_name=slot, decode=False, options=options)
+    logger.info(f"streaming slot {slot} ({plugin}) into {output}...")
+
+    writer = ChangeFileWriter(output, batch_rows, flush_seconds)
+    started = time.monotonic()
+    last_commit_lsn = 0
+    seq = 0
+    try:
+        while max_seconds is None or time.monotonic() - started < max_seconds:
+            msg = cur.read_message()
+            if msg is None:
+                if writer.should_flush():
+                    writer.flush()
+                    cur.send_feedback(flush_lsn=last_commit_lsn)
+                select.select([cur], [], [], 1.0)
+                continue
+
+            event = decoder.decode(msg.payload)
+            if event is None:
+                continue
+            if event["kind"] == "commit":
+                last_commit_lsn = msg.data_start
+                writer.commit(last_commit_lsn)
+                # only committed changes are flushed, so acked lsn == written data
+                if writer.should_flush():
+                    writer.flush()
+                    cur.send_feedback(flush_lsn=last_commit_lsn)
+                continue
+
+            seq += 1
+            event["_lsn"], event["_seq"] = msg.data_start, seq % 2**32
+            writer.add(event)
+    finally:
+        if writer.buffered:
+            writer.flush()
+            cur.send_feedback(flush_lsn=last_commit_lsn, force=True)
+        conn.close()
+
+
+def compact(output: str, psql_table: str, delete_compacted: bool = False) -> None:
+    """Folds change files newer than the current snapshot into a new snapshot.
+
+    Latest change per id wins (ordered by _lsn, _seq), ids whose latest change is a delete
+    are dropped. Columns an UPDATE left as unchanged TOAST take the id's previous value.
+    Only the change files not yet covered by `_current.json` are read.
+    """
+    root = f"{output.rstrip('/')}/{psql_table}"
+    fs, fs_root = fsspec.core.url_to_fs(root)
+    manifest_path = f"{fs_root}/snapshot/_current.json"
+    manifest = json.loads(fs.cat(manifest_path)) if fs.exists(manifest_path) else {"snapshot": None, "lsn": 0, "files": []}
+
+    def last_lsn(path: str) -> int:
+        return int(path.rsplit("/", 1)[1].split("-")[1].split(".")[0], 16)
+
+    # file names are {first_commit_lsn}-{last_commit_lsn}-{first_seq}.parquet
+    new_files = [
+        f"{root}{f[len(fs_root):]}"
+        for f in sorted(fs.glob(f"{fs_root}/changes/*.parquet"))
+        if last_lsn(f) > manifest["lsn"]
+    ]
+    if not new_files:
+        logger.info(f"{psql_table}: snapshot is up to date.")
+        return
+
+    new_lsn = max(last_lsn(f) for f in new_files)
+    snapshot_path = f"{root}/snapshot/{new_lsn:016X}.parquet"
+    fs.makedirs(f"{fs_root}/snapshot", exist_ok=True)
+
+    changes_sql = ", ".join(f"'{f}'" for f in new_files)
+    previous_sql = ""
+    if manifest["snapshot"]:
+        # previous snapshot rows rank below any change (lsn 0)
+        previous_sql = f"""
+            UNION ALL BY NAME
+            SELECT *, 'S' AS _op, 0::UBIGINT AS _lsn, 0::UINTEGER AS _seq
+            FROM read_parquet('{manifest["snapshot"]}')
+        """
+
+    with duckdb.connect() as duck_conn:
+        duck_conn.execute(f"""
+            CREATE TEMP VIEW changes AS
+            SELECT * FROM read_parquet([{changes_sql}], union_by_name = true)
+            {previous_sql}
+        """)
+        toasted = [
+            r[0] for r in duck_conn.execute(
+                "SELECT DISTINCT unnest(_toast_unchanged) FROM changes WHERE len(_toast_unchanged) > 0"
+            ).fetchall()
+        ]
+        # last value the column really had, wrapped in a struct so a real NULL still counts
+        carried = ", ".join(
+            f"(last_value(CASE WHEN list_contains(coalesce(_toast_unchanged, []), '{c}') THEN NULL "
+            f"ELSE {{'v': \"{c}\"}} END IGNORE NULLS) OVER history).v AS \"{c}\""
+            for c in toasted
+        )
+        replace = f"REPLACE ({carried})" if toasted else ""
+        duck_conn.execute(f"""
+            CREATE TEMP TABLE latest AS
+            SELECT * {replace}
+            FROM changes
+            WINDOW history AS (PARTITION BY id ORDER BY _lsn, _seq ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+            QUALIFY row_number() OVER (PARTITION BY id ORDER BY _lsn DESC, _seq DESC) = 1
+                AND _op != 'D'
+        """)
+        if toasted:
+            (missing,) = duck_conn.execute(f"""
+                SELECT count(*) FROM latest
+                WHERE list_has_any(coalesce(_toast_unchanged, []), {toasted})
+                    AND ({" OR ".join(f'"{c}" IS NULL' for c in toasted)})
+            """).fetchone()
+            if missing:
+                logger.warning(
+                    f"{psql_table}: {missing} rows have unchanged TOAST columns {toasted} without an earlier value, "
+                    f"left NULL (set REPLICA IDENTITY FULL or start from a full snapshot)"
+                )
+        rows = duck_conn.execute(f"""
+            COPY (
+                SELECT * EXCLUDE ({", ".join(META_COLUMNS)}) FROM latest ORDER BY id
+            ) TO '{snapshot_path}' (FORMAT PARQUET, COMPRESSION zstd)
+        """).fetchone()[0]
+
+    fs.pipe(manifest_path, json.dumps({"snapshot": snapshot_path, "lsn": new_lsn, "files": new_files}).encode())
+    logger.info(f"✅ {psql_table}: {len(new_files)} change files compacted into {snapshot_path} ({rows} rows)")
+
+    if delete_compacted:
+        fs.rm([f"{fs_root}{f[len(root):]}" for f in new_files])
+        if manifest["snapshot"]:
+            fs.rm(f"{fs_root}{manifest['snapshot'][len(root):]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="postgres logical replication CDC")
+    parser.add_argument("command", choices=["setup", "stream", "compact"])
+    parser.add_argument("--tables", nargs="*", default=[], help="schema.table list for the publication")
+    parser.add_argument("--table", help="table to compact")
+    parser.add_argument("--output", default=f"gs://{os.getenv('GCS_BUCKET')}/cdc")
+    parser.add_argument("--slot", default="duckdb_ingest")
+    parser.add_argument("--publication", default="duckdb_ingest_pub")
+    parser.add_argument("--plugin", choices=["pgoutput", "wal2json"], default="pgoutput")
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    parser.add_argument("--flush-seconds", type=int, default=60)
+    parser.add_argument("--max-seconds", type=float)
+    parser.add_argument("--delete-compacted", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "setup":
+        setup(args.tables, args.slot, args.publication, args.plugin)
+    elif args.command == "stream":
+        stream(
+            args.output, args.slot, args.publication, args.plugin,
+            args.batch_rows, args.flush_seconds, args.max_seconds,
+        )
+    else:
+        compact(args.output, args.table, args.delete_compacted)
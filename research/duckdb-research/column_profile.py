@@ -0,0 +1,151 @@
+import base64
+import json
+import logging
+import zlib
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Column profiles computed on the arrow batches the writer already has in memory, so the
+# metrics DQOps patterns check (tutorial/dqops/patterns) don't need another scan of the data:
+#   nulls_count / nulls_percent      "Detect anomalies in the percentage of null values",
+#                                    "Detect columns containing any null values", empty columns
+#   distinct_count (HyperLogLog)     "Detect anomalies in the count of distinct values"
+#   min / max / sum / mean           "Detect anomalies in the sum and average of numeric values"
+#   row_count, rows_by_day           "Detect big day-to-day data volume changes", partition volume
+# One small json per written partition:
+#     {table}/_metrics/dt={etl_date}/{run}.json
+# HLL registers are stored too (zlib + base64), so profiles of several runs/partitions can
+# be merged into an exact-as-HLL distinct count later.
+
+HLL_P = 12  # 4096 registers, ~1.6% standard error
+
+
+def _bit_length(w: np.ndarray) -> np.ndarray:
+    """Vectorized int.bit_length for uint64."""
+    n = np.zeros(w.shape, dtype=np.uint8)
+    w = w.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = w >= (np.uint64(1) << np.uint64(shift))
+        n[big] += shift
+        w[big] >>= np.uint64(shift)
+    return n + (w > 0)
+
+
+class HyperLogLog:
+    def __init__(self, p: int = HLL_P, registers: np.ndarray | None = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if not len(hashes):
+            return
+        p = np.uint64(self.p)
+        idx = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes << p
+        # position of the first 1 bit in the remaining 64-p bits
+        rho = np.where(rest == 0, 64 - self.p + 1, 65 - _bit_length(rest).astype(np.int16)).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rho)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m**2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            # linear counting for small cardinalities
+            return int(round(self.m * np.log(self.m / zeros)))
+        return int(round(raw))
+
+    def dumps(self) -> str:
+        return base64.b64encode(zlib.compress(self.registers.tobytes())).decode()
+
+    @classmethod
+    def loads(cls, data: str, p: int = HLL_P) -> "HyperLogLog":
+        return cls(p, np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=np.uint8).copy())
+
+
+def _hash_values(arr: pa.Array) -> np.ndarray:
+    # HLL ignores duplicates, so only the distinct values of the batch need hashing
+    values = pc.unique(arr.drop_null())
+    if pa.types.is_dictionary(values.type):
+        values = values.dictionary_decode()
+    if pa.types.is_decimal(values.type):
+        # python Decimal objects are slow to hash, doubles are close enough for a distinct estimate
+        values = pc.cast(values, pa.float64(), safe=False)
+    values = values.to_numpy(zero_copy_only=False)
+    if values.dtype.kind in "Mm":
+        values = values.view("i8")
+    return pd.util.hash_array(values, categorize=False)
+
+
+class ColumnProfiler:
+    def __init__(self, schema: pa.Schema, date_column: str | None = None):
+        self.schema = schema
+        self.date_column = date_column
+        self.row_count = 0
+        self.rows_by_day = {}
+        self.columns = {
+            field.name: {"nulls_count": 0, "min": None, "max": None, "sum": None, "hll": HyperLogLog()}
+            for field in schema
+        }
+
+    def update(self, batch: pa.RecordBatch) -> None:
+        self.row_count += batch.num_rows
+        for field, arr in zip(batch.schema, batch.columns):
+            stats = self.columns[field.name]
+            stats["nulls_count"] += arr.null_count
+            t = arr.type
+            if arr.null_count == len(arr):
+                continue
+            # nested values (json/arrays) would need a python round trip per value to hash
+            if not pa.types.is_nested(t):
+                stats["hll"].add_hashes(_hash_values(arr))
+            if pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t) or pa.types.is_temporal(t) or pa.types.is_string(t) or pa.types.is_large_string(t):
+                mm = pc.min_max(arr)
+                lo, hi = mm["min"].as_py(), mm["max"].as_py()
+                stats["min"] = lo if stats["min"] is None else min(stats["min"], lo)
+                stats["max"] = hi if stats["max"] is None else max(stats["max"], hi)
+            if pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_decimal(t):
+                s = pc.sum(arr).as_py()
+                stats["sum"] = s if stats["sum"] is None else stats["sum"] + s
+
+        if self.date_column and self.date_column in batch.schema.names:
+            days = batch.column(self.date_column)
+            if pa.types.is_timestamp(days.type):
+                days = pc.cast(pc.floor_temporal(days, unit="day"), pa.date32())
+            for item in pc.value_counts(days.drop_null()).to_pylist():
+                day = str(item["values"])
+                self.rows_by_day[day] = self.rows_by_day.get(day, 0) + item["counts"]
+
+    def to_dict(self) -> dict:
+        columns = {}
+        for name, stats in self.columns.items():
+            non_null = self.row_count - stats["nulls_count"]
+            columns[name] = {
+                "type": str(self.schema.field(name).type),
+                "nulls_count": stats["nulls_count"],
+                "nulls_percent": 100.0 * stats["nulls_count"] / self.row_count if self.row_count else 0.0,
+                "distinct_count": None if pa.types.is_nested(self.schema.field(name).type) else stats["hll"].estimate(),
+                "min": stats["min"],
+                "max": stats["max"],
+                "sum": stats["sum"],
+                "mean": stats["sum"] / non_null if stats["sum"] is not None and non_null else None,
+                "hll": stats["hll"].dumps(),
+            }
+        return {"row_count": self.row_count, "rows_by_day": self.rows_by_day, "columns": columns}
+
+    def write(self, path: str, **extra) -> None:
+        fs, fs_path = fsspec.core.url_to_fs(path)
+        fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+        with fs.open(fs_path, "w") as f:
+            json.dump({**extra, **self.to_dict()}, f, default=str, separators=(",", ":"))
+        logger.info(f"column profile written to {path}")
@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import duckdb
+import fsspec
+import numpy as np
+import pendulum
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# "Latest row per id" for a table, kept up to date from its daily change partitions instead of
+# deduplicating all of history on every read:
+#     {table}/_current/_manifest.json
+#     {table}/_current/{first id}-v{version}.parquet
+# Every file owns a contiguous id range [lo, hi) (the manifest has the bounds plus min/max id
+# and row count of each file), rows inside are sorted by id, so readers prune whole files
+# through the manifest and row groups through the parquet min/max stats.
+# Applying dt={etl_date}:
+#   - the partition (main.py / pipelined_writer.py files, or hash_cdc.py extracts) is
+#     deduplicated to one row per id, newest --order-column first, which also removes the
+#     UNION ALL duplicates
+#   - only files whose id range has a batch id, or overlaps a range hash_cdc.py replaced
+#     ({table}/_changes/dt=/*.json - ids missing there were deleted), are read and merged,
+#     the newest --order-column wins and the batch wins ties; a merged file bigger than
+#     2 x --file-rows is split
+#   - new files are written first, then the manifest, then the replaced files are deleted,
+#     so a reader holding the old manifest still finds its files until then
+# Applied partitions are recorded in the manifest, reruns skip them unless --force.
+# duck_lake.py's upsert_batch is the DuckLake variant of the same merge.
+#
+# python current_state.py --table b2x_checkout_transaction --etl-date 2025-10-08
+# python current_state.py --table b2x_checkout_transaction --start 2025-09-01 --end 2025-10-08 --output /tmp/lake
+# python current_state.py --table b2x_checkout_transaction --output /tmp/lake --id 123456
+
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+
+
+def _connect() -> duckdb.DuckDBPyConnection:
+    conn = duckdb.connect()
+    conn.sql("""
+        SET memory_limit = '2GB';
+        SET preserve_insertion_order = false;
+    """)
+    if os.getenv("GCS_HMAC_ACCESS_KEY"):
+        conn.sql(f"""
+            INSTALL httpfs;
+            LOAD httpfs;
+            CREATE SECRET (
+                TYPE gcs,
+                KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+                SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+            );
+        """)
+    return conn
+
+
+def _files_sql(paths: list[str]) -> str:
+    return "read_parquet([" + ", ".join(f"'{p}'" for p in paths) + "], union_by_name = true, hive_partitioning = false)"
+
+
+def _in_ranges(column: str, ranges: list) -> str:
+    return " OR ".join(f"({column} >= {lo} AND {column} < {hi})" for lo, hi in ranges) or "false"
+
+
+class CurrentState:
+    def __init__(self, output: str, table: str, id_column: str = "id", order_column: str = "last_updated"):
+        self.root = f"{output.rstrip('/')}/{table}"
+        self.dir = f"{self.root}/_current"
+        self.fs, self.fs_dir = fsspec.core.url_to_fs(self.dir)
+        self.id = id_column
+        self.order = order_column
+        self.manifest = self._load()
+        self._garbage = []  # replaced files, deleted once the new manifest is written
+
+    def _load(self) -> dict:
+        path = f"{self.fs_dir}/_manifest.json"
+        if self.fs.exists(path):
+            with self.fs.open(path) as f:
+                return json.load(f)
+        return {"version": 0, "id_column": self.id, "order_column": self.order, "files": [], "applied": {}}
+
+    def _save(self) -> None:
+        self.fs.makedirs(self.fs_dir, exist_ok=True)
+        tmp = f"{self.fs_dir}/_manifest.json.tmp"
+        with self.fs.open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        self.fs.mv(tmp, f"{self.fs_dir}/_manifest.json")
+
+    def path(self, name: str) -> str:
+        return f"{self.dir}/{name}"
+
+    def files_for(self, lo: int | None = None, hi: int | None = None) -> list[str]:
+        """Files that can hold ids in [lo, hi], from the manifest's min/max id."""
+        return [
+            self.path(f["name"])
+            for f in self.manifest["files"]
+            if (lo is None or f["max_id"] >= lo) and (hi is None or f["min_id"] <= hi)
+        ]
+
+    def relation(self, conn, lo: int | None = None, hi: int | None = None):
+        files = self.files_for(lo, hi)
+        if not files:
+            return None
+        where = " AND ".join(
+            c for c in (lo is not None and f"{self.id} >= {lo}", hi is not None and f"{self.id} <= {hi}") if c
+        )
+        return conn.sql(f"SELECT * FROM {_files_sql(files)}" + (f" WHERE {where}" if where else ""))
+
+    def _batches(self, etl_date: str) -> list[tuple[list[str], list | None, str]]:
+        """(files, replaced id ranges or None, key) of a dt= partition, in run order."""
+        fs, part = fsspec.core.url_to_fs(f"{self.root}/dt={etl_date}")
+        protocol = self.root.split("://", 1)[0] + "://" if "://" in self.root else ""
+        changes_dir = f"{self.root}/_changes/dt={etl_date}"
+        cfs, cdir = fsspec.core.url_to_fs(changes_dir)
+        batches, covered = [], set()
+        for manifest_path in sorted(cfs.glob(f"{cdir}/*.json")):
+            with cfs.open(manifest_path) as f:
+                change = json.load(f)
+            # a full extract replaces every id, ids not in it were deleted
+            ranges = [(-(2**63), 2**63 - 1)] if change["full"] else change["ranges"]
+            if change["files"] or ranges:
+                batches.append((change["files"], ranges, change["run_id"]))
+            covered.update(os.path.basename(p) for p in change["files"])
+        # plain window extracts, everything not listed in a _changes manifest
+        plain = sorted(
+            f"{protocol}{p}" for p in fs.glob(f"{part}/**/*.parquet") if os.path.basename(p) not in covered
+        )
+        if plain:
+            batches.insert(0, (plain, None, "window"))
+        return batches
+
+    def apply(self, conn, etl_date: str, file_rows: int = 1_000_000, force: bool = False) -> dict:
+        if etl_date in self.manifest["applied"] and not force:
+            logger.info(f"dt={etl_date} already applied, skipping")
+            return {}
+        applied = sorted(self.manifest["applied"])
+        if applied and etl_date < applied[-1]:
+            logger.warning(f"dt={etl_date} is older than dt={applied[-1]}, replaced ranges from it may undo newer rows")
+
+        batches = self._batches(etl_date)
+        if not batches:
+            # not landed yet, recording it would make the run after it lands skip it
+            logger.warning(f"dt={etl_date} has no files and no _changes manifests, not applied")
+            return {}
+
+        stats = {"batch_rows": 0, "files_rewritten": 0, "files_written": 0, "rows_rewritten": 0}
+        for files, ranges, key in batches:
+            s = self._apply_batch(conn, files, ranges, file_rows)
+            for k in stats:
+                stats[k] += s[k]
+        self.manifest["applied"][etl_date] = pendulum.now("UTC").to_iso8601_string()
+        self._save()
+        for name in self._garbage:
+            self.fs.rm_file(f"{self.fs_dir}/{name}")
+        self._garbage = []
+        return stats
+
+    def _apply_batch(self, conn, files: list[str], ranges: list | None, file_rows: int) -> dict:
+        has_order = False
+        if files:
+            columns = [r[0] for r in conn.sql(f"DESCRIBE SELECT * FROM {_files_sql(files)}").fetchall()]
+            has_order = self.order in columns
+            latest = f"ORDER BY {self.order} DESC NULLS LAST" if has_order else ""
+            conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE batch AS
+                SELECT * FROM {_files_sql(files)}
+                QUALIFY row_number() OVER (PARTITION BY {self.id} {latest}) = 1
+            """)
+        elif self.manifest["files"]:
+            # only deletions
+            conn.execute(f"CREATE OR REPLACE TEMP TABLE batch AS SELECT * FROM {_files_sql(self.files_for())} LIMIT 0")
+        else:
+            return {"batch_rows": 0, "files_rewritten": 0, "files_written": 0, "rows_rewritten": 0}
+        ids = conn.execute(f"SELECT {self.id} FROM batch ORDER BY 1").fetchnumpy()[self.id]
+        replaced = ranges or []
+
+        current = self.manifest["files"]
+        if not current:
+            # first batch: the whole table
+            new = self._write(conn, "SELECT * FROM batch", None, None, file_rows)
+            self.manifest["files"] = new
+            return {"batch_rows": len(ids), "files_rewritten": 0, "files_written": len(new), "rows_rewritten": 0}
+
+        kept, stats = [], {"batch_rows": len(ids), "files_rewritten": 0, "files_written": 0, "rows_rewritten": 0}
+        for f in current:
+            lo, hi = f["lo"], f["hi"]
+            left = 0 if lo is None else np.searchsorted(ids, lo, "left")
+            right = len(ids) if hi is None else np.searchsorted(ids, hi, "left")
+            touched_ranges = [
+                (a, b) for a, b in replaced if (hi is None or a < hi) and (lo is None or b > lo)
+            ]
+            if right <= left and not touched_ranges:
+                kept.append(f)
+                continue
+
+            own = " AND ".join(
+                c for c in (lo is not None and f"{self.id} >= {lo}", hi is not None and f"{self.id} < {hi}") if c
+            ) or "true"
+            old = f"SELECT *, 0 AS _src FROM read_parquet('{self.path(f['name'])}', hive_partitioning = false)"
+            if touched_ranges:
+                old += f" WHERE NOT ({_in_ranges(self.id, touched_ranges)})"
+            newest = f"{self.order} DESC NULLS LAST, " if has_order else ""
+            merged = f"""
+                SELECT * EXCLUDE (_src) FROM (
+                    {old}
+                    UNION ALL BY NAME
+                    SELECT *, 1 AS _src FROM batch WHERE {own}
+                )
+                QUALIFY row_number() OVER (PARTITION BY {self.id} ORDER BY {newest}_src DESC) = 1
+            """
+            new = self._write(conn, merged, lo, hi, file_rows)
+            stats["files_rewritten"] += 1
+            stats["files_written"] += len(new)
+            stats["rows_rewritten"] += sum(n["rows"] for n in new)
+            self._garbage.append(f["name"])
+            if new:
+                kept.extend(new)
+            elif kept:
+                # everything in the range was deleted, the previous file takes over its ids
+                kept[-1]["hi"] = hi
+            else:
+                kept.append({**f, "name": None, "rows": 0})
+        # a leading placeholder (first range emptied) hands its lower bound to the next file
+        while kept and kept[0]["name"] is None:
+            placeholder = kept.pop(0)
+            if kept:
+                kept[0]["lo"] = placeholder["lo"]
+        self.manifest["files"] = kept
+        return stats
+
+    def _write(self, conn, sql: str, lo: int | None, hi: int | None, file_rows: int) -> list[dict]:
+        """Writes `sql` sorted by id into files of ~file_rows, returns their manifest entries."""
+        conn.execute(f"CREATE OR REPLACE TEMP TABLE merged AS SELECT * FROM ({sql}) ORDER BY {self.id}")
+        total = conn.execute("SELECT count(*) FROM merged").fetchone()[0]
+        if not total:
+            return []
+        # only split when it is worth it, small files from a few new ids are merged back later
+        chunks = max(1, total // file_rows) if total > 2 * file_rows else 1
+        size = -(-total // chunks)
+        self.manifest["version"] += 1
+        version = self.manifest["version"]
+        self.fs.makedirs(self.fs_dir, exist_ok=True)
+        entries = []
+        for k in range(chunks):
+            first, last, n = conn.execute(f"""
+                SELECT min({self.id}), max({self.id}), count(*)
+                FROM (SELECT {self.id} FROM merged LIMIT {size} OFFSET {k * size})
+            """).fetchone()
+            name = f"{first}-v{version}.parquet"
+            conn.execute(f"""
+                COPY (SELECT * FROM merged ORDER BY {self.id} LIMIT {size} OFFSET {k * size})
+                TO '{self.path(name)}' (FORMAT PARQUET, COMPRESSION zstd, ROW_GROUP_SIZE 100000)
+            """)
+            entries.append({"name": name, "lo": first, "hi": None, "min_id": first, "max_id": last, "rows": n})
+        # ownership bounds: the first file keeps the old lower bound, the others start at their first id
+        entries[0]["lo"] = lo
+        for a, b in zip(entries, entries[1:]):
+            a["hi"] = b["lo"]
+        entries[-1]["hi"] = hi
+        return entries
+
+
+def run(
+    psql_table: str,
+    etl_dates: list[str],
+    output: str = gcs_bucket_prefix,
+    id_column: str = "id",
+    order_column: str = "last_updated",
+    file_rows: int = 1_000_000,
+    force: bool = False,
+) -> None:
+    state = CurrentState(output, psql_table, id_column, order_column)
+    with _connect() as conn:
+        for etl_date in etl_dates:
+            started = time.time()
+            stats = state.apply(conn, etl_date, file_rows, force)
+            if not stats:
+                continue
+            total = sum(f["rows"] for f in state.manifest["files"])
+            logger.info(
+                f"✅ dt={etl_date}: {stats['batch_rows']} changed ids, {stats['files_rewritten']} of "
+                f"{len(state.manifest['files'])} files rewritten ({stats['rows_rewritten']} of {total} rows) "
+                f"in {time.time() - started:.1f}s"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="merge dt= change partitions into a latest-row-per-id table")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", help="dt= partition to apply")
+    parser.add_argument("--start", help="apply every partition from --start to --end")
+    parser.add_argument("--end")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--order-column", default="last_updated", help="newest value wins")
+    parser.add_argument("--file-rows", type=int, default=1_000_000)
+    parser.add_argument("--force", action="store_true", help="re-apply partitions already applied")
+    parser.add_argument("--id", type=int, help="print the current row of this id (manifest pruned read)")
+    args = parser.parse_args()
+
+    if args.id is not None:
+        state = CurrentState(args.output, args.table, args.id_column, args.order_column)
+        with _connect() as conn:
+            rel = state.relation(conn, args.id, args.id)
+            logger.info(f"read {len(state.files_for(args.id, args.id))} of {len(state.manifest['files'])} files")
+            if rel is not None:
+                rel.show()
+    else:
+        if args.etl_date:
+            dates = [args.etl_date]
+        else:
+            start, end = pendulum.parse(args.start), pendulum.parse(args.end)
+            dates = [d.strftime("%Y-%m-%d") for d in pendulum.interval(start, end).range("days")]
+        run(args.table, dates, args.output, args.id_column, args.order_column, args.file_rows, args.force)
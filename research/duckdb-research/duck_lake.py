@@ -1,43 +1,203 @@
+import argparse
+import json
+import logging
+import os
+from datetime import timedelta
+
 import duckdb
+import pendulum
 from dotenv import load_dotenv
-import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 env_vars = load_dotenv("../../.env.shared")
 
-with duckdb.connect() as dconn:
-    install_extensions = """
+# DuckLake as ingestion sink
+# Every run upserts its batch on `id` inside one transaction, so it lands as exactly one
+# DuckLake snapshot. Reruns and overlapping windows update rows instead of appending them
+# again, and a row only gets replaced by a version with the same or a newer last_updated.
+# Readers can pin a snapshot id (`read --snapshot`) and keep seeing the same data while
+# new batches are committed; filters on id/created prune files through the per-file
+# min/max stats DuckLake keeps in the catalog.
+#
+# Catalogs:
+#   --catalog postgres                    the shared catalog (PSQL_* env vars), data on GCS
+#   --catalog sqlite:/tmp/lake.sqlite     local testing
+#   --catalog /tmp/lake.ducklake          local testing, duckdb file as catalog
+#
+# python duck_lake.py ingest --table b2x_checkout_transaction --etl-date 2025-10-08
+# python duck_lake.py ingest --table b2x_checkout_transaction --source '/tmp/lake/b2x_checkout_transaction/dt=2025-10-08/*.parquet' \
+#     --catalog sqlite:/tmp/lake.sqlite --data-path /tmp/lake_data/
+# python duck_lake.py read --table b2x_checkout_transaction --snapshot 12 --where "id >= 1000 AND id < 2000"
+# python duck_lake.py snapshots
+
+psql_schema = "public"
+lake_alias = "psql_ducklake"
+default_data_path = "gs://dev-duckdb-sink/ducklake_metadata/"
+
+
+def attach_ducklake(dconn, catalog: str = "postgres", data_path: str = default_data_path, alias: str = lake_alias) -> None:
+    dconn.sql("""
         INSTALL ducklake;
         INSTALL httpfs;
         INSTALL postgres;
-    """
+        LOAD ducklake;
+        LOAD httpfs;
+        LOAD postgres;
+    """)
 
-    create_gcs_secret = f"""
-        CREATE SECRET (
-            TYPE gcs,
-            KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
-            SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}',
-            URL_STYLE path
-        );
-    """
+    if data_path.startswith("gs://"):
+        # named, so it doesn't clash with the unnamed one setup_duckdb creates
+        dconn.sql(f"""
+            CREATE OR REPLACE SECRET ducklake_gcs (
+                TYPE gcs,
+                KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+                SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}',
+                URL_STYLE path
+            );
+        """)
 
-    load_extensions = """
-        LOAD postgres;
-        LOAD httpfs;
-    """
+    if catalog == "postgres":
+        metadata = (
+            f"postgres:dbname={os.getenv('PSQL_NAME')} "
+            f"host={os.getenv('PSQL_HOST')} "
+            f"user={os.getenv('PSQL_USERNAME')} "
+            f"password={os.getenv('PSQL_PASSWORD')}"
+        )
+    elif catalog.startswith("sqlite:"):
+        dconn.sql("INSTALL sqlite; LOAD sqlite;")
+        metadata = catalog
+    else:
+        metadata = catalog
+
+    dconn.sql(f"ATTACH 'ducklake:{metadata}' AS {alias} (DATA_PATH '{data_path}')")
+    dconn.sql(f"USE {alias}")
 
-    attach_postgres = f"""
-        ATTACH 
-        'ducklake:postgres:dbname={os.getenv("PSQL_NAME")} \
-        host={os.getenv("PSQL_HOST")} \
-        user={os.getenv("PSQL_USERNAME")} \
-        password={os.getenv("PSQL_PASSWORD")}'
-        AS psql_ducklake (DATA_PATH 'gs://dev-duckdb-sink/ducklake_metadata/');
 
-        USE psql_ducklake;
+def current_snapshot(dconn, alias: str = lake_alias) -> int:
+    return dconn.sql(f"SELECT max(snapshot_id) FROM ducklake_snapshots('{alias}')").fetchone()[0]
+
+
+def upsert_batch(
+    dconn,
+    table: str,
+    source_sql: str,
+    params: dict | None = None,
+    commit_message: str = "",
+    extra_info: dict | None = None,
+    alias: str = lake_alias,
+) -> dict:
+    """MERGEs `source_sql` into `{alias}.main.{table}` on id as a single snapshot.
+
+    The window query returns an id twice when both created and last_updated fall in the
+    window, and MERGE doesn't allow two source rows for one target row, so the batch is
+    deduplicated to the newest version per id first.
     """
+    target = f"{alias}.main.{table}"
+    dconn.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE batch AS
+        SELECT * FROM ({source_sql})
+        QUALIFY row_number() OVER (PARTITION BY id ORDER BY last_updated DESC NULLS LAST) = 1
+        ORDER BY id
+        """,
+        params or {},
+    )
+    batch_rows = dconn.sql("SELECT count(*) FROM batch").fetchone()[0]
+
+    dconn.sql("BEGIN TRANSACTION")
+    try:
+        dconn.sql(f"CREATE TABLE IF NOT EXISTS {target} AS SELECT * FROM batch LIMIT 0")
+        before = dconn.sql(f"SELECT count(*) FROM {target}").fetchone()[0]
+        # only replace a stored row by the same or a newer version, so replaying an
+        # older window can't roll rows back
+        merged = dconn.execute(f"""
+            MERGE INTO {target} AS tgt
+            USING batch AS src
+            ON tgt.id = src.id
+            WHEN MATCHED AND (tgt.last_updated IS NULL OR src.last_updated >= tgt.last_updated) THEN UPDATE
+            WHEN NOT MATCHED THEN INSERT
+        """).fetchone()[0]
+        after = dconn.sql(f"SELECT count(*) FROM {target}").fetchone()[0]
+        dconn.execute(
+            f"CALL {alias}.set_commit_message('ingestion', ?, extra_info => ?)",
+            [commit_message, json.dumps(extra_info or {})],
+        )
+        dconn.sql("COMMIT")
+    except Exception:
+        dconn.sql("ROLLBACK")
+        raise
+
+    stats = {
+        "batch_rows": batch_rows,
+        "inserted": after - before,
+        "updated": merged - (after - before),
+        "snapshot_id": current_snapshot(dconn, alias),
+    }
+    logger.info(f"{target}: {stats}")
+    return stats
+
+
+def read_pinned(dconn, table: str, snapshot_id: int | None = None, where: str = "true", alias: str = lake_alias):
+    """Scan of the table as of `snapshot_id` (the latest snapshot when not given)."""
+    if snapshot_id is None:
+        snapshot_id = current_snapshot(dconn, alias)
+    logger.info(f"reading {alias}.main.{table} at snapshot {snapshot_id}")
+    return dconn.sql(f"SELECT * FROM {alias}.main.{table} AT (VERSION => {int(snapshot_id)}) WHERE {where}")
+
+
+def ingest(dconn, table: str, etl_date: str, source: str | None = None) -> dict:
+    if source:
+        source_sql = f"SELECT * FROM read_parquet('{source}', hive_partitioning = false)"
+        params = {}
+    else:
+        from helpers import setup_duckdb
+
+        setup_duckdb(dconn)
+        date = pendulum.parse(etl_date, tz="Asia/Jakarta")
+        params = {
+            "psql_dstart": (date - timedelta(days=2)).strftime("%Y-%m-%d 17:00:00"),
+            "psql_dend": (date - timedelta(days=1)).strftime("%Y-%m-%d 17:00:00"),
+        }
+        source_sql = f"""
+            SELECT * FROM pg.{psql_schema}.{table}
+            WHERE created >= $psql_dstart AND created < $psql_dend
+
+            UNION ALL
+
+            SELECT * FROM pg.{psql_schema}.{table}
+            WHERE last_updated >= $psql_dstart AND last_updated < $psql_dend
+        """
+    return upsert_batch(
+        dconn,
+        table,
+        source_sql,
+        params,
+        commit_message=f"{table} dt={etl_date}",
+        extra_info={"table": table, "etl_date": etl_date, "source": source or "postgres"},
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DuckLake ingestion sink")
+    parser.add_argument("command", choices=["ingest", "read", "snapshots", "tables"])
+    parser.add_argument("--table")
+    parser.add_argument("--etl-date", default=pendulum.now("Asia/Jakarta").strftime("%Y-%m-%d"))
+    parser.add_argument("--source", help="parquet glob to ingest instead of the postgres window")
+    parser.add_argument("--catalog", default="postgres", help="postgres, sqlite:<path> or a .ducklake file")
+    parser.add_argument("--data-path", default=default_data_path)
+    parser.add_argument("--snapshot", type=int, help="snapshot id to read at")
+    parser.add_argument("--where", default="true")
+    args = parser.parse_args()
 
-    dconn.sql(create_gcs_secret)
-    dconn.sql(install_extensions)
-    dconn.sql(load_extensions)
-    dconn.sql(attach_postgres)
-    dconn.sql("SELECT * FROM duckdb_tables ;").show()
+    with duckdb.connect() as dconn:
+        attach_ducklake(dconn, args.catalog, args.data_path)
+        if args.command == "ingest":
+            ingest(dconn, args.table, args.etl_date, args.source)
+        elif args.command == "read":
+            read_pinned(dconn, args.table, args.snapshot, args.where).show()
+        elif args.command == "snapshots":
+            dconn.sql(f"SELECT * FROM ducklake_snapshots('{lake_alias}') ORDER BY snapshot_id").show()
+        else:
+            dconn.sql("SELECT * FROM duckdb_tables ;").show()
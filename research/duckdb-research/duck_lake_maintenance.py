@@ -0,0 +1,165 @@
+import argparse
+import logging
+import time
+
+import duckdb
+import fsspec
+
+from duck_lake import attach_ducklake, default_data_path, lake_alias
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maintenance for the DuckLake sink in duck_lake.py
+# Every ingestion run commits a snapshot with its own small files, so over time tables turn
+# into many tiny parquet files and a long snapshot history. This runs, in order:
+#   1. merge adjacent small files per table (ducklake_merge_adjacent_files)
+#   2. expire snapshots older than --retention (ducklake_expire_snapshots), time travel
+#      before that point stops working
+#   3. delete the files only expired snapshots referenced and the files the merge replaced
+#      (ducklake_cleanup_old_files), once they were scheduled longer than --cleanup-grace ago,
+#      so a query still reading an older snapshot (duck_lake.read_pinned) keeps its files
+#   4. delete files under DATA_PATH the catalog doesn't know (ducklake_delete_orphaned_files),
+#      only when older than --orphan-min-age so files of a running ingestion are left alone
+# and reports files/bytes under DATA_PATH before and after, with --measure-scans also a full
+# scan time per table (reads every table twice, off by default).
+#
+# python duck_lake_maintenance.py --retention '7 days'
+# python duck_lake_maintenance.py --retention '7 days' --cleanup-grace '6 hours' --measure-scans
+# python duck_lake_maintenance.py --catalog sqlite:/tmp/lake.sqlite --data-path /tmp/lake_data/ --dry-run
+
+
+def storage_usage(data_path: str) -> tuple[int, int]:
+    fs, root = fsspec.core.url_to_fs(data_path)
+    if not fs.exists(root):
+        return 0, 0
+    sizes = fs.du(root, total=False, withdirs=False)
+    return len(sizes), sum(sizes.values())
+
+
+def list_tables(dconn, alias: str) -> list[tuple[str, str]]:
+    return dconn.sql(f"""
+        SELECT schema_name, table_name FROM duckdb_tables()
+        WHERE database_name = '{alias}'
+        ORDER BY ALL
+    """).fetchall()
+
+
+def scan_seconds(dconn, alias: str, schema: str, table: str) -> float:
+    # hash of the whole row, so every column of every file gets read
+    tick = time.perf_counter()
+    dconn.sql(f"SELECT max(hash(t)) FROM {alias}.{schema}.{table} AS t").fetchone()
+    return time.perf_counter() - tick
+
+
+def table_files(dconn, alias: str) -> dict:
+    return {
+        row[0]: {"files": row[1], "bytes": row[2]}
+        for row in dconn.sql(
+            f"SELECT table_name, file_count, file_size_bytes FROM ducklake_table_info('{alias}')"
+        ).fetchall()
+    }
+
+
+def snapshot_count(dconn, alias: str) -> int:
+    return dconn.sql(f"SELECT count(*) FROM ducklake_snapshots('{alias}')").fetchone()[0]
+
+
+def measure(dconn, alias: str, data_path: str, tables: list, scans: bool = False) -> dict:
+    files, size = storage_usage(data_path)
+    return {
+        "storage_files": files,
+        "storage_bytes": size,
+        "snapshots": snapshot_count(dconn, alias),
+        "tables": table_files(dconn, alias),
+        "scan_s": {table: scan_seconds(dconn, alias, schema, table) for schema, table in tables} if scans else {},
+    }
+
+
+def run_maintenance(
+    dconn,
+    data_path: str,
+    retention: str = "7 days",
+    orphan_min_age: str = "1 day",
+    dry_run: bool = False,
+    alias: str = lake_alias,
+    cleanup_grace: str = "1 day",
+    measure_scans: bool = False,
+) -> dict:
+    tables = list_tables(dconn, alias)
+    before = measure(dconn, alias, data_path, tables, measure_scans)
+    logger.info(
+        f"before: {before['storage_files']} files, {before['storage_bytes'] / 1024**2:.1f} MB, "
+        f"{before['snapshots']} snapshots, {len(tables)} tables"
+    )
+
+    if dry_run:
+        expired = dconn.sql(
+            f"CALL ducklake_expire_snapshots('{alias}', dry_run => true, older_than => now() - INTERVAL '{retention}')"
+        ).fetchall()
+        orphans = dconn.sql(
+            f"CALL ducklake_delete_orphaned_files('{alias}', dry_run => true, older_than => now() - INTERVAL '{orphan_min_age}')"
+        ).fetchall()
+        logger.info(f"dry run: would expire {len(expired)} snapshots and delete {len(orphans)} orphaned files")
+        return {"before": before, "expired": len(expired), "orphans": len(orphans)}
+
+    for schema, table in tables:
+        tick = time.perf_counter()
+        dconn.sql(f"CALL ducklake_merge_adjacent_files('{alias}', '{table}', schema => '{schema}')")
+        logger.info(f"merged small files of {schema}.{table} in {time.perf_counter() - tick:.1f}s")
+
+    expired = dconn.sql(
+        f"CALL ducklake_expire_snapshots('{alias}', older_than => now() - INTERVAL '{retention}')"
+    ).fetchall()
+    logger.info(f"expired {len(expired)} snapshots older than {retention}")
+
+    # files replaced by the merge and files of expired snapshots are only scheduled for
+    # deletion, this removes the ones scheduled before the grace period
+    cleaned = dconn.sql(
+        f"CALL ducklake_cleanup_old_files('{alias}', older_than => now() - INTERVAL '{cleanup_grace}')"
+    ).fetchall()
+    logger.info(f"deleted {len(cleaned)} files scheduled for deletion more than {cleanup_grace} ago")
+
+    orphans = dconn.sql(
+        f"CALL ducklake_delete_orphaned_files('{alias}', older_than => now() - INTERVAL '{orphan_min_age}')"
+    ).fetchall()
+    logger.info(f"deleted {len(orphans)} orphaned files older than {orphan_min_age}")
+
+    after = measure(dconn, alias, data_path, tables, measure_scans)
+    logger.info(
+        f"after: {after['storage_files']} files, {after['storage_bytes'] / 1024**2:.1f} MB, "
+        f"{after['snapshots']} snapshots"
+    )
+    logger.info(
+        f"✅ reclaimed {before['storage_files'] - after['storage_files']} files, "
+        f"{(before['storage_bytes'] - after['storage_bytes']) / 1024**2:.1f} MB"
+    )
+    for schema, table in tables:
+        old, new = before["tables"].get(table, {}), after["tables"].get(table, {})
+        scan = f", full scan {before['scan_s'][table]:.2f}s -> {after['scan_s'][table]:.2f}s" if measure_scans else ""
+        logger.info(f"  {schema}.{table}: files {old.get('files')} -> {new.get('files')}{scan}")
+    return {"before": before, "after": after, "expired": len(expired), "cleaned": len(cleaned), "orphans": len(orphans)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DuckLake compaction, snapshot expiry and orphan cleanup")
+    parser.add_argument("--catalog", default="postgres", help="postgres, sqlite:<path> or a .ducklake file")
+    parser.add_argument("--data-path", default=default_data_path)
+    parser.add_argument("--retention", default="7 days", help="keep snapshots younger than this")
+    parser.add_argument("--orphan-min-age", default="1 day", help="only delete orphaned files older than this")
+    parser.add_argument("--cleanup-grace", default="1 day", help="only delete replaced/expired files scheduled before this")
+    parser.add_argument("--measure-scans", action="store_true", help="time a full scan of every table before and after")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    with duckdb.connect() as dconn:
+        attach_ducklake(dconn, args.catalog, args.data_path)
+        run_maintenance(
+            dconn,
+            args.data_path,
+            args.retention,
+            args.orphan_min_age,
+            args.dry_run,
+            cleanup_grace=args.cleanup_grace,
+            measure_scans=args.measure_scans,
+        )
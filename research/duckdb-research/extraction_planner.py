@@ -0,0 +1,384 @@
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+import duckdb
+import fsspec
+import pendulum
+import psycopg2
+from dotenv import load_dotenv
+
+from helpers import setup_duckdb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Picks how to pull a day's window out of postgres from what postgres says it would do.
+# query/main_query.sql is the same for every table, but without an index on last_updated its
+# second UNION branch is a sequential scan of the whole table (and so is the first one without
+# an index on created). Candidates, all returning the rows created or updated in the window:
+#   - window:     main_query.sql as is, two branches (UNION ALL duplicates included)
+#   - id_range:   one pass over the primary key in --chunk-rows sized id ranges, both window
+#                 predicates OR-ed, so the table is read once instead of twice
+#   - ctid_range: the same over physical page ranges (TID Range Scan, postgres 14+)
+#   - full:       the whole table, only offered below --small-pages; the snapshot goes to
+#                 {table}/_snapshots/dt={etl_date}/{HHMMSS}.parquet with a {table}/_changes/dt=
+#                 manifest marking it full (current_state.py treats ids missing from it as
+#                 deleted), dt= itself only gets the window's rows filtered out of it, so
+#                 reconcile.py / metrics_anomaly.py / the GX suites still see the day's window
+# Every candidate gets EXPLAIN (FORMAT JSON); chunked ones explain their middle chunk times
+# the number of chunks. Score = planner total cost + rows * width shipped to duckdb, counted
+# as --transfer-page-cost per 8kB page. The cheapest wins and is logged with all scores.
+# The choice is cached per table in .state/extraction_plan/plans.sqlite and reused until
+# reltuples or relpages drift more than --stats-drift or the set of indexed columns changes.
+# The extract itself runs through postgres_query() on the duckdb `pg` attachment, chunk by
+# chunk into a temp table, then one COPY to {table}/dt={etl_date}/{HHMMSS}.parquet.
+# Chunks are separate transactions; a row updated mid-extract leaves the window and is
+# picked up by the next run.
+#
+# python extraction_planner.py --table b2x_checkout_transaction --etl-date 2025-10-08 --plan-only
+# python extraction_planner.py --table b2x_checkout_transaction --etl-date 2025-10-08 --output /tmp/lake
+# python extraction_planner.py --table b2x_user_status_history --etl-date 2025-10-08 --replan
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_path = Path(".state/extraction_plan/plans.sqlite")
+main_query_path = Path(__file__).parent / "query" / "main_query.sql"
+
+PAGE_BYTES = 8192
+
+
+def window_bounds(etl_date: str) -> tuple[str, str]:
+    """dt=D holds rows from D-2 17:00 to D-1 17:00, as in main.py."""
+    date = pendulum.parse(etl_date)
+    return (
+        date.subtract(days=2).strftime("%Y-%m-%d 17:00:00"),
+        date.subtract(days=1).strftime("%Y-%m-%d 17:00:00"),
+    )
+
+
+def _literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render_main_query(table: str, params: dict) -> str:
+    """query/main_query.sql in postgres dialect: no pg. prefix, $params inlined."""
+    sql = main_query_path.read_text().format(psql_schema=psql_schema, psql_table=table)
+    sql = sql.replace(f"pg.{psql_schema}.", f"{psql_schema}.")
+    return re.sub(r"\$(\w+)", lambda m: _literal(params[m.group(1)]), sql).strip().rstrip(";")
+
+
+class Strategy:
+    def __init__(self, name: str, statements: list[str], explain_index: int = 0):
+        self.name = name
+        self.statements = statements
+        # the statement that is explained, its cost is scaled by len(statements)
+        self.explain_index = explain_index
+
+
+class TableStats:
+    def __init__(self, reltuples: int, relpages: int, indexed: list[str], server_version: int):
+        self.reltuples = reltuples
+        self.relpages = relpages
+        self.indexed = sorted(indexed)
+        self.server_version = server_version
+
+    def drifted(self, reltuples: int, relpages: int, indexed: str, threshold: float) -> bool:
+        def off(now, then):
+            return abs(now - then) / max(then, 1) > threshold
+
+        return off(self.reltuples, reltuples) or off(self.relpages, relpages) or json.dumps(self.indexed) != indexed
+
+
+def table_stats(cur, table: str) -> TableStats:
+    cur.execute(
+        """
+        SELECT
+            greatest(c.reltuples, 0)::bigint,
+            c.relpages,
+            coalesce(array_agg(DISTINCT a.attname::text) FILTER (WHERE a.attname IS NOT NULL), '{}'),
+            current_setting('server_version_num')::int
+        FROM pg_class c
+        LEFT JOIN pg_index i ON i.indrelid = c.oid
+        LEFT JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+        WHERE c.oid = %s::regclass
+        GROUP BY c.reltuples, c.relpages
+        """,
+        (f"{psql_schema}.{table}",),
+    )
+    return TableStats(*cur.fetchone())
+
+
+def candidates(
+    cur,
+    table: str,
+    stats: TableStats,
+    etl_date: str,
+    id_column: str,
+    chunk_rows: int,
+    small_pages: int,
+) -> list[Strategy]:
+    dstart, dend = window_bounds(etl_date)
+    cur.execute(f"SELECT min({id_column}), max({id_column}) FROM {psql_schema}.{table}")
+    min_id, max_id = cur.fetchone()
+    strategies = [
+        Strategy(
+            "window",
+            [render_main_query(table, {"min_id": min_id, "max_id": max_id, "psql_dstart": dstart, "psql_dend": dend})],
+        )
+    ]
+    if min_id is None:
+        return strategies
+
+    in_window = (
+        f"((created >= {_literal(dstart)} AND created < {_literal(dend)})"
+        f" OR (last_updated >= {_literal(dstart)} AND last_updated < {_literal(dend)}))"
+    )
+    select = f"SELECT * FROM {psql_schema}.{table} WHERE"
+    n = max(1, math.ceil(stats.reltuples / chunk_rows))
+
+    # id chunks, the last one open ended for rows inserted after min/max was read
+    width = max(1, math.ceil((max_id - min_id + 1) / n))
+    bounds = list(range(min_id, max_id + 1, width))
+    strategies.append(Strategy(
+        "id_range",
+        [
+            f"{select} {id_column} >= {lo}" + (f" AND {id_column} < {bounds[k + 1]}" if k + 1 < len(bounds) else "")
+            + f" AND {in_window}"
+            for k, lo in enumerate(bounds)
+        ],
+        len(bounds) // 2,
+    ))
+
+    if stats.server_version >= 140000:
+        pages = max(1, math.ceil(stats.relpages / n))
+        starts = list(range(0, max(stats.relpages, 1), pages))
+        strategies.append(Strategy(
+            "ctid_range",
+            [
+                f"{select} ctid >= '({p},0)'::tid"
+                + (f" AND ctid < '({starts[k + 1]},0)'::tid" if k + 1 < len(starts) else "")
+                + f" AND {in_window}"
+                for k, p in enumerate(starts)
+            ],
+            len(starts) // 2,
+        ))
+
+    if stats.relpages <= small_pages:
+        strategies.append(Strategy("full", [f"SELECT * FROM {psql_schema}.{table}"]))
+    return strategies
+
+
+def explain_cost(cur, strategy: Strategy, transfer_page_cost: float) -> dict:
+    cur.execute("EXPLAIN (FORMAT JSON) " + strategy.statements[strategy.explain_index])
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    scale = len(strategy.statements)
+    planner = root["Total Cost"] * scale
+    transfer = root["Plan Rows"] * root["Plan Width"] * scale / PAGE_BYTES * transfer_page_cost
+    nodes, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node["Node Type"])
+        stack.extend(node.get("Plans", []))
+    return {
+        "cost": round(planner + transfer, 2),
+        "planner_cost": round(planner, 2),
+        "rows": int(root["Plan Rows"] * scale),
+        "chunks": scale,
+        "scans": sorted({n for n in nodes if "Scan" in n}),
+    }
+
+
+class PlanCache:
+    def __init__(self, path: Path = state_path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS plans (
+                table_name TEXT PRIMARY KEY,
+                strategy TEXT,
+                costs TEXT,
+                reltuples INTEGER,
+                relpages INTEGER,
+                indexed TEXT,
+                planned_at TEXT
+            )
+        """)
+
+    def get(self, table: str, stats: TableStats, drift: float) -> tuple[str, dict] | None:
+        row = self.db.execute(
+            "SELECT strategy, costs, reltuples, relpages, indexed FROM plans WHERE table_name = ?", (table,)
+        ).fetchone()
+        if row is None or stats.drifted(row[2], row[3], row[4], drift):
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, table: str, strategy: str, costs: dict, stats: TableStats) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    table,
+                    strategy,
+                    json.dumps(costs),
+                    stats.reltuples,
+                    stats.relpages,
+                    json.dumps(stats.indexed),
+                    pendulum.now("UTC").to_iso8601_string(),
+                ),
+            )
+
+
+def plan(
+    cur,
+    table: str,
+    etl_date: str,
+    cache: PlanCache,
+    id_column: str = "id",
+    chunk_rows: int = 1_000_000,
+    small_pages: int = 10_000,
+    transfer_page_cost: float = 4.0,
+    stats_drift: float = 0.2,
+    replan: bool = False,
+) -> tuple[Strategy, dict]:
+    stats = table_stats(cur, table)
+    strategies = {s.name: s for s in candidates(cur, table, stats, etl_date, id_column, chunk_rows, small_pages)}
+    cached = None if replan else cache.get(table, stats, stats_drift)
+    if cached and cached[0] in strategies:
+        name, costs = cached
+        logger.info(f"{table}: cached plan {name} (estimated cost {costs[name]['cost']}), stats unchanged")
+        return strategies[name], costs
+
+    costs = {name: explain_cost(cur, s, transfer_page_cost) for name, s in strategies.items()}
+    name = min(costs, key=lambda k: costs[k]["cost"])
+    cache.put(table, name, costs, stats)
+    logger.info(
+        f"{table}: chose {name} (estimated cost {costs[name]['cost']}, {costs[name]['rows']} rows, "
+        f"{', '.join(costs[name]['scans'])}) over "
+        + ", ".join(f"{k} {v['cost']} ({', '.join(v['scans'])})" for k, v in costs.items() if k != name)
+        + f"; reltuples {stats.reltuples}, relpages {stats.relpages}, indexed {stats.indexed}"
+    )
+    return strategies[name], costs
+
+
+def extract(duck_conn, strategy: Strategy) -> None:
+    """Runs the strategy chunk by chunk into the `planned_sink` temp table."""
+    for k, sql in enumerate(strategy.statements):
+        source = f"SELECT * FROM postgres_query('pg', '{sql.replace(chr(39), chr(39) * 2)}')"
+        if k == 0:
+            duck_conn.execute(f"CREATE OR REPLACE TEMP TABLE planned_sink AS {source}")
+        else:
+            duck_conn.execute(f"INSERT INTO planned_sink {source}")
+
+
+def write(duck_conn, path: str, window: tuple[str, str] | None = None) -> int:
+    """planned_sink to parquet, only the rows created or updated in `window` when given."""
+    fs, fs_path = fsspec.core.url_to_fs(path)
+    fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+    where = ""
+    if window is not None:
+        where = (
+            f" WHERE (created >= {_literal(window[0])} AND created < {_literal(window[1])})"
+            f" OR (last_updated >= {_literal(window[0])} AND last_updated < {_literal(window[1])})"
+        )
+    return duck_conn.execute(
+        f"COPY (SELECT * FROM planned_sink{where}) TO '{path}' (FORMAT PARQUET, COMPRESSION zstd)"
+    ).fetchone()[0]
+
+
+def run(
+    psql_table: str,
+    etl_date: str,
+    output: str = gcs_bucket_prefix,
+    plan_only: bool = False,
+    replan: bool = False,
+    **plan_args,
+) -> dict:
+    # psycopg2's `with conn` only ends the transaction, closing() closes the connection
+    with contextlib.closing(psycopg2.connect(os.getenv("PSQL_CONN"))) as conn, conn, conn.cursor() as cur:
+        strategy, costs = plan(cur, psql_table, etl_date, PlanCache(), replan=replan, **plan_args)
+    if plan_only:
+        return costs
+
+    run_id = pendulum.now().strftime("%H%M%S")
+    path = f"{output}/{psql_table}/dt={etl_date}/{run_id}.parquet"
+    snapshot_path = f"{output}/{psql_table}/_snapshots/dt={etl_date}/{run_id}.parquet"
+    started = time.time()
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+        extract(duck_conn, strategy)
+        if strategy.name == "full":
+            # dt= stays the day's window, the whole table goes next to it
+            snapshot_rows = write(duck_conn, snapshot_path)
+            rows = write(duck_conn, path, window_bounds(etl_date))
+        else:
+            rows = write(duck_conn, path)
+
+    if strategy.name == "full":
+        fs, manifest_path = fsspec.core.url_to_fs(f"{output}/{psql_table}/_changes/dt={etl_date}/{run_id}.json")
+        fs.makedirs(manifest_path.rsplit("/", 1)[0], exist_ok=True)
+        with fs.open(manifest_path, "w") as f:
+            json.dump(
+                {
+                    "table": psql_table,
+                    "etl_date": etl_date,
+                    "run_id": run_id,
+                    "id_column": plan_args.get("id_column", "id"),
+                    "full": True,
+                    "ranges": None,
+                    "files": [snapshot_path],
+                    "rows": snapshot_rows,
+                },
+                f,
+                indent=2,
+            )
+
+    logger.info(
+        f"✅ {psql_table}: {rows} rows extracted with {strategy.name} "
+        f"({len(strategy.statements)} statements) in {time.time() - started:.1f}s"
+    )
+    return costs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="extract a window with the strategy postgres estimates cheapest")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", required=True, help="dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="estimated rows per id/ctid chunk")
+    parser.add_argument("--small-pages", type=int, default=10_000, help="offer a full snapshot up to this many pages")
+    parser.add_argument("--transfer-page-cost", type=float, default=4.0, help="planner cost per 8kB shipped")
+    parser.add_argument("--stats-drift", type=float, default=0.2, help="replan when reltuples/relpages move this much")
+    parser.add_argument("--replan", action="store_true", help="ignore the cached plan")
+    parser.add_argument("--plan-only", action="store_true", help="log the decision, extract nothing")
+    args = parser.parse_args()
+
+    run(
+        args.table,
+        args.etl_date,
+        args.output,
+        args.plan_only,
+        args.replan,
+        id_column=args.id_column,
+        chunk_rows=args.chunk_rows,
+        small_pages=args.small_pages,
+        transfer_page_cost=args.transfer_page_cost,
+        stats_drift=args.stats_drift,
+    )
@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import duckdb
+import fsspec
+import pendulum
+from dotenv import load_dotenv
+
+from helpers import setup_duckdb
+from reconcile import PostgresSide, Side, canonical_columns
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Change detection for tables without a reliable last_updated (history / lookup tables in
+# spark_etl_postgres_to_gcs.py's list), which otherwise need a full reload every run:
+#   - postgres computes (count(*), sum(row hash)) per id bucket of --bucket-width ids, with the
+#     same row hash reconcile.py uses, pushed down through postgres_query(); only one row per
+#     bucket comes back
+#   - the previous run's bucket hashes are kept in .state/row_hash/state.sqlite, buckets that
+#     are new, gone or hash differently are merged into contiguous id ranges
+#   - only those ranges are extracted (whole buckets, ordered by id) to
+#         {table}/dt={etl_date}/{HHMMSS}[-n].parquet
+#     next to a manifest listing the ranges the files replace (so ids missing from them were
+#     deleted) for current_state.py and friends:
+#         {table}/_changes/dt={etl_date}/{HHMMSS}.json
+# Transfer is one bucket list plus the changed buckets, i.e. proportional to churn.
+# The first run, a new --bucket-width or a change of columns/types extracts everything.
+# Bucket hashes are read before the extract, rows changing in between are picked up again
+# by the next run. They are saved only after the extract and its manifest are written, a run
+# failing before that is redone in full by the next one.
+#
+# python hash_cdc.py --table b2x_user_status_history --etl-date 2025-10-08
+# python hash_cdc.py --table b2x_user_status_history --etl-date 2025-10-08 --bucket-width 50000 --output /tmp/lake
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_path = Path(".state/row_hash/state.sqlite")
+
+MAX_RANGES_PER_FILE = 500
+
+
+class BucketState:
+    def __init__(self, path: Path = state_path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS tables (
+                table_name TEXT PRIMARY KEY,
+                bucket_width INTEGER,
+                columns TEXT,
+                etl_date TEXT
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                table_name TEXT,
+                bucket INTEGER,
+                n INTEGER,
+                hash_sum TEXT,
+                PRIMARY KEY (table_name, bucket)
+            );
+        """)
+
+    def load(self, table: str) -> tuple[int | None, str | None, dict]:
+        row = self.db.execute("SELECT bucket_width, columns FROM tables WHERE table_name = ?", (table,)).fetchone()
+        if row is None:
+            return None, None, {}
+        buckets = {
+            b: (n, int(s))
+            for b, n, s in self.db.execute("SELECT bucket, n, hash_sum FROM buckets WHERE table_name = ?", (table,))
+        }
+        return row[0], row[1], buckets
+
+    def save(self, table: str, bucket_width: int, columns: str, buckets: dict, etl_date: str) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM buckets WHERE table_name = ?", (table,))
+            self.db.executemany(
+                "INSERT INTO buckets VALUES (?, ?, ?, ?)",
+                [(table, b, n, str(s)) for b, (n, s) in buckets.items()],
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?)", (table, bucket_width, columns, etl_date)
+            )
+
+
+def changed_ranges(previous: dict, current: dict, width: int) -> list[tuple[int, int]]:
+    """Id ranges of buckets that are new, gone or hash differently, adjacent ones merged."""
+    changed = sorted(b for b in previous.keys() | current.keys() if previous.get(b) != current.get(b))
+    ranges = []
+    for b in changed:
+        lo, hi = b * width, (b + 1) * width
+        if ranges and ranges[-1][1] == lo:
+            ranges[-1] = (ranges[-1][0], hi)
+        else:
+            ranges.append((lo, hi))
+    return ranges
+
+
+def detect_and_extract(
+    side: Side,
+    table: str,
+    columns_fingerprint: str,
+    bucket_width: int,
+    output_dir: str,
+    run_id: str,
+    state: BucketState,
+) -> tuple[dict, dict]:
+    """Extracts the changed id ranges, returns the result and the bucket hashes to save once
+    the caller has recorded the result."""
+    started = time.time()
+    previous_width, previous_columns, previous = state.load(table)
+    current = side.buckets(None, 0, bucket_width)
+    full = previous_width != bucket_width or previous_columns != columns_fingerprint
+    if full:
+        logger.info(f"{table}: no comparable bucket hashes (first run, new width or new columns), extracting all")
+        ranges = None
+    else:
+        ranges = changed_ranges(previous, current, bucket_width)
+    hashed_s = time.time() - started
+
+    fs, root = fsspec.core.url_to_fs(output_dir)
+    fs.makedirs(root, exist_ok=True)
+    files, rows = [], 0
+    chunks = [None] if ranges is None else [ranges[i:i + MAX_RANGES_PER_FILE] for i in range(0, len(ranges), MAX_RANGES_PER_FILE)]
+    for i, chunk in enumerate(chunks):
+        path = f"{output_dir}/{run_id}.parquet" if len(chunks) == 1 else f"{output_dir}/{run_id}-{i}.parquet"
+        rows += side.dconn.execute(f"COPY ({side.rows(chunk)}) TO '{path}' (FORMAT PARQUET, COMPRESSION zstd)").fetchone()[0]
+        files.append(path)
+
+    return {
+        "full": full,
+        "ranges": None if ranges is None else [list(r) for r in ranges],
+        "files": files,
+        "rows": rows,
+        "buckets": len(current),
+        "changed_buckets": len(current) if ranges is None else sum((hi - lo) // bucket_width for lo, hi in ranges),
+        "source_rows": sum(n for n, _ in current.values()),
+        "hash_seconds": hashed_s,
+        "seconds": time.time() - started,
+    }, current
+
+
+def run(
+    psql_table: str,
+    etl_date: str,
+    output: str = gcs_bucket_prefix,
+    id_column: str = "id",
+    bucket_width: int = 10_000,
+    exclude: list[str] | None = None,
+) -> dict:
+    run_id = pendulum.now().strftime("%H%M%S")
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+        columns = [
+            (name, dtype)
+            for name, dtype, *_ in duck_conn.execute(f"DESCRIBE pg.{psql_schema}.{psql_table}").fetchall()
+            if name not in (exclude or [])
+        ]
+        pg_text, _, skipped = canonical_columns(columns)
+        if skipped:
+            logger.warning(f"not hashed (changes only in these columns go unnoticed): {skipped}")
+        side = PostgresSide("postgres", duck_conn, f"SELECT * FROM {psql_schema}.{psql_table}", id_column, pg_text)
+        fingerprint = hashlib.md5(json.dumps(columns).encode()).hexdigest()
+        state = BucketState()
+        result, buckets = detect_and_extract(
+            side,
+            psql_table,
+            fingerprint,
+            bucket_width,
+            f"{output}/{psql_table}/dt={etl_date}",
+            run_id,
+            state,
+        )
+
+    manifest = {
+        "table": psql_table,
+        "etl_date": etl_date,
+        "run_id": run_id,
+        "id_column": id_column,
+        "bucket_width": bucket_width,
+        **result,
+    }
+    fs, path = fsspec.core.url_to_fs(f"{output}/{psql_table}/_changes/dt={etl_date}/{run_id}.json")
+    fs.makedirs(path.rsplit("/", 1)[0], exist_ok=True)
+    with fs.open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    # last: until the manifest exists, current_state.py hasn't seen these changes
+    state.save(psql_table, bucket_width, fingerprint, buckets, etl_date)
+
+    logger.info(
+        f"✅ {psql_table}: {result['changed_buckets']}/{result['buckets']} buckets changed, "
+        f"{result['rows']} of {result['source_rows']} rows extracted "
+        f"({100 * result['rows'] / max(result['source_rows'], 1):.1f}%) in {result['seconds']:.1f}s "
+        f"(hashing {result['hash_seconds']:.1f}s)"
+    )
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="extract only the id buckets whose row hashes changed")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", required=True, help="dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--id-column", default="id", help="integer id to bucket on")
+    parser.add_argument("--bucket-width", type=int, default=10_000, help="ids per bucket")
+    parser.add_argument("--exclude", action="append", help="columns left out of the row hash")
+    args = parser.parse_args()
+
+    run(args.table, args.etl_date, args.output, args.id_column, args.bucket_width, args.exclude)
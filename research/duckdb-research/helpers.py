@@ -1,10 +1,39 @@
 import pandas as pd
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def setup_duckdb(duck_conn, memory_limit: str = "2GB", threads: int = 1) -> None:
+    """
+    Same setup main.py does inline: attach postgres as `pg`, load httpfs,
+    create the GCS secret and apply the performance settings.
+    """
+    logging.info("setting up duckdb...")
+    duck_conn.sql(f"""
+        INSTALL postgres;
+        LOAD postgres;
+        ATTACH '{os.getenv("PSQL_CONN")}'
+        AS pg (TYPE POSTGRES, READ_ONLY);
+
+        INSTALL httpfs;
+        LOAD httpfs;
+
+        CREATE SECRET (
+            TYPE gcs,
+            KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+            SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+        );
+
+        SET memory_limit = '{memory_limit}';
+        SET threads TO {threads};
+        SET preserve_insertion_order = false;
+    """)
+    logging.info("setup done.")
+
+
 # Add the DuckDB to BigQuery mapper class
 class DuckDBToBigQueryMapper:
     """
@@ -0,0 +1,307 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+
+import fsspec
+import numpy as np
+import pendulum
+from dotenv import load_dotenv
+
+from column_profile import HyperLogLog
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Anomaly detection over the per-partition metrics column_profile.py writes
+# ({table}/_metrics/dt={etl_date}/*.json), covering the DQOps patterns
+#   "Detect big day-to-day data volume changes"           row_count vs previous partition
+#   "Detect data freshness anomalies daily"               freshness_hours
+#   "Detect outliers in numeric values across daily partitions"  per column min/max/mean
+# plus nulls_percent and distinct_count per column.
+# History is never re-read: every (table, metric) series keeps a small running state in
+# .state/anomaly/state.sqlite (count, mean, M2 for the variance, EWMA + EW variance, last value
+# and two P² quantile estimators for the anomaly band), updated in O(1) per new partition.
+# Evaluating a night's partitions is one NumPy pass over the arrays of all series.
+#
+# python metrics_anomaly.py --etl-date 2025-10-08
+# python metrics_anomaly.py --start 2025-09-01 --end 2025-10-08 --output /tmp/lake    (seed history)
+
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_path = Path(".state/anomaly/state.sqlite")
+
+
+class P2Quantile:
+    """P² estimator (Jain & Chlamtac) of one quantile: 5 markers, O(1) per observation."""
+
+    def __init__(self, p: float, state: dict | None = None):
+        self.p = p
+        state = state or {}
+        self.init = state.get("init", [])
+        self.q = state.get("q")
+        self.n = state.get("n")
+        self.np_ = state.get("np")
+
+    def add(self, x: float) -> None:
+        if self.q is None:
+            self.init.append(x)
+            if len(self.init) == 5:
+                p = self.p
+                self.q = sorted(self.init)
+                self.n = [0, 1, 2, 3, 4]
+                self.np_ = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+                self.init = []
+            return
+
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0], k = x, 0
+        elif x >= q[4]:
+            q[4], k = x, 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i, dn in enumerate((0, self.p / 2, self.p, (1 + self.p) / 2, 1)):
+            self.np_[i] += dn
+
+        for i in (1, 2, 3):
+            d = self.np_[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # parabolic prediction, linear when it would break the marker order
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self) -> float:
+        if self.q is not None:
+            return self.q[2]
+        if not self.init:
+            return np.nan
+        return float(np.quantile(self.init, self.p))
+
+    def state(self) -> dict:
+        return {"init": self.init, "q": self.q, "n": self.n, "np": self.np_}
+
+
+class StateStore:
+    def __init__(self, path: Path = state_path, low: float = 0.0005, high: float = 0.9995, alpha: float = 0.2):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS series (
+                table_name TEXT,
+                metric TEXT,
+                n INTEGER,
+                mean REAL,
+                m2 REAL,
+                ewma REAL,
+                ewvar REAL,
+                last_value REAL,
+                last_dt TEXT,
+                q_low TEXT,
+                q_high TEXT,
+                PRIMARY KEY (table_name, metric)
+            )
+        """)
+        self.low, self.high, self.alpha = low, high, alpha
+
+    def load(self, keys: list[tuple[str, str]]) -> dict:
+        """State arrays aligned with `keys`, zeros/NaN for series seen for the first time."""
+        rows = {
+            (r[0], r[1]): r
+            for r in self.db.execute(
+                "SELECT table_name, metric, n, mean, m2, ewma, ewvar, last_value, last_dt, q_low, q_high FROM series"
+            )
+        }
+        out = {name: np.full(len(keys), np.nan) for name in ("n", "mean", "m2", "ewma", "ewvar", "last_value", "q_low", "q_high")}
+        out["n"][:] = 0
+        out["last_dt"] = [None] * len(keys)
+        for i, key in enumerate(keys):
+            row = rows.get(key)
+            if row is None:
+                continue
+            out["n"][i], out["mean"][i], out["m2"][i], out["ewma"][i], out["ewvar"][i], out["last_value"][i] = row[2:8]
+            out["last_dt"][i] = row[8]
+            out["q_low"][i] = P2Quantile(self.low, json.loads(row[9])).value()
+            out["q_high"][i] = P2Quantile(self.high, json.loads(row[10])).value()
+        return out
+
+    def update(self, keys: list[tuple[str, str]], values: np.ndarray, etl_date: str) -> None:
+        existing = {
+            (r[0], r[1]): r
+            for r in self.db.execute(
+                "SELECT table_name, metric, n, mean, m2, ewma, ewvar, last_value, last_dt, q_low, q_high FROM series"
+            )
+        }
+        for key, x in zip(keys, values):
+            if np.isnan(x):
+                continue
+            row = existing.get(key)
+            if row is not None and row[8] is not None and row[8] >= etl_date:
+                # partition already folded into the state, reruns don't count it twice
+                continue
+            if row is None:
+                n, mean, m2, ewma, ewvar = 0, 0.0, 0.0, float(x), 0.0
+                q_low, q_high = P2Quantile(self.low), P2Quantile(self.high)
+            else:
+                n, mean, m2, ewma, ewvar = row[2:7]
+                q_low, q_high = P2Quantile(self.low, json.loads(row[9])), P2Quantile(self.high, json.loads(row[10]))
+            # Welford
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+            # exponentially weighted mean and variance
+            diff = x - ewma
+            incr = self.alpha * diff
+            ewma += incr
+            ewvar = (1 - self.alpha) * (ewvar + diff * incr)
+            q_low.add(float(x))
+            q_high.add(float(x))
+            self.db.execute(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, n, mean, m2, ewma, ewvar, float(x), etl_date, json.dumps(q_low.state()), json.dumps(q_high.state())),
+            )
+        self.db.commit()
+
+
+def partition_metrics(output: str, etl_date: str) -> dict[tuple[str, str], float]:
+    """Metric values of dt={etl_date} for every table with profiles, several runs merged."""
+    fs, root = fsspec.core.url_to_fs(output)
+    by_table = {}
+    for path in fs.glob(f"{root}/*/_metrics/dt={etl_date}/*.json"):
+        with fs.open(path) as f:
+            profile = json.load(f)
+        by_table.setdefault(path[len(root) + 1:].split("/")[0], []).append(profile)
+
+    # dt=D covers rows up to D-1 17:00 UTC
+    window_end = pendulum.parse(etl_date, tz="UTC").subtract(days=1).add(hours=17)
+    metrics = {}
+    for table, profiles in by_table.items():
+        rows = sum(p["row_count"] for p in profiles)
+        metrics[(table, "row_count")] = rows
+        for col in profiles[0]["columns"]:
+            stats = [p["columns"][col] for p in profiles if col in p["columns"]]
+            nulls = sum(s["nulls_count"] for s in stats)
+            metrics[(table, f"{col}.nulls_percent")] = 100.0 * nulls / rows if rows else 0.0
+            if stats[0]["distinct_count"] is not None:
+                hll = HyperLogLog.loads(stats[0]["hll"])
+                for s in stats[1:]:
+                    hll.merge(HyperLogLog.loads(s["hll"]))
+                metrics[(table, f"{col}.distinct_count")] = hll.estimate()
+            if stats[0]["sum"] is not None:
+                total = sum(float(s["sum"]) for s in stats if s["sum"] is not None)
+                metrics[(table, f"{col}.sum")] = total
+                metrics[(table, f"{col}.mean")] = total / (rows - nulls) if rows - nulls else np.nan
+                metrics[(table, f"{col}.min")] = min(float(s["min"]) for s in stats if s["min"] is not None)
+                metrics[(table, f"{col}.max")] = max(float(s["max"]) for s in stats if s["max"] is not None)
+            if col == "last_updated" and any(s["max"] for s in stats):
+                newest = pendulum.parse(max(str(s["max"]) for s in stats if s["max"]), tz="UTC")
+                metrics[(table, "freshness_hours")] = (window_end - newest).total_seconds() / 3600
+    return metrics
+
+
+def evaluate(
+    keys: list[tuple[str, str]],
+    values: np.ndarray,
+    state: dict,
+    min_history: int = 7,
+    z_threshold: float = 3.0,
+    max_change_percent: float = 10.0,
+) -> np.ndarray:
+    """One vectorized pass over all series; returns a structured array of checks per series."""
+    n = state["n"]
+    enough = n >= min_history
+    std = np.sqrt(np.where(n > 1, state["m2"] / np.maximum(n - 1, 1), np.nan))
+    ewstd = np.sqrt(state["ewvar"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.abs(values - state["mean"]) / std
+        ewz = np.abs(values - state["ewma"]) / ewstd
+        change = 100.0 * np.abs(values - state["last_value"]) / np.abs(state["last_value"])
+
+    outside_band = enough & ((values < state["q_low"]) | (values > state["q_high"]))
+    zscore = enough & (z > z_threshold)
+    ewma = enough & (ewz > z_threshold)
+    is_volume = np.array([metric == "row_count" for _, metric in keys])
+    volume_change = is_volume & ~np.isnan(state["last_value"]) & (change > max_change_percent)
+
+    result = np.zeros(
+        len(keys),
+        dtype=[("value", "f8"), ("mean", "f8"), ("z", "f8"), ("ewma_z", "f8"), ("change_percent", "f8"),
+               ("outside_band", "?"), ("zscore", "?"), ("ewma", "?"), ("volume_change", "?"), ("anomaly", "?")],
+    )
+    result["value"], result["mean"], result["z"], result["ewma_z"], result["change_percent"] = values, state["mean"], z, ewz, change
+    result["outside_band"], result["zscore"], result["ewma"], result["volume_change"] = outside_band, zscore, ewma, volume_change
+    # the z-score against the whole history has to agree with the band or the recent trend,
+    # either of those alone is too noisy while the history is short
+    result["anomaly"] = (zscore & (outside_band | ewma)) | volume_change
+    return result
+
+
+def run(output: str, etl_date: str, store: StateStore, **thresholds) -> list[dict]:
+    metrics = partition_metrics(output, etl_date)
+    if not metrics:
+        logger.info(f"no metrics for dt={etl_date}")
+        return []
+    keys = sorted(metrics)
+    values = np.array([metrics[k] for k in keys], dtype=np.float64)
+    state = store.load(keys)
+    result = evaluate(keys, values, state, **thresholds)
+
+    anomalies = []
+    for i in np.flatnonzero(result["anomaly"]):
+        table, metric = keys[i]
+        checks = [c for c in ("outside_band", "zscore", "ewma", "volume_change") if result[c][i]]
+        anomalies.append({
+            "table": table,
+            "metric": metric,
+            "value": float(result["value"][i]),
+            "mean": float(result["mean"][i]),
+            "z": float(result["z"][i]),
+            "change_percent": float(result["change_percent"][i]),
+            "checks": checks,
+        })
+        logger.warning(
+            f"⚠️ dt={etl_date} {table}.{metric} = {result['value'][i]:.4g} "
+            f"(mean {result['mean'][i]:.4g}, z {result['z'][i]:.1f}) {checks}"
+        )
+
+    store.update(keys, values, etl_date)
+    logger.info(f"dt={etl_date}: {len(keys)} series over {len({t for t, _ in keys})} tables, {len(anomalies)} anomalies")
+    return anomalies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="incremental anomaly detection over partition metrics")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="where the _metrics folders are")
+    parser.add_argument("--etl-date", help="dt= partition to evaluate (YYYY-MM-DD)")
+    parser.add_argument("--start", help="first dt= when replaying history")
+    parser.add_argument("--end", help="last dt= when replaying history")
+    parser.add_argument("--min-history", type=int, default=7, help="partitions needed before flagging")
+    parser.add_argument("--z-threshold", type=float, default=3.0)
+    parser.add_argument("--max-change-percent", type=float, default=10.0, help="daily_row_count_change max_percent")
+    parser.add_argument("--anomaly-percent", type=float, default=0.1, help="two-sided tail for the quantile band")
+    args = parser.parse_args()
+
+    tail = args.anomaly_percent / 100 / 2
+    store = StateStore(low=tail, high=1 - tail)
+    thresholds = {"min_history": args.min_history, "z_threshold": args.z_threshold, "max_change_percent": args.max_change_percent}
+    if args.start:
+        day = pendulum.parse(args.start)
+        while day <= pendulum.parse(args.end):
+            run(args.output, day.strftime("%Y-%m-%d"), store, **thresholds)
+            day += timedelta(days=1)
+    else:
+        run(args.output, args.etl_date or pendulum.now("Asia/Jakarta").strftime("%Y-%m-%d"), store, **thresholds)
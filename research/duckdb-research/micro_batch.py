@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import duckdb
+import fsspec
+import pendulum
+from dotenv import load_dotenv
+
+from helpers import setup_duckdb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Micro-batch version of main.py
+# `run` polls every --interval seconds for rows created/updated since the persisted cursor
+# and writes them as small hour-partitioned files:
+#     {table}/dt={etl_date}/hr={HH}/{HHMMSS}-{HHMMSS}.parquet
+# The planned window end is saved with the cursor before its file is written, so a retry after
+# a crash rewrites the same {start}-{end} file instead of adding an overlapping one.
+# `rollup` merges the hr= files of a finished day into the daily layout
+#     {table}/dt={etl_date}/rollup.parquet
+# dt= follows the daily job: dt=D holds the Asia/Jakarta day before D, so hr= is the
+# Jakarta hour of that day.
+#
+# python micro_batch.py run --table b2x_checkout_transaction --interval 600
+# python micro_batch.py rollup --table b2x_checkout_transaction --etl-date 2025-10-08
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_dir = Path(".state/micro_batch")
+
+# rows committed in the last few seconds may still be invisible to our snapshot,
+# stay behind "now" so the cursor never skips them
+SAFETY_LAG = pendulum.duration(seconds=30)
+
+
+def etl_date_of(ts: pendulum.DateTime) -> str:
+    return ts.in_timezone("Asia/Jakarta").add(days=1).strftime("%Y-%m-%d")
+
+
+def _load_state(psql_table: str) -> dict:
+    path = state_dir / f"{psql_table}.json"
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def load_cursor(psql_table: str) -> pendulum.DateTime:
+    state = _load_state(psql_table)
+    if "cursor" in state:
+        return pendulum.parse(state["cursor"])
+    # first run starts at the beginning of the current Jakarta day
+    return pendulum.now("Asia/Jakarta").start_of("day").in_timezone("UTC")
+
+
+def load_pending_end(psql_table: str) -> pendulum.DateTime | None:
+    """End of a window that was planned but not confirmed written."""
+    pending = _load_state(psql_table).get("pending_end")
+    return pendulum.parse(pending) if pending else None
+
+
+def save_cursor(psql_table: str, cursor: pendulum.DateTime, pending_end: pendulum.DateTime | None = None) -> None:
+    state_dir.mkdir(parents=True, exist_ok=True)
+    path = state_dir / f"{psql_table}.json"
+    tmp = path.with_suffix(".tmp")
+    state = {"cursor": cursor.to_iso8601_string()}
+    if pending_end is not None:
+        state["pending_end"] = pending_end.to_iso8601_string()
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+
+def next_window(cursor: pendulum.DateTime, now: pendulum.DateTime):
+    """[cursor, end) capped at `now - SAFETY_LAG` and at the next hour boundary, so every
+    file belongs to exactly one hr= partition."""
+    end = min(now - SAFETY_LAG, cursor.start_of("hour").add(hours=1))
+    return (cursor, end) if end > cursor else None
+
+
+def write_micro_batch(duck_conn, psql_table: str, output: str, start, end) -> int:
+    jakarta_start = start.in_timezone("Asia/Jakarta")
+    path = (
+        f"{output}/{psql_table}/dt={etl_date_of(start)}/hr={jakarta_start.strftime('%H')}/"
+        f"{jakarta_start.strftime('%H%M%S')}-{end.in_timezone('Asia/Jakarta').strftime('%H%M%S')}.parquet"
+    )
+    query_params = {
+        "psql_dstart": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "psql_dend": end.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    data_query = f"""
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE created >= $psql_dstart AND created < $psql_dend
+
+        UNION ALL
+
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE last_updated >= $psql_dstart AND last_updated < $psql_dend
+    """
+    fs, fs_path = fsspec.core.url_to_fs(path)
+    fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+    # file name comes from the window, which is persisted before this runs, so a retry after a
+    # crash rewrites the same file
+    rows = duck_conn.execute(
+        f"COPY ({data_query}) TO '{path}' (FORMAT PARQUET, COMPRESSION zstd)",
+        query_params,
+    ).fetchone()[0]
+    logger.info(f"{psql_table} [{query_params['psql_dstart']}, {query_params['psql_dend']}): {rows} rows -> {path}")
+    return rows
+
+
+def run(psql_table: str, output: str, interval: int, once: bool = False) -> None:
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+        while True:
+            tick = time.monotonic()
+            cursor = load_cursor(psql_table)
+            pending_end = load_pending_end(psql_table)
+            # catch up hour by hour when we are behind (first run, downtime)
+            while window := (cursor, pending_end) if pending_end else next_window(cursor, pendulum.now("UTC")):
+                save_cursor(psql_table, cursor, pending_end=window[1])
+                write_micro_batch(duck_conn, psql_table, output, *window)
+                cursor, pending_end = window[1], None
+                save_cursor(psql_table, cursor)
+            if once:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - tick)))
+
+
+def rollup(psql_table: str, output: str, etl_date: str) -> None:
+    """Merges dt={etl_date}/hr=*/ into one daily file and drops the hourly files.
+
+    The daily file is written before the hourly files are deleted, so a reader listing the
+    partition recursively in between sees the day twice; readers of the daily layout
+    (`dt=*/*.parquet`) never see hr= files.
+    Safe to rerun: the daily file has a fixed name and `_rollup.json` records that it is
+    complete, a rerun after a crash during the deletes only finishes deleting.
+    """
+    day_end = pendulum.parse(etl_date, tz="Asia/Jakarta").in_timezone("UTC")
+    if load_cursor(psql_table) < day_end:
+        raise ValueError(f"dt={etl_date} is not complete yet, cursor is before {day_end}")
+
+    fs, root = fsspec.core.url_to_fs(f"{output}/{psql_table}/dt={etl_date}")
+    hourly = fs.glob(f"{root}/hr=*/*.parquet")
+    marker = f"{root}/_rollup.json"
+    if not hourly:
+        if fs.exists(marker):
+            fs.rm(marker)
+        logger.info(f"nothing to roll up for dt={etl_date}")
+        return
+
+    daily_path = f"{output}/{psql_table}/dt={etl_date}/rollup.parquet"
+    if fs.exists(marker):
+        logger.info(f"{daily_path} is already complete, finishing the deletes of a previous rollup")
+    else:
+        with duckdb.connect() as duck_conn:
+            setup_duckdb(duck_conn)
+            rows = duck_conn.execute(
+                f"""
+                COPY (
+                    SELECT * FROM read_parquet('{output}/{psql_table}/dt={etl_date}/hr=*/*.parquet', hive_partitioning = false)
+                ) TO '{daily_path}' (FORMAT PARQUET, COMPRESSION zstd)
+                """
+            ).fetchone()[0]
+        fs.pipe(marker, json.dumps({"rows": rows, "hourly_files": len(hourly)}).encode())
+        logger.info(f"rolled up {len(hourly)} hourly files ({rows} rows) into {daily_path}")
+
+    fs.rm([f"{root}/{d}" for d in {p[len(root) + 1:].split("/")[0] for p in hourly}], recursive=True)
+    fs.rm(marker)
+    logger.info("✅ hourly files removed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="micro-batch ingestion from postgres")
+    parser.add_argument("command", choices=["run", "rollup"])
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--interval", type=int, default=600, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="catch up once and exit")
+    parser.add_argument("--etl-date", help="dt= partition to roll up (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.table, args.output, args.interval, once=args.once)
+    else:
+        rollup(args.table, args.output, args.etl_date)
@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import math
+import time
+
+import fsspec
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# PII verdicts for text columns, computed on the arrow batches the writer already has in memory
+# instead of DQOps' "Profile text columns to detect PII values" pattern scanning every value
+# after load.
+#   - every batch of a text column contributes a Bernoulli sample (--sample / --min-values of
+#     its values), so the sample is spread over the whole stream read so far and keeps growing
+#   - the sample is scanned with arrow's RE2 kernels (pc.match_substring_regex / extract_regex,
+#     repeated on the rest of the value so every match counts), NIK dates and card Luhn
+#     checksums are validated with numpy on the extracted digits
+#   - a 16 digit number that is both a valid NIK and Luhn valid goes to whichever of the two the
+#     column's unambiguous values point to: a NIK passes Luhn one time in ten, a card always does
+#   - from --min-values values on, a column is settled as soon as the Wilson interval of every
+#     detector's match rate is clearly below or above --pii-threshold; settled columns are not
+#     sampled any more and once all are settled update() is a no-op, so wide free-text/json
+#     tables stop paying early. PII that only shows up after a column settled is missed, raise
+#     --min-values for columns that change content over time
+# One json per table, next to the schema json main.py writes:
+#     {table}/schema/pii_profile.json
+#
+# python pii_profile.py /tmp/lake/b2x_checkout_transaction/dt=2025-10-08/*.parquet --compare
+
+SAMPLE_SIZE = 10_000  # values sampled per column by the time it has seen MIN_VALUES
+MIN_VALUES = 100_000  # values a column must have seen before it can settle
+THRESHOLD = 0.01  # share of values matching a detector above which a column is flagged
+Z = 1.96  # 95% Wilson interval
+
+DETECTORS = {
+    # DQOps profile_contains_email_percent
+    "email": r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}",
+    # mobile numbers: +62 / 62 / 0, then 8xx and 7-11 more digits, optional space/dash separators
+    "phone_id": r"(?:^|[^0-9])(?:\+62|62|0)[ -]?8[1-9](?:[ -]?[0-9]){6,10}(?:[^0-9]|$)",
+    # 16 digit NIK: province (11-94), regency, district, DDMMYY (DD + 40 for women), serial
+    "nik": r"(?:^|[^0-9])(?P<nik>[1-9][0-9]{15})(?:[^0-9]|$)",
+    # 13-19 digit card numbers starting like visa/mastercard/amex/jcb/discover, Luhn checked
+    "card": r"(?:^|[^0-9])(?P<card>[2-6](?:[ -]?[0-9]){12,18})(?:[^0-9]|$)",
+}
+
+
+def _wilson(hits: int, n: int) -> tuple[float, float]:
+    if not n:
+        return 0.0, 1.0
+    p = hits / n
+    centre = p + Z**2 / (2 * n)
+    margin = Z * math.sqrt(p * (1 - p) / n + Z**2 / (4 * n**2))
+    denom = 1 + Z**2 / n
+    return max(0.0, (centre - margin) / denom), min(1.0, (centre + margin) / denom)
+
+
+def _luhn_valid(digits: np.ndarray) -> np.ndarray:
+    """Luhn check over an array of digit strings (13-19 chars)."""
+    if not len(digits):
+        return np.zeros(0, dtype=bool)
+    # right-align into a fixed 19 wide matrix, leading zeros don't change the checksum
+    padded = np.char.rjust(digits.astype("U19"), 19, "0")
+    d = padded.view(np.uint32).reshape(-1, 19).astype(np.int64) - ord("0")
+    # every second digit from the right is doubled
+    doubled = (18 - np.arange(19)) % 2 == 1
+    d[:, doubled] *= 2
+    d[d > 9] -= 9
+    return d.sum(axis=1) % 10 == 0
+
+
+def _nik_valid(digits: np.ndarray) -> np.ndarray:
+    """16 digit strings with a non zero province and a valid DDMMYY (DD + 40 for women)."""
+    valid = np.char.str_len(digits.astype(str)) == 16
+    if valid.any():
+        d = digits[valid].astype("U16").view(np.uint32).reshape(-1, 16).astype(np.int64) - ord("0")
+        dd = (d[:, 6] * 10 + d[:, 7]) % 40
+        mm = d[:, 8] * 10 + d[:, 9]
+        valid[valid] = (d[:, 0] > 0) & (dd >= 1) & (dd <= 31) & (mm >= 1) & (mm <= 12)
+    return valid
+
+
+def _all_matches(values: pa.Array, pattern: str, group: str) -> tuple[np.ndarray, np.ndarray]:
+    """Every match of `group` in `values`, as (value index, matched text) arrays."""
+    # extract_regex only returns the leftmost match, so the rest of each matching value is
+    # searched again until nothing matches; detectors consume the separator after a match,
+    # the rest starts right behind it and ^ takes over as the boundary
+    regex = f"(?s)^.*?{pattern}(?P<rest>.*)$"
+    index = np.arange(len(values))
+    rows, found = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=str)]
+    while len(values):
+        matched = pc.extract_regex(values, regex)
+        hit = matched.is_valid().to_numpy(zero_copy_only=False)
+        if not hit.any():
+            break
+        taken = pa.array(np.flatnonzero(hit))
+        index = index[hit]
+        rows.append(index)
+        found.append(matched.field(group).take(taken).to_numpy(zero_copy_only=False).astype(str))
+        values = matched.field("rest").take(taken)
+    return np.concatenate(rows), np.concatenate(found)
+
+
+def detect(values: pa.Array) -> dict:
+    """Number of values matching each detector, plus values only matching as NIK and card at once.
+
+    The raw counts add up across batches, resolve() turns them into one count per detector.
+    """
+    values = values.drop_null()
+    if isinstance(values.type, pa.ExtensionType):
+        values = values.storage
+    hits = {"email": int(pc.sum(pc.match_substring_regex(values, DETECTORS["email"])).as_py() or 0)}
+    hits["phone_id"] = int(pc.sum(pc.match_substring_regex(values, DETECTORS["phone_id"])).as_py() or 0)
+
+    nik_rows, nik = _all_matches(values, DETECTORS["nik"], "nik")
+    card_rows, card = _all_matches(values, DETECTORS["card"], "card")
+    card = pc.replace_substring_regex(pa.array(card), r"[ -]", "").to_numpy(zero_copy_only=False).astype(str)
+    nik_ok = _nik_valid(nik)
+    card_ok = _luhn_valid(card)
+    # the same digits pass both checks, a card pattern match starts with 2-6
+    nik_both = nik_ok & np.isin(nik.astype("U1"), list("23456")) & _luhn_valid(nik)
+    card_both = card_ok & _nik_valid(card)
+
+    is_nik = np.zeros(len(values), dtype=bool)
+    is_nik[nik_rows[nik_ok & ~nik_both]] = True
+    is_card = np.zeros(len(values), dtype=bool)
+    is_card[card_rows[card_ok & ~card_both]] = True
+    is_both = np.zeros(len(values), dtype=bool)
+    is_both[nik_rows[nik_both]] = True
+    is_both[card_rows[card_both]] = True
+    hits["nik"] = int(np.count_nonzero(is_nik))
+    hits["card"] = int(np.count_nonzero(is_card))
+    hits["nik_or_card"] = int(np.count_nonzero(is_both & ~is_nik & ~is_card))
+    return hits
+
+
+def resolve(hits: dict) -> dict:
+    """One count per detector, values that are both a valid NIK and a valid card go to one side.
+
+    Only one NIK in ten passes Luhn, so when the ambiguous values outnumber the NIK-only ones
+    the column holds card numbers.
+    """
+    hits = dict(hits)
+    ambiguous = hits.pop("nik_or_card")
+    hits["card" if ambiguous > hits["nik"] else "nik"] += ambiguous
+    return hits
+
+
+def _text_type(t: pa.DataType) -> bool:
+    if isinstance(t, pa.ExtensionType):
+        t = t.storage_type
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
+
+
+class StreamSample:
+    """Raw detector counts over a Bernoulli sample of every batch of one column."""
+
+    def __init__(self, rate: float, rng: np.random.Generator):
+        self.rate = rate
+        self.rng = rng
+        self.seen = 0
+        self.sampled = 0
+        self.hits = dict.fromkeys([*DETECTORS, "nik_or_card"], 0)
+
+    def add(self, arr: pa.Array) -> None:
+        arr = arr.drop_null()
+        n = len(arr)
+        if not n:
+            return
+        picked = np.flatnonzero(self.rng.random(n) < self.rate)
+        if len(picked):
+            for kind, count in detect(arr.take(pa.array(picked))).items():
+                self.hits[kind] += count
+            self.sampled += len(picked)
+        self.seen += n
+
+
+class PIIProfiler:
+    def __init__(
+        self,
+        schema: pa.Schema,
+        sample_size: int = SAMPLE_SIZE,
+        threshold: float = THRESHOLD,
+        seed: int | None = None,
+        min_values: int = MIN_VALUES,
+    ):
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self.min_values = min_values
+        rate = min(1.0, sample_size / min_values)
+        self.columns = {field.name: StreamSample(rate, rng) for field in schema if _text_type(field.type)}
+        self.verdicts = {}
+        self.rows = 0
+        self._next_check = {name: min_values for name in self.columns}
+
+    @property
+    def done(self) -> bool:
+        return len(self.verdicts) == len(self.columns)
+
+    def update(self, batch: pa.RecordBatch) -> None:
+        if self.done:
+            return
+        self.rows += batch.num_rows
+        for name, sample in self.columns.items():
+            if name in self.verdicts:
+                continue
+            sample.add(batch.column(name))
+            # check once min_values went through, then every time the stream doubles; the sample
+            # doubles along with it, so the interval keeps narrowing for uncertain columns
+            if sample.seen >= self._next_check[name]:
+                self._next_check[name] = sample.seen * 2
+                verdict = self._evaluate(sample)
+                if verdict["verdict"] != "uncertain":
+                    verdict["settled_after_rows"] = self.rows
+                    self.verdicts[name] = verdict
+                    logger.info(f"pii: {name} settled as {verdict['verdict']} after {self.rows} rows")
+
+    def _evaluate(self, sample: StreamSample) -> dict:
+        n = sample.sampled
+        hits = resolve(sample.hits)
+        detectors, flagged, uncertain = {}, [], False
+        for kind, count in hits.items():
+            lower, upper = _wilson(count, n)
+            detectors[kind] = {"matches": count, "percent": 100.0 * count / n if n else 0.0, "ci95": [lower, upper]}
+            if lower > self.threshold:
+                flagged.append(kind)
+            elif upper >= self.threshold:
+                uncertain = True
+        return {
+            "verdict": "pii" if flagged else "uncertain" if uncertain else "clean",
+            "pii_types": flagged,
+            "values_seen": sample.seen,
+            "values_sampled": n,
+            "detectors": detectors,
+        }
+
+    def to_dict(self) -> dict:
+        columns = {}
+        for name, sample in self.columns.items():
+            if name in self.verdicts:
+                columns[name] = self.verdicts[name]
+            else:
+                # never settled: verdict from the final sample, still flag likely hits
+                verdict = self._evaluate(sample)
+                verdict["pii_types"] = [
+                    kind for kind, d in verdict["detectors"].items() if d["matches"] / max(sample.sampled, 1) > self.threshold
+                ]
+                if verdict["pii_types"]:
+                    verdict["verdict"] = "pii"
+                columns[name] = verdict
+        return {
+            "rows_seen": self.rows,
+            "sample_size": self.sample_size,
+            "min_values": self.min_values,
+            "threshold_percent": 100.0 * self.threshold,
+            "pii_columns": sorted(n for n, c in columns.items() if c["verdict"] == "pii"),
+            "columns": columns,
+        }
+
+    def write(self, path: str, **extra) -> None:
+        fs, fs_path = fsspec.core.url_to_fs(path)
+        fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+        with fs.open(fs_path, "w") as f:
+            json.dump({**extra, **self.to_dict()}, f, indent=2)
+        logger.info(f"pii profile written to {path}")
+
+
+def full_scan(table: pa.Table) -> dict:
+    """Every value through the same detectors, what the DQOps profiling checks do after load."""
+    return {
+        field.name: resolve(detect(pa.concat_arrays([c.cast(pa.large_string()) for c in table.column(field.name).chunks])))
+        for field in table.schema
+        if _text_type(field.type)
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="sampled PII verdicts for the text columns of parquet files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--sample", type=int, default=SAMPLE_SIZE, help="values sampled per column by --min-values")
+    parser.add_argument("--min-values", type=int, default=MIN_VALUES, help="values seen before a column can settle")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--batch-rows", type=int, default=100_000)
+    parser.add_argument("--compare", action="store_true", help="also run a full scan and compare")
+    args = parser.parse_args()
+
+    dataset = pq.ParquetDataset(args.files)
+    table = dataset.read()
+    profiler = PIIProfiler(table.schema, args.sample, args.threshold, min_values=args.min_values)
+    tick = time.perf_counter()
+    for batch in table.to_batches(args.batch_rows):
+        profiler.update(batch)
+        if profiler.done:
+            break
+    sampled_s = time.perf_counter() - tick
+    result = profiler.to_dict()
+    logger.info(f"✅ pii columns: {result['pii_columns']} ({sampled_s:.2f}s sampled, {table.num_rows} rows)")
+
+    if args.compare:
+        tick = time.perf_counter()
+        full = full_scan(table)
+        full_s = time.perf_counter() - tick
+        for name, hits in full.items():
+            non_null = table.num_rows - table.column(name).null_count
+            flagged = sorted(kind for kind, count in hits.items() if non_null and count / non_null > args.threshold)
+            sampled = sorted(result["columns"][name]["pii_types"])
+            logger.info(f"  {name}: full scan {flagged}, sampled {sampled}{'' if flagged == sampled else '  <- differs'}")
+        logger.info(f"full scan {full_s:.2f}s, sampled {sampled_s:.2f}s ({100 * sampled_s / full_s:.1f}% of full scan)")
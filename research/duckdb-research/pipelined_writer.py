@@ -0,0 +1,289 @@
+import argparse
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import duckdb
+import fsspec
+import pendulum
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from column_profile import ColumnProfiler
+from helpers import setup_duckdb
+from pii_profile import PIIProfiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Pipelined version of main.py's extract -> COPY TO gs:// flow
+# Three stages connected by bounded queues, so postgres reads, parquet encoding and uploads
+# overlap instead of running one after another:
+#   extract: record batches from postgres through duckdb
+#   encode:  batches -> parquet parts of ~--part-rows rows in a local staging dir
+#   upload:  --uploaders threads push finished parts with fsspec (gcsfs does resumable
+#            multipart uploads for big files) and delete the local copy
+# Parts land flat in the partition like main.py's files, {table}/dt={etl_date}/{HHMMSS}-part-N.parquet;
+# if any stage fails the parts of the run already uploaded are removed again before the error
+# is raised, so readers never see half a run.
+# The queues are bounded, so a slow stage stalls the ones before it instead of piling
+# batches up in memory or parts up on disk.
+# With --profile the encode stage also feeds every batch to column_profile.ColumnProfiler
+# and writes {table}/_metrics/dt={etl_date}/{run}.json next to the data.
+# With --pii text columns are sampled by pii_profile.PIIProfiler until every column has a
+# verdict, written to {table}/schema/pii_profile.json next to the schema json.
+#
+# python pipelined_writer.py --table b2x_checkout_transaction --etl-date 2025-10-08
+# python pipelined_writer.py --table b2x_checkout_transaction --etl-date 2025-10-08 --output /tmp/lake
+# python pipelined_writer.py --table b2x_checkout_transaction --etl-date 2025-10-08 --profile --profile-date-column created
+# python pipelined_writer.py --table b2x_checkout_transaction --etl-date 2025-10-08 --pii
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+
+_DONE = object()
+
+
+class Pipeline:
+    def __init__(
+        self,
+        output_dir: str,
+        prefix: str,
+        part_rows: int,
+        uploaders: int,
+        queue_size: int,
+        staging_dir: str | None,
+        profiler: ColumnProfiler | None = None,
+        pii: PIIProfiler | None = None,
+    ):
+        self.output_dir = output_dir.rstrip("/")
+        self.prefix = prefix
+        self.profiler = profiler
+        self.pii = pii
+        self.part_rows = part_rows
+        self.uploaders = uploaders
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.parts = queue.Queue(maxsize=queue_size)
+        self.staging_dir = tempfile.mkdtemp(prefix="pipelined-", dir=staging_dir)
+        self.failed = threading.Event()
+        self.errors = []
+        self.stats = {"rows": 0, "parts": 0, "bytes": 0, "extract_s": 0.0, "encode_s": 0.0, "upload_s": 0.0}
+        self.lock = threading.Lock()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # a blocking put would hang forever once the consumer died
+        while not self.failed.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.failed.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, stage: str, e: Exception) -> None:
+        logger.error(f"{stage} stage failed: {e}")
+        self.errors.append(e)
+        self.failed.set()
+
+    def extract(self, reader) -> None:
+        try:
+            while True:
+                tick = time.monotonic()
+                try:
+                    batch = reader.read_next_batch()
+                except StopIteration:
+                    break
+                self.stats["extract_s"] += time.monotonic() - tick
+                if batch.num_rows and not self._put(self.batches, batch):
+                    return
+        except Exception as e:
+            self._fail("extract", e)
+        finally:
+            self._put(self.batches, _DONE)
+
+    def encode(self, schema) -> None:
+        writer, path, rows = None, None, 0
+        try:
+            while (batch := self._get(self.batches)) is not _DONE:
+                tick = time.monotonic()
+                if writer is None:
+                    path = os.path.join(self.staging_dir, f"part-{self.stats['parts']:05d}.parquet")
+                    writer = pq.ParquetWriter(path, schema, compression="zstd")
+                writer.write_batch(batch)
+                if self.profiler is not None:
+                    self.profiler.update(batch)
+                if self.pii is not None and not self.pii.done:
+                    self.pii.update(batch)
+                rows += batch.num_rows
+                if rows >= self.part_rows:
+                    writer.close()
+                    self._finish_part(path, rows)
+                    writer, rows = None, 0
+                self.stats["encode_s"] += time.monotonic() - tick
+                if self.failed.is_set():
+                    return
+            if writer is not None:
+                writer.close()
+                self._finish_part(path, rows)
+        except Exception as e:
+            self._fail("encode", e)
+        finally:
+            for _ in range(self.uploaders):
+                self._put(self.parts, _DONE)
+
+    def _finish_part(self, path: str, rows: int) -> None:
+        self.stats["parts"] += 1
+        self.stats["rows"] += rows
+        self._put(self.parts, path)
+
+    def upload(self) -> None:
+        fs, root = fsspec.core.url_to_fs(self.output_dir)
+        try:
+            while (path := self._get(self.parts)) is not _DONE:
+                tick = time.monotonic()
+                size = os.path.getsize(path)
+                fs.put_file(path, f"{root}/{self.prefix}-{os.path.basename(path)}")
+                os.remove(path)
+                with self.lock:
+                    self.stats["bytes"] += size
+                    self.stats["upload_s"] += time.monotonic() - tick
+                logger.info(f"uploaded {self.prefix}-{os.path.basename(path)} ({size / 1024**2:.1f} MB)")
+        except Exception as e:
+            self._fail("upload", e)
+
+    def run(self, reader) -> dict:
+        fs, root = fsspec.core.url_to_fs(self.output_dir)
+        fs.makedirs(root, exist_ok=True)
+        threads = [
+            threading.Thread(target=self.extract, args=(reader,), name="extract"),
+            threading.Thread(target=self.encode, args=(reader.schema,), name="encode"),
+            *[threading.Thread(target=self.upload, name=f"upload-{i}") for i in range(self.uploaders)],
+        ]
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+        if self.errors:
+            uploaded = fs.glob(f"{root}/{self.prefix}-part-*.parquet")
+            if uploaded:
+                fs.rm(uploaded)
+                logger.warning(f"removed {len(uploaded)} parts already uploaded by the failed run")
+            raise self.errors[0]
+        return self.stats
+
+
+def run(
+    psql_table: str,
+    etl_date: str,
+    output: str,
+    part_rows: int = 1_000_000,
+    batch_rows: int = 100_000,
+    uploaders: int = 4,
+    queue_size: int = 4,
+    staging_dir: str | None = None,
+    profile: bool = False,
+    profile_date_column: str | None = None,
+    pii: bool = False,
+    pii_sample: int = 10_000,
+) -> dict:
+    date = pendulum.parse(etl_date, tz="Asia/Jakarta")
+    query_params = {
+        "psql_dstart": (date - timedelta(days=2)).strftime("%Y-%m-%d 17:00:00"),
+        "psql_dend": (date - timedelta(days=1)).strftime("%Y-%m-%d 17:00:00"),
+    }
+    data_query = f"""
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE created >= $psql_dstart AND created < $psql_dend
+
+        UNION ALL
+
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE last_updated >= $psql_dstart AND last_updated < $psql_dend
+    """
+    # parts of one run share the {HHMMSS} prefix, a rerun writes a new set next to the old one
+    # like main.py's {HHMMSS}.parquet files do
+    run_id = pendulum.now().strftime("%H%M%S")
+    output_dir = f"{output}/{psql_table}/dt={etl_date}"
+
+    started = time.time()
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+        reader = duck_conn.execute(data_query, query_params).fetch_record_batch(batch_rows)
+        profiler = ColumnProfiler(reader.schema, profile_date_column) if profile else None
+        pii_profiler = PIIProfiler(reader.schema, pii_sample) if pii else None
+        stats = Pipeline(output_dir, run_id, part_rows, uploaders, queue_size, staging_dir, profiler, pii_profiler).run(reader)
+
+    if profiler is not None:
+        profiler.write(
+            f"{output}/{psql_table}/_metrics/dt={etl_date}/{run_id}.json",
+            table=psql_table,
+            etl_date=etl_date,
+            run_id=run_id,
+        )
+
+    if pii_profiler is not None:
+        pii_profiler.write(
+            f"{output}/{psql_table}/schema/pii_profile.json",
+            table=psql_table,
+            etl_date=etl_date,
+            run_id=run_id,
+        )
+
+    wall = time.time() - started
+    logger.info(
+        f"✅ {stats['rows']} rows in {stats['parts']} parts ({stats['bytes'] / 1024**2:.1f} MB) "
+        f"-> {output_dir}/{run_id}-part-*.parquet in {wall:.1f}s; stage time extract {stats['extract_s']:.1f}s, "
+        f"encode {stats['encode_s']:.1f}s, upload {stats['upload_s']:.1f}s "
+        f"(summed over {uploaders} uploaders)"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="overlapped extract / encode / upload")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", required=True, help="dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--part-rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-rows", type=int, default=100_000)
+    parser.add_argument("--uploaders", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=4, help="max items waiting between two stages")
+    parser.add_argument("--staging-dir", help="local dir for parts waiting to be uploaded")
+    parser.add_argument("--profile", action="store_true", help="write column profiles for DQ checks")
+    parser.add_argument("--profile-date-column", help="timestamp column for rows_by_day, e.g. created")
+    parser.add_argument("--pii", action="store_true", help="write sampled PII verdicts for text columns")
+    parser.add_argument("--pii-sample", type=int, default=10_000, help="values sampled per text column by the time it can settle")
+    args = parser.parse_args()
+
+    run(
+        args.table,
+        args.etl_date,
+        args.output,
+        args.part_rows,
+        args.batch_rows,
+        args.uploaders,
+        args.queue_size,
+        args.staging_dir,
+        args.profile,
+        args.profile_date_column,
+        args.pii,
+        args.pii_sample,
+    )
@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import duckdb
+import fsspec
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Result cache for repeated adhoc DuckDB queries
+# A result is stored as parquet under a key made of
+#   - the normalized SQL (comments dropped, whitespace collapsed, case folded outside literals)
+#   - the bound parameters
+#   - a fingerprint of the sources: path + size + ETag/mtime of every file matched by the
+#     read_parquet('...') globs in the query (or passed in `sources`), and for `ducklake:<alias>`
+#     sources the current DuckLake snapshot id
+# A new file in a dt= partition, an overwritten file or a new lake snapshot changes the
+# fingerprint, so stale results are never served; the entry it replaced is dropped right away.
+# Sources are found in duckdb's own parse tree (file reading table functions and quoted file
+# paths). A query over anything else - pg.* tables, duckdb tables, views, other table
+# functions - has no fingerprint and runs uncached unless `sources` is passed explicitly.
+# Eviction: `lru` drops least recently used results above max_bytes, `ttl` also drops
+# anything older than max_age seconds.
+#
+#     cache = QueryCache()
+#     table = cache.query(duck_conn, "SELECT status, count(*) FROM read_parquet('gs://bucket/t/dt=*/*.parquet') GROUP BY 1")
+#
+# python query_cache.py --sql "SELECT count(*) FROM read_parquet('/tmp/lake/t/*/*.parquet')"
+
+default_cache_dir = os.path.expanduser("~/.cache/duckdb-research/results")
+
+_TOKENS = re.compile(r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|(--[^\n]*|/\*.*?\*/)|(\s+)", re.S)
+_FILE_FUNCTIONS = {"read_parquet", "parquet_scan", "read_csv", "read_csv_auto", "read_json", "read_json_auto"}
+
+
+def normalize_sql(sql: str) -> str:
+    parts, last = [], 0
+    for m in _TOKENS.finditer(sql):
+        if m.start() > last:
+            parts.append(sql[last:m.start()].lower())
+        if m.group(1) or m.group(2):
+            parts.append(m.group(0))
+        elif parts and not parts[-1].endswith(" "):
+            # comments and whitespace runs become a single space
+            parts.append(" ")
+        last = m.end()
+    parts.append(sql[last:].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _constants(node: dict) -> list | None:
+    """String constants of a literal or a list literal, None for anything computed."""
+    if node.get("class") == "CONSTANT" and node["value"]["type"]["id"] == "VARCHAR":
+        return [node["value"]["value"]]
+    if node.get("class") == "FUNCTION" and node.get("function_name") == "list_value":
+        values = [_constants(child) for child in node["children"]]
+        return None if None in values else [v for vs in values for v in vs]
+    return None
+
+
+def scan_sources(sql: str) -> tuple[list[str], list[str]]:
+    """(files the query reads, relations that are not files) from duckdb's parse tree."""
+    with duckdb.connect() as conn:
+        tree = json.loads(conn.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    if tree.get("error"):
+        return [], [f"unparsable: {tree.get('error_message')}"]
+
+    files, others, ctes, tables = set(), set(), set(), []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if "cte_map" in node:
+            ctes.update(entry["key"] for entry in node["cte_map"]["map"])
+        if node.get("type") == "BASE_TABLE":
+            tables.append(node)
+        elif node.get("type") == "TABLE_FUNCTION":
+            function = node["function"]
+            paths = _constants(function["children"][0]) if function.get("children") else None
+            if function["function_name"] in _FILE_FUNCTIONS and paths:
+                files.update(paths)
+            else:
+                others.add(f"{function['function_name']}(...)")
+        stack.extend(node.values())
+
+    for table in tables:
+        name = table["table_name"]
+        if not table["catalog_name"] and not table["schema_name"] and ("/" in name or re.search(r"\.\w+$", name)):
+            files.add(name)  # FROM 'path/to/file.parquet'
+        elif table["catalog_name"] or table["schema_name"] or name not in ctes:
+            others.add(".".join(p for p in (table["catalog_name"], table["schema_name"], name) if p))
+    return sorted(files), sorted(others)
+
+
+def detect_sources(sql: str) -> list[str]:
+    return scan_sources(sql)[0]
+
+
+def source_fingerprint(duck_conn, sources: list[str]) -> str:
+    entries = []
+    for source in sources:
+        if source.startswith("ducklake:"):
+            alias = source.split(":", 1)[1]
+            snapshot = duck_conn.sql(f"SELECT max(snapshot_id) FROM ducklake_snapshots('{alias}')").fetchone()[0]
+            entries.append(f"{source}@{snapshot}")
+            continue
+        fs, _ = fsspec.core.url_to_fs(source)
+        for path, info in sorted(fs.glob(fs._strip_protocol(source), detail=True).items()):
+            version = info.get("etag") or info.get("ETag") or info.get("generation") or info.get("mtime") or info.get("updated")
+            entries.append(f"{path}|{info.get('size')}|{version}")
+    return hashlib.sha256("\n".join(entries).encode()).hexdigest()
+
+
+class QueryCache:
+    def __init__(
+        self,
+        cache_dir: str = default_cache_dir,
+        max_bytes: int = 2 * 1024**3,
+        policy: str = "lru",
+        max_age: float = 24 * 3600,
+    ):
+        if policy not in ("lru", "ttl"):
+            raise ValueError(f"unknown eviction policy `{policy}`, use lru or ttl")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                query_key TEXT,
+                sql TEXT,
+                size INTEGER,
+                created REAL,
+                last_access REAL
+            )
+        """)
+        self.db.commit()
+        self.hits = self.misses = 0
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def _drop(self, key: str) -> None:
+        self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        if self.policy == "ttl":
+            for (key,) in self.db.execute(
+                "SELECT key FROM results WHERE created < ?", (time.time() - self.max_age,)
+            ).fetchall():
+                self._drop(key)
+        total = self.db.execute("SELECT coalesce(sum(size), 0) FROM results").fetchone()[0]
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._drop(key)
+            total -= size
+
+    def query(self, duck_conn, sql: str, params: dict | list | None = None, sources: list[str] | None = None):
+        """Result of `sql` as a pyarrow Table, from the cache when sources didn't change."""
+        normalized = normalize_sql(sql)
+        query_key = hashlib.sha256(
+            (normalized + "\0" + json.dumps(params, sort_keys=True, default=str)).encode()
+        ).hexdigest()
+        if sources is None:
+            sources, others = scan_sources(sql)
+            if others or not sources:
+                # no way to tell when the result goes stale
+                logger.warning(f"not caching, the query reads {others or 'no files'}; pass sources= to cache it")
+                self.misses += 1
+                return duck_conn.execute(sql, params).fetch_arrow_table() if params else duck_conn.sql(sql).fetch_arrow_table()
+        key = hashlib.sha256(f"{query_key}\0{source_fingerprint(duck_conn, sources)}".encode()).hexdigest()
+
+        with self.lock:
+            found = self.db.execute("SELECT created FROM results WHERE key = ?", (key,)).fetchone()
+            if found and self.policy == "ttl" and time.time() - found[0] > self.max_age:
+                self._drop(key)
+                found = None
+            if found:
+                self.db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+        if found:
+            try:
+                table = pq.read_table(self._file(key))
+                self.hits += 1
+                logger.info(f"result cache hit {key[:12]}")
+                return table
+            except FileNotFoundError:
+                pass
+
+        self.misses += 1
+        tick = time.perf_counter()
+        table = duck_conn.execute(sql, params).fetch_arrow_table() if params else duck_conn.sql(sql).fetch_arrow_table()
+        logger.info(f"result cache miss {key[:12]}, query took {time.perf_counter() - tick:.2f}s")
+
+        tmp = f"{self._file(key)}.{threading.get_ident()}.tmp"
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, self._file(key))
+        with self.lock:
+            # same query over older versions of the sources can never be hit again
+            for (old,) in self.db.execute(
+                "SELECT key FROM results WHERE query_key = ? AND key != ?", (query_key, key)
+            ).fetchall():
+                self._drop(old)
+            now = time.time()
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query_key, normalized, os.path.getsize(self._file(key)), now, now),
+            )
+            self._evict()
+            self.db.commit()
+        return table
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.db.execute("SELECT count(*), coalesce(sum(size), 0) FROM results").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a query through the result cache")
+    parser.add_argument("--sql", required=True)
+    parser.add_argument("--params", help="JSON object of named parameters")
+    parser.add_argument("--source", action="append", help="override detected sources, e.g. ducklake:psql_ducklake")
+    parser.add_argument("--cache-dir", default=default_cache_dir)
+    parser.add_argument("--policy", choices=["lru", "ttl"], default="lru")
+    parser.add_argument("--max-gb", type=float, default=2)
+    parser.add_argument("--max-age", type=float, default=24 * 3600, help="seconds, for the ttl policy")
+    args = parser.parse_args()
+
+    cache = QueryCache(args.cache_dir, int(args.max_gb * 1024**3), args.policy, args.max_age)
+    with duckdb.connect() as duck_conn:
+        if any(s.startswith("gs://") for s in (args.source or detect_sources(args.sql))):
+            from helpers import setup_duckdb
+
+            setup_duckdb(duck_conn)
+        result = cache.query(duck_conn, args.sql, json.loads(args.params) if args.params else None, args.source)
+        print(result.to_pandas())
+        logger.info(cache.stats())
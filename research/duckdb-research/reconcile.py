@@ -0,0 +1,320 @@
+import argparse
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import duckdb
+import pendulum
+from dotenv import load_dotenv
+
+from helpers import setup_duckdb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Checks that a written dt= partition (main.py's COPY TO, pipelined_writer.py or the spark
+# backfill) still matches its source window in postgres, without pulling the window back:
+#   - both sides are reduced to (id bucket, count(*), sum(row hash)) - the row hash is the
+#     first 60 bits of md5 over a canonical text form of every column, so the sum does not
+#     depend on row order and fits postgres' numeric / duckdb's hugeint sums exactly
+#   - the postgres aggregate runs in postgres through postgres_query(), only one row per
+#     bucket comes back; the parquet aggregate runs in duckdb over the files
+#   - buckets that differ are split --fanout ways and compared again, Merkle style, only
+#     inside the mismatching id ranges, until a bucket holds <= --leaf-rows rows; those
+#     leaves are diffed row by row on (id, hash)
+# So a clean partition costs one bucket list per side, and a missing/corrupted range costs
+# a few levels of small bucket lists plus the rows of the leaves around it.
+# The canonical text per column type is in CANONICAL; nested types and intervals print
+# differently in postgres and duckdb and are left out of the hash (logged).
+# Reports go to .state/reconcile/{table}/dt={etl_date}.json
+#
+# python reconcile.py --table b2x_checkout_transaction --etl-date 2025-10-08
+# python reconcile.py --table b2x_checkout_transaction --etl-date 2025-10-08 --path /tmp/lake --glob '**/*.parquet'
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_dir = ".state/reconcile"
+
+TS_PG = "'YYYY-MM-DD HH24:MI:SS.US'"
+TS_DUCK = "'%Y-%m-%d %H:%M:%S.%f'"
+
+# duckdb type of the parquet column -> (postgres expression, duckdb expression) giving the same text
+CANONICAL = {
+    "BOOLEAN": ("CASE WHEN {c} THEN '1' WHEN NOT {c} THEN '0' END", "CASE WHEN {c} THEN '1' WHEN NOT {c} THEN '0' END"),
+    "DATE": ("to_char({c}, 'YYYY-MM-DD')", "strftime({c}, '%Y-%m-%d')"),
+    "TIMESTAMP": (f"to_char({{c}}, {TS_PG})", f"strftime({{c}}, {TS_DUCK})"),
+    "TIMESTAMP WITH TIME ZONE": (f"to_char({{c}} AT TIME ZONE 'UTC', {TS_PG})", f"strftime(timezone('UTC', {{c}}), {TS_DUCK})"),
+    # floats are compared to 6 decimals, their shortest text differs between the two
+    "DOUBLE": ("round({c}::numeric * 1000000)::text", "round({c} * 1000000)::HUGEINT::VARCHAR"),
+    "FLOAT": ("round({c}::numeric * 1000000)::text", "round({c} * 1000000)::HUGEINT::VARCHAR"),
+    "BLOB": ("encode({c}, 'hex')", "lower(hex({c}))"),
+}
+TEXT = ("{c}::text", "{c}::VARCHAR")
+SKIPPED = ("[]", "STRUCT", "MAP", "UNION", "INTERVAL")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def canonical_columns(columns: list[tuple[str, str]]) -> tuple[list[str], list[str], list[str]]:
+    """(postgres expressions, duckdb expressions, skipped columns) for the row text."""
+    pg, duck, skipped = [], [], []
+    for name, dtype in columns:
+        if any(s in dtype for s in SKIPPED):
+            skipped.append(name)
+            continue
+        if dtype.startswith("DECIMAL"):
+            scale = int(dtype.rstrip(")").split(",")[1])
+            # numeric(p,s)::text and DECIMAL(p,s)::VARCHAR both print s decimals
+            pair = (f"round({{c}}::numeric, {scale})::text", "{c}::VARCHAR")
+        else:
+            pair = CANONICAL.get(dtype, TEXT)
+        c = _quote(name)
+        pg.append(f"coalesce({pair[0].format(c=c)}, '\\N')")
+        duck.append(f"coalesce({pair[1].format(c=c)}, '\\N')")
+    return pg, duck, skipped
+
+
+class Side:
+    """One end of the comparison: a source query plus the dialect to aggregate it in."""
+
+    def __init__(self, name: str, dconn, source: str, id_column: str, row_text: list[str]):
+        self.name = name
+        # own cursor, so both sides can run at the same time
+        self.dconn = dconn.cursor()
+        self.source = source
+        self.id = _quote(id_column)
+        self.row_text = " || chr(31) || ".join(row_text)
+        self.rows_transferred = 0
+
+    def row_hash(self) -> str:
+        raise NotImplementedError
+
+    def bucket(self, base: int, width: int) -> str:
+        raise NotImplementedError
+
+    def sum_text(self) -> str:
+        raise NotImplementedError
+
+    def wrap(self, sql: str) -> str:
+        """duckdb statement that runs `sql` where this side's data lives."""
+        raise NotImplementedError
+
+    def run(self, sql: str) -> list[tuple]:
+        return self.dconn.execute(self.wrap(sql)).fetchall()
+
+    def _where(self, ranges: list[tuple[int, int]] | None) -> str:
+        return " OR ".join(f"({self.id} >= {lo} AND {self.id} < {hi})" for lo, hi in ranges or []) or "true"
+
+    def _filtered(self, ranges: list[tuple[int, int]] | None) -> str:
+        return f"SELECT {self.id} AS id, {self.row_hash()} AS h FROM ({self.source}) src WHERE {self._where(ranges)}"
+
+    def rows(self, ranges: list[tuple[int, int]] | None) -> str:
+        """duckdb statement returning the full rows of the id ranges, ordered by id."""
+        return self.wrap(f"SELECT * FROM ({self.source}) src WHERE {self._where(ranges)} ORDER BY {self.id}")
+
+    def id_range(self) -> tuple[int | None, int | None, int]:
+        lo, hi, n = self.run(f"SELECT min({self.id}), max({self.id}), count(*) FROM ({self.source}) src")[0]
+        return lo, hi, n
+
+    def buckets(self, ranges: list[tuple[int, int]] | None, base: int, width: int) -> dict:
+        """bucket -> (count, hash sum) over the given id ranges, None for all rows."""
+        sql = (
+            f"SELECT {self.bucket(base, width)} AS b, count(*) AS n, {self.sum_text()} AS s "
+            f"FROM ({self._filtered(ranges)}) t GROUP BY 1"
+        )
+        rows = self.run(sql)
+        self.rows_transferred += len(rows)
+        return {int(b): (int(n), int(s)) for b, n, s in rows}
+
+    def leaf_rows(self, ranges: list[tuple[int, int]]) -> Counter:
+        rows = self.run(f"SELECT id, h FROM ({self._filtered(ranges)}) t")
+        self.rows_transferred += len(rows)
+        return Counter((int(i), int(h)) for i, h in rows)
+
+
+class PostgresSide(Side):
+    def row_hash(self) -> str:
+        return f"('x' || substr(md5({self.row_text}), 1, 15))::bit(60)::bigint"
+
+    def bucket(self, base: int, width: int) -> str:
+        # integer division, id - base is never negative
+        return f"(id - {base}) / {width}"
+
+    def sum_text(self) -> str:
+        # numeric sum, as text so postgres_query doesn't hand it back as a double
+        return "sum(h)::text"
+
+    def wrap(self, sql: str) -> str:
+        # the whole statement runs inside postgres, duckdb only receives its result
+        return f"SELECT * FROM postgres_query('pg', '{sql.replace(chr(39), chr(39) * 2)}')"
+
+
+class ParquetSide(Side):
+    """Aggregates in duckdb, over parquet files or anything else duckdb can read."""
+
+    def row_hash(self) -> str:
+        return f"('0x' || substr(md5({self.row_text}), 1, 15))::BIGINT"
+
+    def bucket(self, base: int, width: int) -> str:
+        return f"(id - {base}) // {width}"
+
+    def sum_text(self) -> str:
+        return "sum(h)::VARCHAR"
+
+    def wrap(self, sql: str) -> str:
+        return sql
+
+
+def _chunks(ranges: list, size: int = 200):
+    for i in range(0, len(ranges), size):
+        yield ranges[i:i + size]
+
+
+def compare(
+    source: Side,
+    target: Side,
+    top_buckets: int = 256,
+    fanout: int = 16,
+    leaf_rows: int = 1_000,
+) -> dict:
+    def both(method: str, *args):
+        # postgres works on its aggregate while duckdb scans the files
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(getattr(side, method), *args) for side in (source, target)]
+            return [f.result() for f in futures]
+
+    (src_lo, src_hi, src_rows), (dst_lo, dst_hi, dst_rows) = both("id_range")
+    report = {"source_rows": src_rows, "target_rows": dst_rows, "levels": []}
+    bounds = [v for v in (src_lo, src_hi, dst_lo, dst_hi) if v is not None]
+    if not bounds:
+        report.update({"match": True, "missing": [], "extra": [], "changed": [], "rows_transferred": {}})
+        return report
+    base, end = min(bounds), max(bounds) + 1
+
+    # widths are powers of the fanout so child buckets nest exactly in their parent
+    width = fanout ** max(0, math.ceil(math.log(max(1, (end - base) / top_buckets), fanout)))
+    ranges = [(base, end)]
+    leaves = []
+    while ranges:
+        src, dst = {}, {}
+        for chunk in _chunks(ranges):
+            src_chunk, dst_chunk = both("buckets", chunk, base, width)
+            src.update(src_chunk)
+            dst.update(dst_chunk)
+        mismatched = sorted(b for b in src.keys() | dst.keys() if src.get(b) != dst.get(b))
+        report["levels"].append({"width": width, "buckets": len(src.keys() | dst.keys()), "mismatched": len(mismatched)})
+        logger.info(f"width {width}: {len(src.keys() | dst.keys())} buckets, {len(mismatched)} mismatched")
+
+        ranges = []
+        for b in mismatched:
+            lo = base + b * width
+            rows = max(src.get(b, (0, 0))[0], dst.get(b, (0, 0))[0])
+            (leaves if rows <= leaf_rows or width == 1 else ranges).append((lo, lo + width))
+        width = max(1, width // fanout)
+
+    missing, extra = Counter(), Counter()
+    for chunk in _chunks(leaves):
+        src, dst = both("leaf_rows", chunk)
+        missing.update(src - dst)
+        extra.update(dst - src)
+    missing_ids, extra_ids = {i for i, _ in missing}, {i for i, _ in extra}
+    changed = missing_ids & extra_ids
+    report.update({
+        "match": not missing and not extra,
+        "missing": sorted(missing_ids - changed),  # in the source window, not in the files
+        "extra": sorted(extra_ids - changed),  # in the files, not in the source window
+        "changed": sorted(changed),  # in both with different contents (or duplicated)
+        "rows_transferred": {source.name: source.rows_transferred, target.name: target.rows_transferred},
+    })
+    return report
+
+
+def run(
+    psql_table: str,
+    etl_date: str,
+    path: str = gcs_bucket_prefix,
+    glob: str = "**/*.parquet",
+    id_column: str = "id",
+    top_buckets: int = 256,
+    fanout: int = 16,
+    leaf_rows: int = 1_000,
+    exclude: list[str] | None = None,
+) -> dict:
+    date = pendulum.parse(etl_date, tz="Asia/Jakarta")
+    dstart = (date - timedelta(days=2)).strftime("%Y-%m-%d 17:00:00")
+    dend = (date - timedelta(days=1)).strftime("%Y-%m-%d 17:00:00")
+    # same window (and the same UNION ALL duplicates) main.py extracts
+    pg_source = f"""
+        SELECT * FROM {psql_schema}.{psql_table}
+        WHERE created >= '{dstart}' AND created < '{dend}'
+        UNION ALL
+        SELECT * FROM {psql_schema}.{psql_table}
+        WHERE last_updated >= '{dstart}' AND last_updated < '{dend}'
+    """
+    files = f"{path.rstrip('/')}/{psql_table}/dt={etl_date}/{glob}"
+    parquet_source = f"SELECT * FROM read_parquet('{files}', union_by_name = true)"
+
+    started = time.time()
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+        columns = [(name, dtype) for name, dtype, *_ in duck_conn.execute(f"DESCRIBE {parquet_source}").fetchall()]
+        columns = [(name, dtype) for name, dtype in columns if name not in (exclude or [])]
+        pg_text, duck_text, skipped = canonical_columns(columns)
+        if skipped:
+            logger.warning(f"not hashed (no common text form): {skipped}")
+        report = compare(
+            PostgresSide("postgres", duck_conn, pg_source, id_column, pg_text),
+            ParquetSide("parquet", duck_conn, parquet_source, id_column, duck_text),
+            top_buckets,
+            fanout,
+            leaf_rows,
+        )
+    report.update({"table": psql_table, "etl_date": etl_date, "files": files, "skipped_columns": skipped})
+
+    out = f"{state_dir}/{psql_table}/dt={etl_date}.json"
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    transferred = sum(report["rows_transferred"].values())
+    logger.info(
+        f"{'✅' if report['match'] else '❌'} {psql_table} dt={etl_date}: {report['source_rows']} source rows, "
+        f"{report['target_rows']} parquet rows, {len(report['missing'])} missing, {len(report['extra'])} extra, "
+        f"{len(report['changed'])} changed; {transferred} rows transferred in {time.time() - started:.1f}s -> {out}"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="bucketed hash reconciliation of a dt= partition against postgres")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", required=True, help="dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--path", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--glob", default="**/*.parquet", help="files of the partition to check, e.g. 093000.parquet")
+    parser.add_argument("--id-column", default="id", help="integer id to bucket on")
+    parser.add_argument("--top-buckets", type=int, default=256)
+    parser.add_argument("--fanout", type=int, default=16)
+    parser.add_argument("--leaf-rows", type=int, default=1_000, help="buckets this small are diffed row by row")
+    parser.add_argument("--exclude", action="append", help="columns left out of the row hash")
+    args = parser.parse_args()
+
+    run(
+        args.table,
+        args.etl_date,
+        args.path,
+        args.glob,
+        args.id_column,
+        args.top_buckets,
+        args.fanout,
+        args.leaf_rows,
+        args.exclude,
+    )
@@ -0,0 +1,198 @@
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import duckdb
+import fsspec
+import pendulum
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from helpers import setup_duckdb
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Resumable version of main.py's main_ingestion
+# The window is split into id-range chunks, each chunk is written as its own part file
+#     {table}/dt={etl_date}/part-{lo}-{hi}.parquet
+# and recorded in a journal once the upload finished:
+#     .state/checkpoint/{table}/dt={etl_date}.jsonl
+# The first journal line is the plan (window + id bounds), every next line is a finished chunk.
+# A rerun reuses the plan, checks the journaled part files (size + row count from the footer)
+# and only runs chunks that are missing or failed verification. Part files left behind by a
+# crash mid-upload are not in the journal and get overwritten. A new plan (--restart, another
+# window, no journal) has other chunk bounds, so it first removes every part-* file of the
+# partition.
+#
+# python resumable_ingestion.py --table b2x_checkout_transaction --etl-date 2025-10-08
+# python resumable_ingestion.py --table b2x_checkout_transaction --etl-date 2025-10-08 --restart
+
+psql_schema = "public"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+state_dir = Path(".state/checkpoint")
+
+
+class Journal:
+    def __init__(self, psql_table: str, etl_date: str):
+        self.path = state_dir / psql_table / f"dt={etl_date}.jsonl"
+        self.plan = None
+        self.chunks = {}
+        if self.path.exists():
+            for line in self.path.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn last line from a crash while appending
+                    continue
+                if entry["type"] == "plan":
+                    self.plan = entry
+                else:
+                    self.chunks[(entry["lo"], entry["hi"])] = entry
+
+    def _append(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, plan: dict) -> None:
+        self.path.unlink(missing_ok=True)
+        self.plan = {"type": "plan", **plan}
+        self.chunks = {}
+        self._append(self.plan)
+
+    def done(self, lo: int, hi: int, path: str, rows: int, size: int) -> None:
+        entry = {"type": "chunk", "lo": lo, "hi": hi, "path": path, "rows": rows, "size": size}
+        self.chunks[(lo, hi)] = entry
+        self._append(entry)
+
+
+def chunk_ranges(min_id: int, max_id: int, chunk_size: int) -> list[tuple[int, int]]:
+    return [(lo, min(lo + chunk_size - 1, max_id)) for lo in range(min_id, max_id + 1, chunk_size)]
+
+
+def verify_part(entry: dict) -> bool:
+    """A journaled part is good when it still exists with the same size and row count."""
+    fs, fs_path = fsspec.core.url_to_fs(entry["path"])
+    try:
+        if fs.info(fs_path)["size"] != entry["size"]:
+            return False
+        with fs.open(fs_path, "rb") as f:
+            return pq.ParquetFile(f).metadata.num_rows == entry["rows"]
+    except Exception as e:
+        logger.warning(f"verification of {entry['path']} failed: {e}")
+        return False
+
+
+def clear_parts(output: str, psql_table: str, etl_date: str) -> None:
+    fs, fs_dir = fsspec.core.url_to_fs(f"{output}/{psql_table}/dt={etl_date}")
+    parts = fs.glob(f"{fs_dir}/part-*.parquet")
+    if parts:
+        fs.rm(parts)
+        logger.info(f"removed {len(parts)} part files of the previous plan")
+
+
+def write_chunk(duck_conn, psql_table: str, path: str, params: dict) -> int:
+    data_query = f"""
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE id >= $lo AND id <= $hi
+        AND created >= $psql_dstart AND created < $psql_dend
+
+        UNION ALL
+
+        SELECT * FROM pg.{psql_schema}.{psql_table}
+        WHERE id >= $lo AND id <= $hi
+        AND last_updated >= $psql_dstart AND last_updated < $psql_dend
+    """
+    fs, fs_path = fsspec.core.url_to_fs(path)
+    fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+    return duck_conn.execute(
+        f"COPY ({data_query}) TO '{path}' (FORMAT PARQUET, COMPRESSION zstd)", params
+    ).fetchone()[0]
+
+
+def run(
+    psql_table: str,
+    etl_date: str,
+    output: str,
+    chunk_size: int = 1_000_000,
+    retries: int = 3,
+    restart: bool = False,
+) -> None:
+    journal = Journal(psql_table, etl_date)
+    date = pendulum.parse(etl_date, tz="Asia/Jakarta")
+    window = {
+        "psql_dstart": (date - timedelta(days=2)).strftime("%Y-%m-%d 17:00:00"),
+        "psql_dend": (date - timedelta(days=1)).strftime("%Y-%m-%d 17:00:00"),
+    }
+
+    with duckdb.connect() as duck_conn:
+        setup_duckdb(duck_conn)
+
+        if restart or journal.plan is None or journal.plan["window"] != window:
+            min_id, max_id = duck_conn.sql(
+                f"SELECT min(id), max(id) FROM pg.{psql_schema}.{psql_table}"
+            ).fetchone()
+            # id bounds are frozen in the plan, a resumed run covers the same rows as the first
+            clear_parts(output, psql_table, etl_date)
+            journal.start({"window": window, "min_id": min_id, "max_id": max_id, "chunk_size": chunk_size})
+            logger.info(f"new plan for {psql_table} dt={etl_date}: ids {min_id}..{max_id}")
+        else:
+            logger.info(f"resuming {psql_table} dt={etl_date} from {journal.path}")
+
+        plan = journal.plan
+        if plan["min_id"] is None:
+            logger.info(f"{psql_table} is empty.")
+            return
+
+        ranges = chunk_ranges(plan["min_id"], plan["max_id"], plan["chunk_size"])
+        todo = []
+        for lo, hi in ranges:
+            entry = journal.chunks.get((lo, hi))
+            if entry is not None and verify_part(entry):
+                continue
+            if entry is not None:
+                logger.warning(f"part {entry['path']} failed verification, redoing chunk {lo}..{hi}")
+            todo.append((lo, hi))
+        logger.info(f"{len(ranges) - len(todo)}/{len(ranges)} chunks already done, {len(todo)} to run")
+
+        started = time.time()
+        for n, (lo, hi) in enumerate(todo, 1):
+            # deterministic name: a redone chunk overwrites its partial file instead of adding one
+            path = f"{output}/{psql_table}/dt={etl_date}/part-{lo:012d}-{hi:012d}.parquet"
+            for attempt in range(1, retries + 1):
+                try:
+                    rows = write_chunk(duck_conn, psql_table, path, {"lo": lo, "hi": hi, **window})
+                    break
+                except (duckdb.IOException, duckdb.HTTPException, duckdb.ConnectionException) as e:
+                    if attempt == retries:
+                        raise
+                    logger.warning(f"chunk {lo}..{hi} attempt {attempt} failed: {e}, retrying...")
+                    time.sleep(2**attempt)
+            fs, fs_path = fsspec.core.url_to_fs(path)
+            journal.done(lo, hi, path, rows, fs.info(fs_path)["size"])
+            logger.info(f"chunk {lo}..{hi}: {rows} rows ({n}/{len(todo)}, {time.time() - started:.0f}s)")
+
+    total = sum(entry["rows"] for entry in journal.chunks.values())
+    logger.info(f"✅ {psql_table} dt={etl_date}: {len(ranges)} chunks, {total} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="checkpointed, resumable ingestion from postgres")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--etl-date", required=True, help="dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--output", default=gcs_bucket_prefix, help="gs://bucket or a local directory")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="ids per chunk")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--restart", action="store_true", help="drop the journal and start over")
+    args = parser.parse_args()
+
+    run(args.table, args.etl_date, args.output, args.chunk_size, args.retries, args.restart)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import fsspec
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Parallel export where every worker reads the same point in time.
+# The coordinator session opens a REPEATABLE READ transaction and calls pg_export_snapshot(),
+# every worker then runs SET TRANSACTION SNAPSHOT with that id before reading its id range.
+# A row updated while the export runs is either seen in its old version by all chunks or
+# not at all, it can't be read twice or fall between two chunks.
+#
+# python snapshot_export.py --table b2x_checkout_transaction --workers 4 \
+#     --output gs://bucket/b2x_checkout_transaction/dt=2025-10-08
+
+psql_schema = "public"
+
+# postgres type oid -> arrow type, every other type is written as its text form
+PG_ARROW_TYPES = {
+    16: pa.bool_(),  # bool
+    20: pa.int64(),  # int8
+    21: pa.int16(),  # int2
+    23: pa.int32(),  # int4
+    26: pa.int64(),  # oid
+    700: pa.float32(),  # float4
+    701: pa.float64(),  # float8
+    17: pa.binary(),  # bytea
+    1082: pa.date32(),  # date
+    1083: pa.time64("us"),  # time
+    1114: pa.timestamp("us"),  # timestamp
+    1184: pa.timestamp("us", tz="UTC"),  # timestamptz
+    1186: pa.duration("us"),  # interval
+}
+JSON_OIDS = {114, 3802}  # json, jsonb: psycopg2 parses them, written back as json text
+NUMERIC_OID = 1700
+
+
+@contextmanager
+def exported_snapshot(dsn: str):
+    """Yields a snapshot id that stays importable until the context exits.
+
+    The exporting transaction has to stay open while workers import the snapshot, so keep
+    the context around the whole parallel read.
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        # psycopg2 opens the transaction itself on the first execute, an explicit BEGIN would
+        # only warn and leave it READ COMMITTED
+        conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot()")
+            (snapshot_id,) = cur.fetchone()
+        logger.info(f"exported snapshot {snapshot_id}")
+        yield snapshot_id
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@contextmanager
+def snapshot_connection(dsn: str, snapshot_id: str):
+    """A connection whose transaction sees exactly the exported snapshot."""
+    conn = psycopg2.connect(dsn)
+    try:
+        # SET TRANSACTION SNAPSHOT must be the first statement of a REPEATABLE READ transaction
+        conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def arrow_schema(description) -> tuple[pa.Schema, dict]:
+    """Arrow schema from the column type oids, plus converters for values arrow can't take as is.
+
+    Guessing types from the first batch of rows breaks as soon as a column is NULL in all of
+    it, so every batch is built against this schema instead.
+    """
+    fields, converters = [], {}
+    for i, col in enumerate(description):
+        if col.type_code in PG_ARROW_TYPES:
+            arrow_type = PG_ARROW_TYPES[col.type_code]
+            if col.type_code == 17:
+                converters[i] = bytes
+        elif col.type_code == NUMERIC_OID and col.precision and col.scale is not None and col.precision <= 38:
+            arrow_type = pa.decimal128(col.precision, col.scale)
+        else:
+            # text types, unconstrained numeric, uuid, enums, arrays, ...
+            arrow_type = pa.string()
+            converters[i] = json.dumps if col.type_code in JSON_OIDS else str
+        fields.append(pa.field(col.name, arrow_type))
+    return pa.schema(fields), converters
+
+
+def rows_to_arrow(schema: pa.Schema, converters: dict, rows: list[tuple]) -> pa.Table:
+    columns = [list(col) for col in zip(*rows)]
+    for i, convert in converters.items():
+        columns[i] = [None if v is None else convert(v) for v in columns[i]]
+    return pa.table(columns, schema=schema)
+
+
+def export_chunk(
+    dsn: str,
+    snapshot_id: str,
+    query: str,
+    params: dict,
+    path: str,
+    fetch_size: int = 50_000,
+) -> int:
+    num_rows = 0
+    with snapshot_connection(dsn, snapshot_id) as conn:
+        # named cursor = server side, rows are streamed in fetch_size batches
+        with conn.cursor(name="snapshot_export") as cur:
+            cur.itersize = fetch_size
+            cur.execute(query, params)
+            # a named cursor only has a description after the first fetch
+            rows = cur.fetchmany(fetch_size)
+            if rows:
+                schema, converters = arrow_schema(cur.description)
+                fs, fs_path = fsspec.core.url_to_fs(path)
+                fs.makedirs(fs_path.rsplit("/", 1)[0], exist_ok=True)
+                # the writer doesn't close a file object it was given, closing it is what
+                # finalizes (and surfaces errors of) the gcs upload
+                with fs.open(fs_path, "wb") as f, pq.ParquetWriter(f, schema, compression="zstd") as writer:
+                    while rows:
+                        writer.write_table(rows_to_arrow(schema, converters, rows))
+                        num_rows += len(rows)
+                        rows = cur.fetchmany(fetch_size)
+    logger.info(f"{num_rows} rows -> {path}")
+    return num_rows
+
+
+def id_ranges(min_id: int, max_id: int, parts: int) -> list[tuple[int, int]]:
+    step = max(1, (max_id - min_id + parts) // parts)
+    return [(lo, min(lo + step - 1, max_id)) for lo in range(min_id, max_id + 1, step)]
+
+
+def parallel_export(
+    psql_table: str,
+    output: str,
+    workers: int = 4,
+    chunks: int | None = None,
+    psql_dstart: str | None = None,
+    psql_dend: str | None = None,
+) -> int:
+    dsn = os.getenv("PSQL_CONN")
+    with exported_snapshot(dsn) as snapshot_id:
+        # min/max from the same snapshot, otherwise rows inserted after this point
+        # could land beyond max_id and be skipped by a later chunk
+        with snapshot_connection(dsn, snapshot_id) as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT min(id), max(id) FROM {psql_schema}.{psql_table}")
+            min_id, max_id = cur.fetchone()
+        if min_id is None:
+            logger.info(f"{psql_table} is empty.")
+            return 0
+
+        window = ""
+        if psql_dstart and psql_dend:
+            window = (
+                "AND ((created >= %(psql_dstart)s AND created < %(psql_dend)s)"
+                " OR (last_updated >= %(psql_dstart)s AND last_updated < %(psql_dend)s))"
+            )
+        query = f"""
+            SELECT * FROM {psql_schema}.{psql_table}
+            WHERE id >= %(lo)s AND id <= %(hi)s {window}
+        """
+
+        ranges = id_ranges(min_id, max_id, chunks or workers)
+        logger.info(f"{psql_table}: ids {min_id}..{max_id} in {len(ranges)} chunks over {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    export_chunk,
+                    dsn,
+                    snapshot_id,
+                    query,
+                    {"lo": lo, "hi": hi, "psql_dstart": psql_dstart, "psql_dend": psql_dend},
+                    f"{output.rstrip('/')}/part-{lo:012d}-{hi:012d}.parquet",
+                )
+                for lo, hi in ranges
+            ]
+            total = sum(f.result() for f in futures)
+
+    logger.info(f"✅ {total} rows exported from snapshot {snapshot_id}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="snapshot-consistent parallel export")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunks", type=int)
+    parser.add_argument("--dstart", help="window start, e.g. '2025-10-06 17:00:00'")
+    parser.add_argument("--dend", help="window end, e.g. '2025-10-07 17:00:00'")
+    args = parser.parse_args()
+
+    parallel_export(args.table, args.output, args.workers, args.chunks, args.dstart, args.dend)
@@ -0,0 +1,507 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+from datetime import time as dt_time
+from decimal import Decimal
+from pathlib import Path
+
+import duckdb
+import fsspec
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv("../../.env.shared")
+
+# Validates dt= parquet partitions of the ingested tables against a GX expectation suite,
+# with DuckDB doing the work instead of pandas:
+#   - the suite is read from the GX expectations store (gx/expectations/{suite}.json)
+#   - every supported expectation becomes aggregate expressions (count(*) FILTER (WHERE ...),
+#     min/max/avg, count(DISTINCT ...)) and all of them go into ONE select over
+#     read_parquet('{table}/dt={dt}/*.parquet'); identical aggregates are only computed once.
+#     Schema expectations only need DESCRIBE, i.e. the parquet footers.
+#   - DuckDB streams the files through the aggregates, only count(DISTINCT ...) keeps state
+#     proportional to the data and it spills to --temp-dir past --memory-limit, so a day of
+#     a big table does not have to fit in RAM
+#   - expect_column_values_to_be_unique counts every row of a duplicated value like GX does,
+#     which takes a GROUP BY over the column: a second scan of the files per unique column
+#   - partitions run in parallel (--parallel), one duckdb connection each
+#   - results are GX ExpectationSuiteValidationResults, saved to the validation results store
+#     so Data Docs (data_docs.py) render them like any other validation; --docs updates the
+#     site with incremental_data_docs.py afterwards, rendering only the new results
+# Partitions already validated with the same files (names + sizes) are skipped, the
+# fingerprints live in gx/uncommitted/duckdb_validation/{table}.json.
+#
+# python duckdb_validation.py --table b2x_checkout_transaction --suite b2x_checkout_transaction
+# python duckdb_validation.py --table b2x_checkout_transaction --suite b2x_checkout_transaction --dt 2025-10-08 --dt 2025-10-09
+# python duckdb_validation.py --table b2x_checkout_transaction --suite b2x_checkout_transaction --path /tmp/lake --no-store
+
+GX_ROOT = Path(__file__).parent / "gx"
+STATE_DIR = GX_ROOT / "uncommitted" / "duckdb_validation"
+gcs_bucket_prefix = f"gs://{os.getenv('GCS_BUCKET')}"
+
+PARTIAL_UNEXPECTED = 20
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _lit(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _jsonable(value):
+    """Decimals and timestamps from duckdb -> what GX's json stores can serialize."""
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, dt_time)):
+        return value.isoformat()
+    return value
+
+
+def _between(expr: str, kwargs: dict) -> str | None:
+    """SQL condition for GX's min_value/max_value/strict_min/strict_max kwargs."""
+    parts = []
+    if kwargs.get("min_value") is not None:
+        op = ">" if kwargs.get("strict_min") else ">="
+        parts.append(f"{expr} {op} {_lit(kwargs['min_value'])}")
+    if kwargs.get("max_value") is not None:
+        op = "<" if kwargs.get("strict_max") else "<="
+        parts.append(f"{expr} {op} {_lit(kwargs['max_value'])}")
+    return " AND ".join(parts) or None
+
+
+# column map expectations: condition a non-null value must meet
+MAP_CONDITIONS = {
+    "expect_column_values_to_be_between": lambda c, kw: _between(c, kw) or "TRUE",
+    "expect_column_values_to_be_in_set": lambda c, kw: f"{c} IN ({', '.join(_lit(v) for v in kw['value_set'])})",
+    "expect_column_values_to_not_be_in_set": lambda c, kw: f"{c} NOT IN ({', '.join(_lit(v) for v in kw['value_set'])})",
+    "expect_column_values_to_match_regex": lambda c, kw: f"regexp_matches({c}::VARCHAR, {_lit(kw['regex'])})",
+    "expect_column_values_to_not_match_regex": lambda c, kw: f"NOT regexp_matches({c}::VARCHAR, {_lit(kw['regex'])})",
+    "expect_column_value_lengths_to_be_between": lambda c, kw: _between(f"length({c}::VARCHAR)", kw) or "TRUE",
+    "expect_column_value_lengths_to_equal": lambda c, kw: f"length({c}::VARCHAR) = {int(kw['value'])}",
+}
+
+# column aggregate expectations: observed value, checked against min_value/max_value
+AGGREGATES = {
+    "expect_column_min_to_be_between": "min({c})",
+    "expect_column_max_to_be_between": "max({c})",
+    "expect_column_mean_to_be_between": "avg({c})",
+    "expect_column_median_to_be_between": "quantile_cont({c}, 0.5)",
+    "expect_column_sum_to_be_between": "sum({c})",
+    "expect_column_stdev_to_be_between": "stddev_samp({c})",
+    "expect_column_unique_value_count_to_be_between": "count(DISTINCT {c})",
+    "expect_column_proportion_of_unique_values_to_be_between": "count(DISTINCT {c}) / nullif(count({c}), 0)",
+}
+
+SCHEMA_EXPECTATIONS = {
+    "expect_column_to_exist",
+    "expect_table_columns_to_match_set",
+    "expect_table_columns_to_match_ordered_list",
+    "expect_table_column_count_to_equal",
+    "expect_table_column_count_to_be_between",
+}
+
+SUPPORTED = {
+    *SCHEMA_EXPECTATIONS,
+    *MAP_CONDITIONS,
+    *AGGREGATES,
+    "expect_table_row_count_to_be_between",
+    "expect_table_row_count_to_equal",
+    "expect_column_values_to_not_be_null",
+    "expect_column_values_to_be_null",
+    "expect_column_values_to_be_unique",
+}
+
+
+class SuiteQuery:
+    """All expectations of a suite compiled into one aggregate select."""
+
+    def __init__(self, expectations: list[dict], columns: list[str]):
+        self.expectations = expectations
+        self.columns = columns
+        self.exprs = {}  # sql -> alias, so shared aggregates (count(*), count(col)) run once
+        self.duplicates = {}  # column -> alias of its rows-with-a-duplicated-value subquery
+        self.rows = self._agg("count(*)")
+        self.plans = [self._plan(e) for e in expectations]
+
+    def _agg(self, sql: str) -> str:
+        if sql not in self.exprs:
+            self.exprs[sql] = f"a{len(self.exprs)}"
+        return self.exprs[sql]
+
+    def _plan(self, expectation: dict):
+        kind = expectation["type"]
+        kw = expectation["kwargs"]
+        if kind not in SUPPORTED:
+            return ("unsupported", None)
+        if kind in SCHEMA_EXPECTATIONS:
+            return ("schema", None)
+
+        if kind in ("expect_table_row_count_to_be_between", "expect_table_row_count_to_equal"):
+            check = _between("count(*)", kw) if kind.endswith("between") else f"count(*) = {int(kw['value'])}"
+            return ("aggregate", {"observed": self.rows, "check": self._agg(check or "TRUE")})
+
+        if kw.get("column") not in self.columns:
+            return ("missing", None)
+        c = _ident(kw["column"])
+        non_null = self._agg(f"count({c})")
+        if kind in ("expect_column_values_to_not_be_null", "expect_column_values_to_be_null"):
+            unexpected = self._agg(f"count(*) - count({c})" if kind.endswith("not_be_null") else f"count({c})")
+            return ("map", {"unexpected": unexpected, "non_null": non_null, "nulls": kind.endswith("not_be_null"), "sample": None})
+
+        if kind == "expect_column_values_to_be_unique":
+            # every row whose value occurs more than once, not only the repeats
+            unexpected = self.duplicates.setdefault(c, f"d{len(self.duplicates)}")
+            return ("map", {"unexpected": unexpected, "non_null": non_null, "nulls": False, "sample": None})
+
+        if kind in MAP_CONDITIONS:
+            bad = f"{c} IS NOT NULL AND NOT ({MAP_CONDITIONS[kind](c, kw)})"
+            unexpected = self._agg(f"count(*) FILTER (WHERE {bad})")
+            # min(x, n) keeps n values, bounded state unlike list()
+            sample = self._agg(f"min({c}, {PARTIAL_UNEXPECTED}) FILTER (WHERE {bad})")
+            return ("map", {"unexpected": unexpected, "non_null": non_null, "nulls": False, "sample": sample})
+
+        observed = AGGREGATES[kind].format(c=c)
+        return ("aggregate", {"observed": self._agg(observed), "check": self._agg(_between(observed, kw) or "TRUE")})
+
+    def sql(self, source: str) -> str:
+        columns = [f"{sql} AS {alias}" for sql, alias in self.exprs.items()]
+        columns += [
+            f"(SELECT coalesce(sum(n), 0) FROM (SELECT count(*) AS n FROM {source} "
+            f"WHERE {c} IS NOT NULL GROUP BY {c} HAVING count(*) > 1)) AS {alias}"
+            for c, alias in self.duplicates.items()
+        ]
+        columns = ",\n    ".join(columns)
+        return f"SELECT\n    {columns}\nFROM {source}"
+
+    def results(self, row: dict) -> list[dict]:
+        out = []
+        for expectation, (mode, plan) in zip(self.expectations, self.plans):
+            config = {"type": expectation["type"], "kwargs": expectation["kwargs"], "meta": expectation.get("meta", {})}
+            if mode == "schema":
+                success, result = _schema_result(expectation, self.columns)
+            elif mode == "aggregate":
+                observed = row[plan["observed"]]
+                success, result = bool(row[plan["check"]]), {"observed_value": observed}
+            elif mode == "map":
+                success, result = _map_result(row, plan, self.rows, expectation["kwargs"].get("mostly", 1.0))
+            else:
+                message = (
+                    f"column {expectation['kwargs'].get('column')} not found"
+                    if mode == "missing"
+                    else f"{expectation['type']} is not supported by duckdb_validation"
+                )
+                out.append({
+                    "success": False,
+                    "expectation_config": config,
+                    "result": {},
+                    "exception_info": {"raised_exception": True, "exception_message": message, "exception_traceback": None},
+                })
+                continue
+            out.append({
+                "success": success,
+                "expectation_config": config,
+                "result": result,
+                "exception_info": {"raised_exception": False, "exception_message": None, "exception_traceback": None},
+            })
+        return out
+
+
+def _map_result(row: dict, plan: dict, rows_alias: str, mostly: float) -> tuple[bool, dict]:
+    rows = row[rows_alias]
+    non_null = row[plan["non_null"]]
+    unexpected = row[plan["unexpected"]]
+    missing = rows - non_null
+    # not_be_null is judged on all rows, the other map expectations on the non-null ones
+    base = rows if plan["nulls"] else non_null
+    unexpected_percent = 100.0 * unexpected / base if base else 0.0
+    result = {
+        "element_count": rows,
+        "unexpected_count": unexpected,
+        "unexpected_percent": unexpected_percent,
+        "partial_unexpected_list": (row[plan["sample"]] or []) if plan["sample"] else [],
+    }
+    if not plan["nulls"]:
+        result.update({
+            "missing_count": missing,
+            "missing_percent": 100.0 * missing / rows if rows else 0.0,
+            "unexpected_percent_total": 100.0 * unexpected / rows if rows else 0.0,
+            "unexpected_percent_nonmissing": unexpected_percent,
+        })
+    return unexpected_percent <= 100.0 * (1 - mostly) + 1e-9, result
+
+
+def _schema_result(expectation: dict, columns: list[str]) -> tuple[bool, dict]:
+    kind, kw = expectation["type"], expectation["kwargs"]
+    if kind == "expect_column_to_exist":
+        return kw["column"] in columns, {}
+    if kind == "expect_table_columns_to_match_ordered_list":
+        return columns == list(kw["column_list"]), {"observed_value": columns}
+    if kind == "expect_table_columns_to_match_set":
+        expected = set(kw["column_set"])
+        if kw.get("exact_match", True):
+            success = set(columns) == expected
+        else:
+            success = expected.issubset(columns)
+        return success, {
+            "observed_value": columns,
+            "details": {
+                "mismatched": {
+                    "unexpected": sorted(set(columns) - expected),
+                    "missing": sorted(expected - set(columns)),
+                }
+            },
+        }
+    count = len(columns)
+    if kind == "expect_table_column_count_to_equal":
+        return count == kw["value"], {"observed_value": count}
+    low, high = kw.get("min_value"), kw.get("max_value")
+    return (low is None or count >= low) and (high is None or count <= high), {"observed_value": count}
+
+
+def load_suite(name: str) -> list[dict]:
+    """Expectations of a suite in the file expectations store (GX 1.x layout)."""
+    suite = json.loads((GX_ROOT / "expectations" / f"{name}.json").read_text())
+    return [
+        {"type": e.get("type") or e["expectation_type"], "kwargs": e.get("kwargs", {}), "meta": e.get("meta", {})}
+        for e in suite["expectations"]
+    ]
+
+
+def setup_connection(memory_limit: str, threads: int, temp_dir: str | None) -> duckdb.DuckDBPyConnection:
+    conn = duckdb.connect()
+    conn.sql(f"""
+        SET memory_limit = '{memory_limit}';
+        SET threads TO {threads};
+        SET preserve_insertion_order = false;
+    """)
+    if temp_dir:
+        conn.sql(f"SET temp_directory = '{temp_dir}'")
+    if os.getenv("GCS_HMAC_ACCESS_KEY"):
+        conn.sql(f"""
+            INSTALL httpfs;
+            LOAD httpfs;
+            CREATE SECRET (
+                TYPE gcs,
+                KEY_ID '{os.getenv("GCS_HMAC_ACCESS_KEY")}',
+                SECRET '{os.getenv("GCS_HMAC_ACCESS_KEY_SECRET")}'
+            );
+        """)
+    return conn
+
+
+def validate_partition(
+    partition: str,
+    expectations: list[dict],
+    suite_name: str,
+    memory_limit: str = "2GB",
+    threads: int = 1,
+    temp_dir: str | None = None,
+) -> dict:
+    source = f"read_parquet('{partition}/**/*.parquet', union_by_name = true)"
+    started = time.time()
+    if temp_dir:
+        # connections spilling into the same directory overwrite each other's temp files
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix="validation-", dir=temp_dir)
+    try:
+        with setup_connection(memory_limit, threads, temp_dir) as conn:
+            # footers only; expectations on a column that is not there fail on their own
+            columns = [r[0] for r in conn.sql(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+            query = SuiteQuery(expectations, columns)
+            cursor = conn.execute(query.sql(source))
+            row = {d[0]: _jsonable(v) for d, v in zip(cursor.description, cursor.fetchone())}
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    results = query.results(row)
+    evaluated = len(results)
+    successful = sum(r["success"] for r in results)
+    return {
+        "success": evaluated == successful,
+        "results": results,
+        "suite_name": suite_name,
+        "statistics": {
+            "evaluated_expectations": evaluated,
+            "successful_expectations": successful,
+            "unsuccessful_expectations": evaluated - successful,
+            "success_percent": 100.0 * successful / evaluated if evaluated else None,
+        },
+        "meta": {
+            "batch_spec": {"path": partition, "engine": "duckdb"},
+            "active_batch_definition": {"data_asset_name": partition},
+            "validation_time": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ"),
+            "scan_seconds": time.time() - started,
+        },
+    }
+
+
+def partitions(table_path: str) -> dict:
+    """dt -> (partition path, fingerprint of its parquet files)."""
+    fs, root = fsspec.core.url_to_fs(table_path)
+    protocol = table_path.split("://", 1)[0] + "://" if "://" in table_path else ""
+    found = {}
+    for path in fs.glob(f"{root}/dt=*"):
+        dt = path.rsplit("dt=", 1)[1]
+        files = fs.find(path, detail=True)
+        # lists, not tuples, so it compares equal to the one read back from the state json
+        fingerprint = sorted(
+            [name[len(path):], info.get("size")] for name, info in files.items() if name.endswith(".parquet")
+        )
+        if fingerprint:
+            found[dt] = (f"{protocol}{path}", fingerprint)
+    return dict(sorted(found.items()))
+
+
+def _load_state(table: str) -> dict:
+    path = STATE_DIR / f"{table}.json"
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def _save_state(table: str, state: dict) -> None:
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = STATE_DIR / f"{table}.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    tmp.replace(path)
+
+
+def store_result(context, table: str, dt: str, result: dict) -> None:
+    """Saves a result dict as an ExpectationSuiteValidationResult in the GX results store."""
+    from great_expectations.core import ExpectationSuiteValidationResult, ExpectationValidationResult
+    from great_expectations.core.run_identifier import RunIdentifier
+    from great_expectations.data_context.types.resource_identifiers import (
+        ExpectationSuiteIdentifier,
+        ValidationResultIdentifier,
+    )
+    from great_expectations.expectations.expectation_configuration import ExpectationConfiguration
+
+    run_id = RunIdentifier(run_name=f"duckdb-{table}-dt={dt}", run_time=datetime.now(timezone.utc))
+    suite_result = ExpectationSuiteValidationResult(
+        success=result["success"],
+        results=[
+            ExpectationValidationResult(
+                success=r["success"],
+                expectation_config=ExpectationConfiguration(**r["expectation_config"]),
+                result=r["result"],
+                exception_info=r["exception_info"],
+            )
+            for r in result["results"]
+        ],
+        suite_name=result["suite_name"],
+        statistics=result["statistics"],
+        meta={**result["meta"], "run_id": run_id.to_json_dict()},
+        batch_id=f"{table}/dt={dt}",
+    )
+    key = ValidationResultIdentifier(
+        expectation_suite_identifier=ExpectationSuiteIdentifier(name=result["suite_name"]),
+        run_id=run_id,
+        batch_identifier=f"{table}-dt={dt}",
+    )
+    context.validation_results_store.set(key, suite_result)
+
+
+def run(
+    table: str,
+    suite: str,
+    path: str = gcs_bucket_prefix,
+    dts: list[str] | None = None,
+    force: bool = False,
+    parallel: int = 4,
+    memory_limit: str = "2GB",
+    threads: int = 2,
+    temp_dir: str | None = None,
+    store: bool = True,
+) -> dict:
+    expectations = load_suite(suite)
+    state = _load_state(table)
+    found = partitions(f"{path.rstrip('/')}/{table}")
+    todo = {
+        dt: (partition, fingerprint)
+        for dt, (partition, fingerprint) in found.items()
+        if (not dts or dt in dts) and (force or dts or state.get(dt, {}).get("fingerprint") != fingerprint)
+    }
+    logger.info(f"{len(found)} partitions of {table}, validating {len(todo)} with {len(expectations)} expectations")
+
+    context = None
+    if store and todo:
+        import great_expectations as gx
+
+        context = gx.get_context(mode="file", project_root_dir=str(GX_ROOT.parent))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = {
+            pool.submit(validate_partition, partition, expectations, suite, memory_limit, threads, temp_dir): dt
+            for dt, (partition, _) in todo.items()
+        }
+        for future in as_completed(futures):
+            dt = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"dt={dt} failed: {e}")
+                continue
+            results[dt] = result
+            stats = result["statistics"]
+            logger.info(
+                f"{'✅' if result['success'] else '❌'} dt={dt}: "
+                f"{stats['successful_expectations']}/{stats['evaluated_expectations']} passed "
+                f"in {result['meta']['scan_seconds']:.1f}s"
+            )
+            if context is not None:
+                store_result(context, table, dt, result)
+            state[dt] = {"fingerprint": todo[dt][1], "success": result["success"], "validated_at": result["meta"]["validation_time"]}
+            _save_state(table, state)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="validate dt= parquet partitions with duckdb")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--suite", required=True, help="expectation suite name in gx/expectations")
+    parser.add_argument("--path", default=gcs_bucket_prefix, help="gs://bucket or a local directory holding {table}/dt=*")
+    parser.add_argument("--dt", action="append", help="only these partitions (validated even when unchanged)")
+    parser.add_argument("--force", action="store_true", help="revalidate unchanged partitions too")
+    parser.add_argument("--parallel", type=int, default=4, help="partitions validated at the same time")
+    parser.add_argument("--memory-limit", default="2GB", help="per partition connection")
+    parser.add_argument("--threads", type=int, default=2, help="duckdb threads per partition connection")
+    parser.add_argument("--temp-dir", help="where duckdb spills past --memory-limit")
+    parser.add_argument("--no-store", action="store_true", help="don't save results to the GX store")
+    parser.add_argument("--docs", action="store_true", help="update data docs with the new results")
+    args = parser.parse_args()
+
+    run(
+        args.table,
+        args.suite,
+        args.path,
+        args.dt,
+        args.force,
+        args.parallel,
+        args.memory_limit,
+        args.threads,
+        args.temp_dir,
+        not args.no_store,
+    )
+    if args.docs and not args.no_store:
+        import incremental_data_docs
+
+        incremental_data_docs.build()
@@ -0,0 +1,298 @@
+import argparse
+import html
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Incremental build of the local Data Docs site (see data_docs.py / great_expectations.yml).
+# context.build_data_docs() re-renders a page for every validation result in the store and
+# re-reads all of them for the index, so each UpdateDataDocsAction gets slower as results pile
+# up over hundreds of partitions. This builder keeps a manifest of what it rendered:
+#     {site}/.incremental_manifest.json   store key -> (mtime, size, summary of the result)
+#   - the validations store is walked with stat() only, results are read just when they are
+#     new or their mtime/size changed; deleted results drop their page
+#   - only those pages are rendered, with GX (--renderer gx, build_data_docs restricted to the
+#     changed resource_identifiers and build_index=False) or with the plain html renderer below
+#   - the index is split into one page per suite (incremental/{suite}.html) built from the
+#     manifest summaries; only suites with changes are rewritten, index.html just lists the
+#     suites with their counts
+#
+# python incremental_data_docs.py
+# python incremental_data_docs.py --renderer html
+# python incremental_data_docs.py --benchmark 5000 --new 20
+
+GX_ROOT = Path(__file__).parent / "gx"
+VALIDATIONS_DIR = GX_ROOT / "uncommitted" / "validations"
+SITE_DIR = GX_ROOT / "uncommitted" / "data_docs" / "local_site"
+SITE_NAME = "local_site"
+MANIFEST = ".incremental_manifest.json"
+
+STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+td, th { border: 1px solid #ddd; padding: 4px 8px; text-align: left; vertical-align: top; }
+.ok { color: #1a7f37; } .fail { color: #cf222e; }
+"""
+
+
+def _write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    tmp.replace(path)
+
+
+def _page(title: str, body: str) -> str:
+    return (
+        f"<!doctype html><html><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+        f"<style>{STYLE}</style></head><body><h1>{html.escape(title)}</h1>{body}</body></html>\n"
+    )
+
+
+def _status(success) -> str:
+    return "<span class='ok'>passed</span>" if success else "<span class='fail'>failed</span>"
+
+
+def scan_store(validations_dir: Path = VALIDATIONS_DIR) -> dict:
+    """store key ('suite/run_name/run_time/batch') -> [mtime_ns, size], stat() only."""
+    found = {}
+    stack = [(str(validations_dir), "")]
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, f"{prefix}{entry.name}/"))
+                elif entry.name.endswith(".json"):
+                    st = entry.stat()
+                    found[f"{prefix}{entry.name[:-5]}"] = [st.st_mtime_ns, st.st_size]
+    return found
+
+
+def summarize(key: str, result: dict) -> dict:
+    suite, run_name, run_time, batch = key.split("/", 3)
+    stats = result.get("statistics", {})
+    return {
+        "suite": result.get("suite_name", suite),
+        "run_name": run_name,
+        "run_time": run_time,
+        "batch": batch,
+        "success": bool(result.get("success")),
+        "evaluated": stats.get("evaluated_expectations"),
+        "successful": stats.get("successful_expectations"),
+    }
+
+
+def page_path(key: str) -> str:
+    # same layout as GX's site store, so links work whichever renderer wrote the page
+    return f"validations/{key}.html"
+
+
+def render_html(site_dir: Path, items: list[tuple[str, dict]]) -> None:
+    """Plain html validation pages, no GX needed."""
+    for key, result in items:
+        rows = []
+        for r in result.get("results", []):
+            config = r.get("expectation_config", {})
+            res = r.get("result", {})
+            observed = res.get("observed_value", res.get("unexpected_count", ""))
+            error = (r.get("exception_info") or {}).get("exception_message") or ""
+            rows.append(
+                f"<tr><td>{_status(r.get('success'))}</td>"
+                f"<td>{html.escape(config.get('type', config.get('expectation_type', '')))}</td>"
+                f"<td><code>{html.escape(json.dumps(config.get('kwargs', {}), default=str))}</code></td>"
+                f"<td>{html.escape(str(observed))}</td>"
+                f"<td>{html.escape(str(res.get('partial_unexpected_list', ''))[:300])}{html.escape(error)}</td></tr>"
+            )
+        stats = result.get("statistics", {})
+        body = (
+            f"<p>{_status(result.get('success'))} {stats.get('successful_expectations')}/"
+            f"{stats.get('evaluated_expectations')} expectations - <code>{html.escape(key)}</code></p>"
+            "<table><tr><th>status</th><th>expectation</th><th>kwargs</th><th>observed</th><th>unexpected</th></tr>"
+            + "".join(rows)
+            + "</table>"
+        )
+        _write(site_dir / page_path(key), _page(key.rsplit("/", 1)[-1], body))
+
+
+def render_gx(site_dir: Path, items: list[tuple[str, dict]]) -> None:
+    """GX validation pages for just these results, leaving the index to this builder."""
+    import great_expectations as gx
+    from great_expectations.data_context.types.resource_identifiers import ValidationResultIdentifier
+
+    context = gx.get_context(mode="file", project_root_dir=str(GX_ROOT.parent))
+    identifiers = [ValidationResultIdentifier.from_tuple(tuple(key.split("/", 3))) for key, _ in items]
+    context.build_data_docs(site_names=[SITE_NAME], resource_identifiers=identifiers, build_index=False)
+
+
+RENDERERS = {"gx": render_gx, "html": render_html}
+
+
+def write_suite_index(site_dir: Path, suite: str, entries: list[tuple[str, dict]]) -> None:
+    entries = sorted(entries, key=lambda e: (e[1]["run_time"], e[0]), reverse=True)
+    rows = "".join(
+        f"<tr><td>{_status(s['success'])}</td><td>{html.escape(s['run_time'])}</td>"
+        f"<td><a href='../{html.escape(page_path(key))}'>{html.escape(s['batch'])}</a></td>"
+        f"<td>{html.escape(s['run_name'])}</td><td>{s['successful']}/{s['evaluated']}</td></tr>"
+        for key, s in entries
+    )
+    body = (
+        "<p><a href='../index.html'>all suites</a></p>"
+        "<table><tr><th>status</th><th>run time</th><th>batch</th><th>run</th><th>passed</th></tr>"
+        f"{rows}</table>"
+    )
+    _write(site_dir / "incremental" / f"{suite}.html", _page(suite, body))
+
+
+def write_index(site_dir: Path, suites: dict) -> None:
+    rows = "".join(
+        f"<tr><td><a href='incremental/{html.escape(suite)}.html'>{html.escape(suite)}</a></td>"
+        f"<td>{c['results']}</td><td class='fail'>{c['failed']}</td><td>{html.escape(c['latest'])}</td></tr>"
+        for suite, c in sorted(suites.items())
+    )
+    body = f"<table><tr><th>suite</th><th>results</th><th>failed</th><th>latest run</th></tr>{rows}</table>"
+    _write(site_dir / "index.html", _page("Data Docs", body))
+
+
+def build(
+    validations_dir: Path = VALIDATIONS_DIR,
+    site_dir: Path = SITE_DIR,
+    renderer: str = "gx",
+    full: bool = False,
+) -> dict:
+    started = time.perf_counter()
+    manifest_path = site_dir / MANIFEST
+    manifest = {} if full or not manifest_path.exists() else json.loads(manifest_path.read_text())
+    entries = manifest.get("entries", {})
+
+    current = scan_store(validations_dir)
+    changed = [key for key, stat in current.items() if entries.get(key, {}).get("stat") != stat]
+    removed = [key for key in entries if key not in current]
+
+    touched_suites = set()
+    items = []
+    for key in changed:
+        result = json.loads((validations_dir / f"{key}.json").read_text())
+        summary = summarize(key, result)
+        entries[key] = {"stat": current[key], "summary": summary}
+        touched_suites.add(summary["suite"])
+        items.append((key, result))
+    for key in removed:
+        touched_suites.add(entries.pop(key)["summary"]["suite"])
+        (site_dir / page_path(key)).unlink(missing_ok=True)
+
+    if items:
+        RENDERERS[renderer](site_dir, items)
+
+    by_suite = {}
+    for key, entry in entries.items():
+        by_suite.setdefault(entry["summary"]["suite"], []).append((key, entry["summary"]))
+    for suite in touched_suites:
+        if suite in by_suite:
+            write_suite_index(site_dir, suite, by_suite[suite])
+        else:
+            (site_dir / "incremental" / f"{suite}.html").unlink(missing_ok=True)
+    if touched_suites or not (site_dir / "index.html").exists():
+        write_index(
+            site_dir,
+            {
+                suite: {
+                    "results": len(items_),
+                    "failed": sum(not s["success"] for _, s in items_),
+                    "latest": max(s["run_time"] for _, s in items_),
+                }
+                for suite, items_ in by_suite.items()
+            },
+        )
+        _write(manifest_path, json.dumps({"entries": entries}))
+
+    stats = {
+        "results": len(current),
+        "rendered": len(items),
+        "removed": len(removed),
+        "suites_rewritten": len(touched_suites),
+        "seconds": time.perf_counter() - started,
+    }
+    logger.info(
+        f"✅ data docs: {stats['rendered']} pages rendered, {stats['removed']} removed, "
+        f"{stats['suites_rewritten']} suite indexes rewritten, {stats['results']} results in store "
+        f"({stats['seconds']:.2f}s)"
+    )
+    return stats
+
+
+def synthetic_store(validations_dir: Path, results: int, suites: int = 20, expectations: int = 12, seed: int = 0) -> None:
+    """Validation results shaped like duckdb_validation.py's, spread over suites and days."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    existing = sum(1 for _ in validations_dir.rglob("*.json")) if validations_dir.exists() else 0
+    for i in range(existing, existing + results):
+        suite = f"table_{i % suites:03d}"
+        dt = (start + timedelta(days=i // suites)).strftime("%Y-%m-%d")
+        run_time = (start + timedelta(days=i // suites, hours=1)).strftime("%Y%m%dT%H%M%S.%fZ")
+        checks = [
+            {
+                "success": rng.random() > 0.03,
+                "expectation_config": {"type": "expect_column_values_to_not_be_null", "kwargs": {"column": f"col_{j}"}},
+                "result": {"element_count": 1_000_000, "unexpected_count": rng.randint(0, 50), "partial_unexpected_list": []},
+                "exception_info": {"raised_exception": False, "exception_message": None},
+            }
+            for j in range(expectations)
+        ]
+        successful = sum(c["success"] for c in checks)
+        result = {
+            "success": successful == expectations,
+            "results": checks,
+            "suite_name": suite,
+            "statistics": {"evaluated_expectations": expectations, "successful_expectations": successful},
+            "meta": {"run_id": {"run_name": f"duckdb-{suite}-dt={dt}", "run_time": run_time}},
+        }
+        path = validations_dir / suite / f"duckdb-{suite}-dt={dt}" / run_time / f"{suite}-dt={dt}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(result))
+
+
+def benchmark(results: int, new: int, renderer: str = "html") -> None:
+    root = Path(tempfile.mkdtemp(prefix="data-docs-bench-"))
+    try:
+        validations_dir, site_dir = root / "validations", root / "site"
+        synthetic_store(validations_dir, results)
+        first = build(validations_dir, site_dir, renderer)
+        synthetic_store(validations_dir, new, seed=1)
+        incremental = build(validations_dir, site_dir, renderer)
+        noop = build(validations_dir, site_dir, renderer)
+        full = build(validations_dir, site_dir, renderer, full=True)
+        logger.info(
+            f"{results} results + {new} new: first build {first['seconds']:.2f}s, "
+            f"full rebuild {full['seconds']:.2f}s, incremental {incremental['seconds']:.3f}s "
+            f"({full['seconds'] / incremental['seconds']:.0f}x faster), no-op {noop['seconds']:.3f}s"
+        )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="incremental data docs build")
+    parser.add_argument("--renderer", choices=RENDERERS, default="gx")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and render everything")
+    parser.add_argument("--benchmark", type=int, metavar="RESULTS", help="benchmark on a synthetic store")
+    parser.add_argument("--new", type=int, default=20, help="results added after the first benchmark build")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.new, "html" if args.renderer == "gx" else args.renderer)
+    else:
+        build(renderer=args.renderer, full=args.full)
@@ -0,0 +1,322 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+from dotenv import load_dotenv
+from pyspark.sql import SparkSession
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+load_dotenv(".env.shared")
+
+# Backfill version of spark_etl_postgres_to_gcs.py
+# Instead of one query over the whole range appended into a single dt= partition, the range
+# is split into the same daily windows the daily job uses and every window overwrites its
+# own dt= partition, a few windows at a time.
+# With --consistent-snapshot the driver exports one postgres snapshot and every JDBC
+# connection (all windows, all id partitions) imports it, so the backfill reads a single
+# point in time even though it runs on many connections.
+#
+# python spark_backfill.py --table b2x_checkout_transaction --start 2025-03-21 --end 2025-06-14
+# python spark_backfill.py --table b2x_checkout_transaction --start 2025-03-21 --end 2025-06-14 \
+#     --consistent-snapshot --num-partitions 8
+
+psql_schema = "public"
+
+POSTGRES_CONFIG = {
+    "user": os.getenv("DEV_PSQL_USERNAME"),
+    "password": os.getenv("DEV_PSQL_PASSWORD"),
+    "host": os.getenv("DEV_PSQL_HOST"),
+    "port": os.getenv("DEV_PSQL_PORT"),
+    "database": os.getenv("DEV_PSQL_DATABASE"),
+}
+
+jdbc_url = f"jdbc:postgresql://{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}"
+
+
+def business_day_windows(start_dt: date, end_dt: date) -> list[dict]:
+    """One window per `dt` partition between `start_dt` and `end_dt` (inclusive).
+
+    Same boundaries as the daily scripts: partition `dt=D` holds rows created/updated in
+    [D-2 17:00 UTC, D-1 17:00 UTC), i.e. the full Asia/Jakarta day before D.
+    """
+    windows = []
+    etl_date = start_dt
+    while etl_date <= end_dt:
+        windows.append(
+            {
+                "etl_date": etl_date.strftime("%Y-%m-%d"),
+                "start_date": (etl_date - timedelta(days=2)).strftime("%Y-%m-%d 17:00:00"),
+                "end_date": (etl_date - timedelta(days=1)).strftime("%Y-%m-%d 17:00:00"),
+            }
+        )
+        etl_date += timedelta(days=1)
+    return windows
+
+
+def partition_path(gcs_bucket: str, psql_table: str, etl_date: str) -> str:
+    return f"gs://{gcs_bucket}/{psql_table}/dt={etl_date}"
+
+
+def is_done(spark: SparkSession, path: str) -> bool:
+    """A window is finished when its partition has the `_SUCCESS` marker spark writes on commit."""
+    jvm = spark._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(f"{path}/_SUCCESS")
+    fs = hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration())
+    return fs.exists(hadoop_path)
+
+
+@contextmanager
+def exported_snapshot():
+    """Yields a postgres snapshot id that stays importable until the context exits.
+
+    The JDBC `isolationLevel` option only applies to writes, so it can't line up reads;
+    instead one driver-side session exports its snapshot and keeps the transaction open
+    while the executors read.
+    """
+    conn = psycopg2.connect(
+        user=POSTGRES_CONFIG["user"],
+        password=POSTGRES_CONFIG["password"],
+        host=POSTGRES_CONFIG["host"],
+        port=POSTGRES_CONFIG["port"],
+        dbname=POSTGRES_CONFIG["database"],
+    )
+    try:
+        # psycopg2 opens the transaction itself on the first execute, an explicit BEGIN would
+        # only warn and leave it READ COMMITTED
+        conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot()")
+            (snapshot_id,) = cur.fetchone()
+        logger.info(f"exported snapshot {snapshot_id}")
+        yield snapshot_id
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def snapshot_session_init(snapshot_id: str) -> str:
+    """sessionInitStatement that puts a fresh JDBC connection into the exported snapshot.
+
+    The transaction is opened explicitly, so the BEGIN the driver sends once spark turns
+    autocommit off only raises a warning and the read runs inside this transaction.
+    """
+    return (
+        "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY; "
+        f"SET TRANSACTION SNAPSHOT '{snapshot_id}'"
+    )
+
+
+def read_jdbc(
+    spark: SparkSession,
+    query: str,
+    fetchsize: int = 10000,
+    snapshot_id: str | None = None,
+    partitioning: dict | None = None,
+):
+    reader = (
+        spark.read.format("jdbc")
+        .option("driver", "org.postgresql.Driver")
+        .option("url", jdbc_url)
+        .option("user", POSTGRES_CONFIG["user"])
+        .option("password", POSTGRES_CONFIG["password"])
+        .option("dbtable", f"({query}) as q")
+        .option("fetchsize", fetchsize)
+    )
+    if snapshot_id:
+        reader = reader.option("sessionInitStatement", snapshot_session_init(snapshot_id))
+    if partitioning:
+        # partitionColumn, lowerBound, upperBound, numPartitions
+        reader = reader.options(**partitioning)
+    return reader.load()
+
+
+def id_partitioning(spark: SparkSession, psql_table: str, num_partitions: int, snapshot_id: str | None) -> dict | None:
+    """Splits reads on `id`; bounds are read in the same snapshot as the data."""
+    if num_partitions <= 1:
+        return None
+    row = read_jdbc(
+        spark,
+        f"SELECT min(id) AS min_id, max(id) AS max_id FROM {psql_schema}.{psql_table}",
+        fetchsize=1,
+        snapshot_id=snapshot_id,
+    ).head()
+    if row is None or row["min_id"] is None:
+        return None
+    return {
+        "partitionColumn": "id",
+        "lowerBound": str(row["min_id"]),
+        "upperBound": str(row["max_id"]),
+        "numPartitions": str(num_partitions),
+    }
+
+
+def backfill_window(
+    spark: SparkSession,
+    psql_table: str,
+    gcs_bucket: str,
+    window: dict,
+    snapshot_id: str | None = None,
+    partitioning: dict | None = None,
+) -> int:
+    start_date, end_date = window["start_date"], window["end_date"]
+    query = f"""
+    SELECT *
+    FROM {psql_schema}.{psql_table}
+    WHERE
+    true
+    and created >= '{start_date}' and created < '{end_date}'
+
+    union all
+
+    SELECT *
+    FROM {psql_schema}.{psql_table}
+    WHERE
+    true
+    and last_updated >= '{start_date}' and last_updated < '{end_date}'
+    """
+
+    path = partition_path(gcs_bucket, psql_table, window["etl_date"])
+    # each thread gets its own pool so one slow window doesn't starve the others
+    spark.sparkContext.setLocalProperty("spark.scheduler.pool", f"backfill-{window['etl_date']}")
+    spark.sparkContext.setJobGroup(window["etl_date"], f"backfill {psql_table} dt={window['etl_date']}")
+
+    # overwrite only touches this dt= directory, so reruns of a window are idempotent
+    read_jdbc(spark, query, snapshot_id=snapshot_id, partitioning=partitioning).write.option("compression", "zstd").mode("overwrite").parquet(path)
+
+    # row count from parquet footers, cheaper than counting the jdbc source twice
+    return spark.read.parquet(path).count()
+
+
+def run_backfill(
+    spark: SparkSession,
+    psql_table: str,
+    gcs_bucket: str,
+    start_dt: date,
+    end_dt: date,
+    max_concurrency: int = 4,
+    dry_run: bool = False,
+    consistent_snapshot: bool = False,
+    num_partitions: int = 1,
+) -> None:
+    windows = business_day_windows(start_dt, end_dt)
+    pending = [
+        w for w in windows
+        if not is_done(spark, partition_path(gcs_bucket, psql_table, w["etl_date"]))
+    ]
+    logger.info(
+        f"{psql_table}: {len(windows)} windows from dt={start_dt} to dt={end_dt}, "
+        f"{len(windows) - len(pending)} already done, {len(pending)} to run "
+        f"with concurrency {max_concurrency}"
+    )
+    if dry_run:
+        for w in pending:
+            logger.info(f"would run dt={w['etl_date']}: [{w['start_date']}, {w['end_date']})")
+        return
+
+    lock = threading.Lock()
+    progress = {"done": 0, "rows": 0, "failed": []}
+    started = time.time()
+
+    with (
+        exported_snapshot() if consistent_snapshot else nullcontext()
+    ) as snapshot_id, ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        partitioning = id_partitioning(spark, psql_table, num_partitions, snapshot_id)
+        futures = {
+            executor.submit(
+                backfill_window, spark, psql_table, gcs_bucket, w, snapshot_id, partitioning
+            ): w
+            for w in pending
+        }
+        for future in as_completed(futures):
+            window = futures[future]
+            with lock:
+                try:
+                    rows = future.result()
+                    progress["done"] += 1
+                    progress["rows"] += rows
+                    logger.info(
+                        f"✅ dt={window['etl_date']}: {rows} rows "
+                        f"({progress['done']}/{len(pending)} windows, "
+                        f"{progress['rows']} rows, {time.time() - started:.0f}s elapsed)"
+                    )
+                except Exception as e:
+                    progress["failed"].append(window["etl_date"])
+                    logger.error(f"❌ dt={window['etl_date']} failed: {e}")
+
+    if progress["failed"]:
+        logger.error(
+            f"{len(progress['failed'])} windows failed: {sorted(progress['failed'])}. "
+            "Rerun the same command to retry only those."
+        )
+    else:
+        logger.info(f"backfill done: {progress['rows']} rows in {time.time() - started:.0f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="backfill dt= partitions from postgres in parallel")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--start", required=True, help="first dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="last dt= partition (YYYY-MM-DD)")
+    parser.add_argument("--bucket", default="oy-bi-raw-hub")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--consistent-snapshot",
+        action="store_true",
+        help="read every window and partition from one exported postgres snapshot",
+    )
+    parser.add_argument("--num-partitions", type=int, default=1, help="parallel JDBC reads per window, split on id")
+    args = parser.parse_args()
+
+    logger.info("Creating Spark session...")
+    spark = (
+        SparkSession.builder.appName(f"Postgres Backfill {args.table}")
+        .config(
+            "spark.jars",
+            "jars/postgresql-42.7.5.jar,"
+            "jars/gcsio-3.0.7.jar,"
+            "jars/gcs-connector-3.0.7.jar,",
+        )
+        .config("spark.executor.memory", "8g")
+        .config("spark.driver.memory", "8g")
+        .config("spark.executor.cores", "2")
+        .config("spark.default.parallelism", "2")
+        # jobs from different threads share executors fairly
+        .config("spark.scheduler.mode", "FAIR")
+        .config(
+            "spark.hadoop.fs.gs.impl",
+            "com.google.cloud.hadoop.fs.gcs.GoogleHadoopFileSystem",
+        )
+        .getOrCreate()
+    )
+    spark.conf.set("google.cloud.auth.service.account.enable", "true")
+    spark.conf.set(
+        "google.cloud.auth.service.account.json.keyfile",
+        os.getenv("GCP_SA_KEYFILE", "/home/giovannor/Documents/creds/sakey-de.json"),
+    )
+
+    try:
+        run_backfill(
+            spark,
+            psql_table=args.table,
+            gcs_bucket=args.bucket,
+            start_dt=datetime.strptime(args.start, "%Y-%m-%d").date(),
+            end_dt=datetime.strptime(args.end, "%Y-%m-%d").date(),
+            max_concurrency=args.max_concurrency,
+            dry_run=args.dry_run,
+            consistent_snapshot=args.consistent_snapshot,
+            num_partitions=args.num_partitions,
+        )
+    finally:
+        logger.info("Stopping Spark session...")
+        spark.stop()
@@ -113,7 +113,6 @@ try:
         .option("password", POSTGRES_CONFIG["password"])
         .option("dbtable", final_query_indexes)
         .option("fetchsize", 2)
-        .option("isolationLevel", "READ_UNCOMMITTED")
         .load()
     )
 
@@ -164,7 +163,8 @@ try:
         # .option("partitionColumn", "id")
         # .option("lowerBound", f"{min_id}")
         # .option("upperBound", f"{max_id}")
-        .option("isolationLevel", "READ_UNCOMMITTED")
+        # isolationLevel only applies to writes and postgres has no READ UNCOMMITTED anyway,
+        # partitioned reads need an exported snapshot, see spark_backfill.py --consistent-snapshot
         .load()
     )
 
@@ -0,0 +1,99 @@
+#
+# Change from the previous readout.
+# Fails when the readout moved more than `max_percent` percent away from the most recent
+# earlier readout in the time window, in either direction.
+#
+# `evaluate_series` takes the full history (series x days, NaN where a day has no readout)
+# so replay.py can score months of readouts for hundreds of checks in one call; DQOps calls
+# `evaluate_rule` per readout, which wraps the same function.
+#
+from datetime import datetime
+from typing import Sequence
+
+import numpy as np
+
+
+class ChangeFromPreviousRuleParametersSpec:
+    max_percent: float
+
+
+class HistoricDataPoint:
+    timestamp_utc: datetime
+    local_datetime: datetime
+    back_periods_index: int
+    sensor_readout: float
+    expected_value: float
+
+
+class RuleTimeWindowSettingsSpec:
+    prediction_time_window: int
+    min_periods_with_readouts: int
+
+
+class RuleExecutionRunParameters:
+    actual_value: float
+    parameters: ChangeFromPreviousRuleParametersSpec
+    time_period_local: datetime
+    previous_readouts: Sequence[HistoricDataPoint]
+    time_window: RuleTimeWindowSettingsSpec
+
+
+class RuleExecutionResult:
+    passed: bool
+    expected_value: float
+    lower_bound: float
+    upper_bound: float
+
+    def __init__(self, passed=None, expected_value=None, lower_bound=None, upper_bound=None):
+        self.passed = passed
+        self.expected_value = expected_value
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+
+
+def evaluate_series(values: np.ndarray, max_percent: float, window: int = 60, min_periods: int = 1) -> dict:
+    """Compares each point with the last non-NaN point at most `window` days before it.
+
+    `min_periods` is only there to match the other rules, one previous readout is enough.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    days = np.arange(values.shape[1])
+    # index of the latest readout up to each day, -1 before the first one
+    latest = np.maximum.accumulate(np.where(np.isnan(values), -1, days), axis=1)
+    prev_idx = np.concatenate([np.full((values.shape[0], 1), -1), latest[:, :-1]], axis=1)
+    previous = np.take_along_axis(values, np.maximum(prev_idx, 0), axis=1)
+
+    valid = (prev_idx >= 0) & (days - prev_idx <= window) & ~np.isnan(values)
+    a = previous * (1 - max_percent / 100.0)
+    b = previous * (1 + max_percent / 100.0)
+    lower, upper = np.minimum(a, b), np.maximum(a, b)
+    passed = np.where(valid, (values >= lower) & (values <= upper), np.nan)
+    return {
+        "passed": passed,
+        "expected_value": np.where(valid, previous, np.nan),
+        "lower_bound": np.where(valid, lower, np.nan),
+        "upper_bound": np.where(valid, upper, np.nan),
+    }
+
+
+def evaluate_rule(rule_parameters: RuleExecutionRunParameters) -> RuleExecutionResult:
+    if not hasattr(rule_parameters, "actual_value") or not hasattr(rule_parameters.parameters, "max_percent"):
+        return RuleExecutionResult()
+
+    readouts = [
+        point.sensor_readout
+        for point in rule_parameters.previous_readouts
+        if point is not None and hasattr(point, "sensor_readout")
+    ]
+    if not readouts:
+        return RuleExecutionResult()
+    result = evaluate_series(
+        np.array([readouts[-1], rule_parameters.actual_value], dtype=np.float64),
+        rule_parameters.parameters.max_percent,
+    )
+    return RuleExecutionResult(
+        bool(result["passed"][0, -1]),
+        float(result["expected_value"][0, -1]),
+        float(result["lower_bound"][0, -1]),
+        float(result["upper_bound"][0, -1]),
+    )
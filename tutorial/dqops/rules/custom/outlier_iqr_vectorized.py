@@ -0,0 +1,112 @@
+#
+# Interquartile range outlier rule (Tukey's fences).
+# The first and third quartiles of the readouts in the time window give the IQR; a readout
+# below Q1 - k * IQR or above Q3 + k * IQR fails. Quartiles don't move much for a single
+# extreme day, so this is steadier than mean/stddev on skewed metrics like sums.
+#
+# np.nanquantile falls back to a python loop per row once NaNs are present, so quartiles
+# are read off a sorted copy of the windows instead, one vectorized pass for all series.
+#
+from datetime import datetime
+from typing import Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class OutlierIqrRuleParametersSpec:
+    iqr_multiplier: float
+
+
+class HistoricDataPoint:
+    timestamp_utc: datetime
+    local_datetime: datetime
+    back_periods_index: int
+    sensor_readout: float
+    expected_value: float
+
+
+class RuleTimeWindowSettingsSpec:
+    prediction_time_window: int
+    min_periods_with_readouts: int
+
+
+class RuleExecutionRunParameters:
+    actual_value: float
+    parameters: OutlierIqrRuleParametersSpec
+    time_period_local: datetime
+    previous_readouts: Sequence[HistoricDataPoint]
+    time_window: RuleTimeWindowSettingsSpec
+
+
+class RuleExecutionResult:
+    passed: bool
+    expected_value: float
+    lower_bound: float
+    upper_bound: float
+
+    def __init__(self, passed=None, expected_value=None, lower_bound=None, upper_bound=None):
+        self.passed = passed
+        self.expected_value = expected_value
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+
+
+def _window_quantile(ordered: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """Linear-interpolated quantile of windows sorted along the last axis with NaNs last."""
+    pos = np.maximum(counts - 1, 0) * q
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, np.maximum(counts - 1, 0))
+    lo_val = np.take_along_axis(ordered, lo[..., None], axis=-1)[..., 0]
+    hi_val = np.take_along_axis(ordered, hi[..., None], axis=-1)[..., 0]
+    return lo_val + (hi_val - lo_val) * (pos - lo)
+
+
+def evaluate_series(values: np.ndarray, iqr_multiplier: float, window: int = 90, min_periods: int = 14) -> dict:
+    """Scores every point of `values` (series x days) against the `window` points before it."""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    padded = np.concatenate([np.full((values.shape[0], window), np.nan), values[:, :-1]], axis=1)
+    ordered = np.sort(sliding_window_view(padded, window, axis=1), axis=-1)
+    counts = np.sum(~np.isnan(ordered), axis=-1)
+
+    q1 = _window_quantile(ordered, counts, 0.25)
+    median = _window_quantile(ordered, counts, 0.5)
+    q3 = _window_quantile(ordered, counts, 0.75)
+    lower = q1 - iqr_multiplier * (q3 - q1)
+    upper = q3 + iqr_multiplier * (q3 - q1)
+
+    enough = (counts >= min_periods) & ~np.isnan(values)
+    passed = np.where(enough, (values >= lower) & (values <= upper), np.nan)
+    return {
+        "passed": passed,
+        "expected_value": np.where(enough, median, np.nan),
+        "lower_bound": np.where(enough, lower, np.nan),
+        "upper_bound": np.where(enough, upper, np.nan),
+    }
+
+
+def evaluate_rule(rule_parameters: RuleExecutionRunParameters) -> RuleExecutionResult:
+    if not hasattr(rule_parameters, "actual_value") or not hasattr(rule_parameters.parameters, "iqr_multiplier"):
+        return RuleExecutionResult()
+
+    readouts = [
+        point.sensor_readout
+        for point in rule_parameters.previous_readouts
+        if point is not None and hasattr(point, "sensor_readout")
+    ]
+    window = rule_parameters.time_window.prediction_time_window
+    series = np.array(readouts[-window:] + [rule_parameters.actual_value], dtype=np.float64)
+    result = evaluate_series(
+        series,
+        rule_parameters.parameters.iqr_multiplier,
+        window=len(series) - 1 or 1,
+        min_periods=rule_parameters.time_window.min_periods_with_readouts,
+    )
+    if np.isnan(result["passed"][0, -1]):
+        return RuleExecutionResult()
+    return RuleExecutionResult(
+        bool(result["passed"][0, -1]),
+        float(result["expected_value"][0, -1]),
+        float(result["lower_bound"][0, -1]),
+        float(result["upper_bound"][0, -1]),
+    )
@@ -0,0 +1,109 @@
+#
+# Two-sided percentile anomaly rule.
+# The previous readouts of the time window are treated as normally distributed; the readout
+# fails when it falls into the `anomaly_percent` tails (split evenly between both sides).
+#
+# `evaluate_series` scores a whole history at once (one row per series, one column per day)
+# and is what replay.py uses; `evaluate_rule` is the per-readout entry point DQOps calls and
+# runs the same code on a single window.
+#
+import warnings
+from datetime import datetime
+from statistics import NormalDist
+from typing import Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class PercentileAnomalyRuleParametersSpec:
+    anomaly_percent: float
+
+
+class HistoricDataPoint:
+    timestamp_utc: datetime
+    local_datetime: datetime
+    back_periods_index: int
+    sensor_readout: float
+    expected_value: float
+
+
+class RuleTimeWindowSettingsSpec:
+    prediction_time_window: int
+    min_periods_with_readouts: int
+
+
+class RuleExecutionRunParameters:
+    actual_value: float
+    parameters: PercentileAnomalyRuleParametersSpec
+    time_period_local: datetime
+    previous_readouts: Sequence[HistoricDataPoint]
+    time_window: RuleTimeWindowSettingsSpec
+
+
+class RuleExecutionResult:
+    passed: bool
+    expected_value: float
+    lower_bound: float
+    upper_bound: float
+
+    def __init__(self, passed=None, expected_value=None, lower_bound=None, upper_bound=None):
+        self.passed = passed
+        self.expected_value = expected_value
+        self.lower_bound = lower_bound
+        self.upper_bound = upper_bound
+
+
+def evaluate_series(values: np.ndarray, anomaly_percent: float, window: int = 90, min_periods: int = 30) -> dict:
+    """Scores every point of `values` (series x days, NaN = no readout) against the `window`
+    points before it. Returns arrays of the same shape: passed (NaN when not enough history),
+    expected_value, lower_bound and upper_bound."""
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    # row t of the view holds the window points before day t
+    padded = np.concatenate([np.full((values.shape[0], window), np.nan), values[:, :-1]], axis=1)
+    history = sliding_window_view(padded, window, axis=1)
+
+    counts = np.sum(~np.isnan(history), axis=-1)
+    with warnings.catch_warnings():
+        # windows without readouts warn here, they are masked out below anyway
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(history, axis=-1)
+        std = np.nanstd(history, axis=-1, ddof=1)
+    z = NormalDist().inv_cdf(1 - anomaly_percent / 200.0)
+    lower, upper = mean - z * std, mean + z * std
+
+    enough = (counts >= min_periods) & ~np.isnan(values)
+    passed = np.where(enough, (values >= lower) & (values <= upper), np.nan)
+    return {
+        "passed": passed,
+        "expected_value": np.where(enough, mean, np.nan),
+        "lower_bound": np.where(enough, lower, np.nan),
+        "upper_bound": np.where(enough, upper, np.nan),
+    }
+
+
+def evaluate_rule(rule_parameters: RuleExecutionRunParameters) -> RuleExecutionResult:
+    if not hasattr(rule_parameters, "actual_value") or not hasattr(rule_parameters.parameters, "anomaly_percent"):
+        return RuleExecutionResult()
+
+    readouts = [
+        point.sensor_readout
+        for point in rule_parameters.previous_readouts
+        if point is not None and hasattr(point, "sensor_readout")
+    ]
+    window = rule_parameters.time_window.prediction_time_window
+    series = np.array(readouts[-window:] + [rule_parameters.actual_value], dtype=np.float64)
+    result = evaluate_series(
+        series,
+        rule_parameters.parameters.anomaly_percent,
+        window=len(series) - 1 or 1,
+        min_periods=rule_parameters.time_window.min_periods_with_readouts,
+    )
+    if np.isnan(result["passed"][0, -1]):
+        return RuleExecutionResult()
+    return RuleExecutionResult(
+        bool(result["passed"][0, -1]),
+        float(result["expected_value"][0, -1]),
+        float(result["lower_bound"][0, -1]),
+        float(result["upper_bound"][0, -1]),
+    )
@@ -0,0 +1,141 @@
+#
+# Replays stored sensor readouts through the vectorized custom rules in rules/custom.
+# Every check (check_hash + data group) becomes one row of a series x days matrix and each
+# rule scores the whole matrix in one call. --compare also runs DQOps-style per-readout
+# evaluation (`evaluate_rule` once per check result per day) on a sample of the series,
+# checks both agree and reports the speedup.
+#
+# cd tutorial/dqops
+# python rules/replay.py --readouts '.data/sensor_readouts/**/*.parquet' --compare
+# python rules/replay.py --synthetic 500 180 --compare
+#
+import argparse
+import importlib.util
+import logging
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RULES_DIR = Path(__file__).parent / "custom"
+
+# rule module -> (parameters, prediction_time_window, min_periods_with_readouts),
+# same defaults as the .dqorule.yaml files
+RULES = {
+    "percentile_anomaly_vectorized": ({"anomaly_percent": 0.1}, 90, 30),
+    "change_from_previous_vectorized": ({"max_percent": 10.0}, 60, 1),
+    "outlier_iqr_vectorized": ({"iqr_multiplier": 1.5}, 90, 14),
+}
+
+
+def load_rule(name: str):
+    spec = importlib.util.spec_from_file_location(name, RULES_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_readouts(pattern: str) -> tuple[np.ndarray, list, np.ndarray]:
+    """Sensor readout parquet files -> (series x days matrix, series keys, days)."""
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    files = sorted(str(p) for p in Path().glob(pattern))
+    dataset = ds.dataset(files, format="parquet")
+    columns = [c for c in ("check_hash", "data_group_hash", "time_period", "actual_value") if c in dataset.schema.names]
+    table = dataset.to_table(columns=columns)
+
+    check = table.column("check_hash").to_numpy(zero_copy_only=False).astype(str)
+    group = (
+        table.column("data_group_hash").to_numpy(zero_copy_only=False).astype(str)
+        if "data_group_hash" in columns
+        else np.zeros(len(check), dtype=str)
+    )
+    day = pc.cast(table.column("time_period"), "date32").to_numpy(zero_copy_only=False).astype("datetime64[D]")
+    value = pc.cast(table.column("actual_value"), "float64").to_numpy(zero_copy_only=False)
+
+    keys, series_idx = np.unique(np.char.add(np.char.add(check, "/"), group), return_inverse=True)
+    days = np.arange(day.min(), day.max() + 1)
+    matrix = np.full((len(keys), len(days)), np.nan)
+    matrix[series_idx, (day - days[0]).astype(np.int64)] = value
+    return matrix, list(keys), days
+
+
+def synthetic_readouts(series: int, days: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    level = rng.uniform(100, 100_000, size=(series, 1))
+    matrix = level * (1 + 0.03 * rng.standard_normal((series, days)))
+    # a few spikes and drops, and days without readouts
+    matrix[rng.random((series, days)) < 0.005] *= 3
+    matrix[rng.random((series, days)) < 0.02] = np.nan
+    return matrix
+
+
+def per_point(module, matrix: np.ndarray, params: dict, window: int, min_periods: int) -> np.ndarray:
+    """DQOps-style evaluation: one evaluate_rule call per series per day."""
+    passed = np.full(matrix.shape, np.nan)
+    time_window = SimpleNamespace(prediction_time_window=window, min_periods_with_readouts=min_periods)
+    parameters = SimpleNamespace(**params)
+    for s in range(matrix.shape[0]):
+        for t in range(matrix.shape[1]):
+            if np.isnan(matrix[s, t]):
+                continue
+            history = matrix[s, max(0, t - window):t]
+            previous = [SimpleNamespace(sensor_readout=float(v)) for v in history if not np.isnan(v)]
+            result = module.evaluate_rule(
+                SimpleNamespace(
+                    actual_value=float(matrix[s, t]),
+                    parameters=parameters,
+                    previous_readouts=previous,
+                    time_window=time_window,
+                )
+            )
+            if result.passed is not None:
+                passed[s, t] = result.passed
+    return passed
+
+
+def replay(matrix: np.ndarray, compare: bool = False, sample: int = 20) -> dict:
+    logger.info(f"replaying {matrix.shape[0]} series x {matrix.shape[1]} days ({np.count_nonzero(~np.isnan(matrix))} readouts)")
+    report = {}
+    for name, (params, window, min_periods) in RULES.items():
+        module = load_rule(name)
+        tick = time.perf_counter()
+        result = module.evaluate_series(matrix, **params, window=window, min_periods=min_periods)
+        vectorized_s = time.perf_counter() - tick
+        failed = int(np.nansum(result["passed"] == 0))
+        evaluated = int(np.count_nonzero(~np.isnan(result["passed"])))
+        report[name] = {"evaluated": evaluated, "failed": failed, "vectorized_s": vectorized_s}
+        logger.info(f"{name}: {evaluated} results, {failed} failed, {vectorized_s:.3f}s vectorized")
+
+        if compare:
+            rows = matrix[:sample]
+            tick = time.perf_counter()
+            expected = per_point(module, rows, params, window, min_periods)
+            per_point_s = (time.perf_counter() - tick) * matrix.shape[0] / len(rows)
+            same = np.array_equal(np.nan_to_num(expected, nan=-1), np.nan_to_num(result["passed"][:sample], nan=-1))
+            report[name].update({"per_point_s": per_point_s, "matches": same})
+            logger.info(
+                f"  per-point (extrapolated from {len(rows)} series): {per_point_s:.1f}s, "
+                f"{per_point_s / vectorized_s:.0f}x slower, results {'match' if same else 'DIFFER'}"
+            )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay sensor readouts through the vectorized custom rules")
+    parser.add_argument("--readouts", help="glob of DQOps sensor readout parquet files")
+    parser.add_argument("--synthetic", nargs=2, type=int, metavar=("SERIES", "DAYS"))
+    parser.add_argument("--compare", action="store_true", help="also run per-readout evaluation on a sample")
+    parser.add_argument("--sample", type=int, default=20, help="series used for --compare")
+    args = parser.parse_args()
+
+    if args.readouts:
+        matrix, _, _ = load_readouts(args.readouts)
+    else:
+        matrix = synthetic_readouts(*(args.synthetic or (500, 180)))
+    replay(matrix, args.compare, args.sample)